@@ -0,0 +1,101 @@
+import json
+
+from storage import atomic_write_json, comparable_signature
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+class InventoryAggregates:
+    """
+    Running dashboard totals over the product catalog.
+
+    Product applies the delta of every add/update/delete through add() and
+    remove(), so reading the totals never touches the catalog. The totals are
+    saved next to the data file together with the storage signature they
+    belong to; a full recompute is only needed when that signature no longer
+    matches (cold load after an outside change).
+    """
+
+    def __init__(self):
+        self.sku_count = 0
+        self.total_units = 0
+        self.total_value = 0.0
+        self.out_of_stock = 0
+        # category -> {"skus": n, "units": n, "value": x, "out_of_stock": n}
+        self.categories = {}
+
+    @classmethod
+    def recompute(cls, products):
+        aggregates = cls()
+        for product in products:
+            aggregates.add(product)
+        return aggregates
+
+    def add(self, product, sign=1):
+        """Adds a product to the totals (sign=-1 takes it out again)."""
+        stock = _number(product.get("stock_quantity"))
+        value = stock * _number(product.get("price"))
+        out_of_stock = 1 if stock <= 0 else 0
+
+        self.sku_count += sign
+        self.total_units += sign * stock
+        self.total_value += sign * value
+        self.out_of_stock += sign * out_of_stock
+
+        category = self.categories.setdefault(
+            str(product.get("category")), {"skus": 0, "units": 0, "value": 0.0, "out_of_stock": 0}
+        )
+        category["skus"] += sign
+        category["units"] += sign * stock
+        category["value"] += sign * value
+        category["out_of_stock"] += sign * out_of_stock
+        if category["skus"] == 0:
+            del self.categories[str(product.get("category"))]
+
+    def remove(self, product):
+        self.add(product, sign=-1)
+
+    def to_dict(self):
+        return {
+            "sku_count": self.sku_count,
+            "total_units": self.total_units,
+            "total_value": self.total_value,
+            "out_of_stock": self.out_of_stock,
+            "categories": self.categories,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregates = cls()
+        aggregates.sku_count = data["sku_count"]
+        aggregates.total_units = data["total_units"]
+        aggregates.total_value = data["total_value"]
+        aggregates.out_of_stock = data["out_of_stock"]
+        aggregates.categories = data["categories"]
+        return aggregates
+
+    def save(self, path, signature):
+        atomic_write_json(path, {"signature": signature, "aggregates": self.to_dict()}, indent=None)
+
+    @classmethod
+    def load(cls, path, signature, products):
+        """
+        Returns the saved totals if they belong to signature, otherwise recomputes them.
+
+        products is a callable returning the records; it is only called for a
+        recompute, so a fresh save costs no read of the data file.
+        """
+        try:
+            with open(path, "r") as file:
+                saved = json.load(file)
+            if saved["signature"] == comparable_signature(signature):
+                return cls.from_dict(saved["aggregates"])
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        aggregates = cls.recompute(products())
+        if signature is not None:
+            # Saved right away, so the next start does not scan the products again
+            aggregates.save(path, signature)
+        return aggregates
@@ -0,0 +1,355 @@
+"""
+Headless JSON-over-HTTP API on the inventory core, for scanners, POS terminals and scripts.
+
+Usage (from this directory):
+    python api.py [--host 127.0.0.1] [--port 8502]
+
+The API serves the same data files as the Streamlit app, through the same
+shared managers (repository.get_manager), and can run next to it: writes of
+either process reach the other through the change bus. Requests are read by
+an asyncio server; the manager calls, which block on locks and file I/O, run
+on a pool of INVENTORY_API_WORKERS threads.
+
+Endpoints (JSON bodies and responses):
+    GET  /health
+    POST /login            {"username", "password"} -> {"token", "role"}
+    GET  /products/<id>
+    POST /products/get     {"ids": [...]} -> {"products": [...], "missing": [...]}
+    POST /users/get        same for users (without password hashes)
+    POST /roles/get        same for roles
+    POST /stock/adjust     {"movements": [{"product_id", "kind", "quantity"}, ...], "location"}
+                           -> {"products": [{"product_id", "stock_quantity"}, ...]}
+    POST /stock/transfer   {"product_id", "quantity", "from", "to"}
+
+Every endpoint but /health and /login needs an "Authorization: Bearer <token>"
+header with a token from /login. Calls are checked against the permissions of
+the token's role, like in the app. Errors are {"error": message} with status
+400 (bad request), 401 (no or expired token), 403 (permission), 404, 409
+(stock would go negative, or a conflicting change) or 413 (body too large).
+"""
+import argparse
+import asyncio
+import functools
+import http.client
+import json
+import os
+import secrets
+import threading
+import time
+import traceback
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from product import Product
+from user import User
+from role_permission import RolePermission
+from repository import ConflictError, get_manager
+from permissions import PermissionDenied, acting_as, check_permission
+from stock_ledger import MOVEMENT_KINDS
+from product_record import to_json_default
+from instrumentation import metrics, timed
+
+# Threads running manager calls; requests beyond this wait for a free one
+API_WORKERS = int(os.environ.get("INVENTORY_API_WORKERS", "8"))
+# Seconds a login token stays valid
+TOKEN_TTL = float(os.environ.get("INVENTORY_API_TOKEN_TTL", "28800"))
+# Largest request body accepted, in bytes
+MAX_BODY = 1 << 20
+# IDs per multi-get and movements per stock adjustment
+MAX_BATCH = 10000
+
+
+class ApiError(Exception):
+    """Ends a request with the given HTTP status and error message."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _batch(payload, field):
+    values = payload.get(field)
+    if not isinstance(values, list):
+        raise ApiError(400, f"'{field}' must be a list")
+    if len(values) > MAX_BATCH:
+        raise ApiError(400, f"At most {MAX_BATCH} entries per request")
+    return values
+
+
+def _without_password(user):
+    return {field: value for field, value in user.items() if field != "password"}
+
+
+class InventoryApi:
+    """
+    The request handlers and the asyncio HTTP/1.1 server in front of them.
+
+    Keep-alive connections are supported, so a terminal can send its requests
+    over one connection. Each handler runs on the worker pool inside
+    acting_as(<mask of the caller's role>).
+    """
+
+    def __init__(self, workers=API_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+        # token -> (role, expiry as time.monotonic())
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        # (method, path) -> (handler, needs a token)
+        self.routes = {
+            ("GET", "/health"): (self.health, False),
+            ("POST", "/login"): (self.login, False),
+            ("POST", "/products/get"): (self.get_products, True),
+            ("POST", "/users/get"): (self.get_users, True),
+            ("POST", "/roles/get"): (self.get_roles, True),
+            ("POST", "/stock/adjust"): (self.adjust_stock, True),
+            ("POST", "/stock/transfer"): (self.transfer_stock, True),
+        }
+
+    # Handlers; they run on the worker pool and return the response payload
+
+    def health(self, payload):
+        return {"status": "ok"}
+
+    def login(self, payload):
+        role = get_manager(User).verify_login(payload.get("username"), payload.get("password"))
+        if not role:
+            raise ApiError(401, "Invalid credentials")
+        token = secrets.token_urlsafe(32)
+        with self.sessions_lock:
+            self.sessions[token] = (role, time.monotonic() + TOKEN_TTL)
+        return {"token": token, "role": role}
+
+    def get_product(self, payload, product_id):
+        check_permission("view_product")
+        product = get_manager(Product).get_product_by_id(product_id)
+        if product is None:
+            raise ApiError(404, f"Product '{product_id}' not found")
+        return product
+
+    def _multi_get(self, payload, lookup):
+        found = []
+        missing = []
+        for record_id in _batch(payload, "ids"):
+            record = lookup(record_id)
+            if record is None:
+                missing.append(record_id)
+            else:
+                found.append(record)
+        return found, missing
+
+    def get_products(self, payload):
+        check_permission("view_product")
+        products, missing = self._multi_get(payload, get_manager(Product).get_product_by_id)
+        return {"products": products, "missing": missing}
+
+    def get_users(self, payload):
+        check_permission("view_user")
+        users, missing = self._multi_get(payload, get_manager(User).get_user_by_id)
+        return {"users": [_without_password(user) for user in users], "missing": missing}
+
+    def get_roles(self, payload):
+        check_permission("view_roles")
+        roles, missing = self._multi_get(payload, get_manager(RolePermission).get_role_by_id)
+        return {"roles": roles, "missing": missing}
+
+    def adjust_stock(self, payload):
+        movements = []
+        for movement in _batch(payload, "movements"):
+            kind = movement.get("kind", "adjustment")
+            quantity = movement.get("quantity")
+            if kind not in MOVEMENT_KINDS:
+                raise ApiError(400, f"Unknown movement kind '{kind}'")
+            if not isinstance(quantity, int) or isinstance(quantity, bool):
+                raise ApiError(400, "Quantities must be integers")
+            movements.append((movement.get("product_id"), kind, quantity))
+        product_manager = get_manager(Product)
+        # One ledger append and one data file write for the whole batch
+        if not product_manager.record_movements(movements, payload.get("location")):
+            raise ApiError(409, "Unknown product, or stock would go below 0; nothing was booked")
+        products = []
+        for product_id in dict.fromkeys(product_id for product_id, _, _ in movements):
+            product = product_manager.get_product_by_id(product_id)
+            products.append({"product_id": product["product_id"], "stock_quantity": product.get("stock_quantity")})
+        return {"products": products}
+
+    def transfer_stock(self, payload):
+        quantity = payload.get("quantity")
+        if not isinstance(quantity, int) or isinstance(quantity, bool):
+            raise ApiError(400, "'quantity' must be an integer")
+        if not get_manager(Product).transfer_stock(payload.get("product_id"), quantity, payload.get("from"), payload.get("to")):
+            raise ApiError(409, "Unknown product, or not enough stock at the source location")
+        return {"transferred": quantity}
+
+    # Dispatch
+
+    def _role_for(self, headers):
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        with self.sessions_lock:
+            role, expires = self.sessions.get(token, (None, 0)) if scheme.lower() == "bearer" else (None, 0)
+            if expires and expires < time.monotonic():
+                del self.sessions[token]
+                role = None
+        if role is None:
+            raise ApiError(401, "Log in first (POST /login) and send 'Authorization: Bearer <token>'")
+        return role
+
+    def _call(self, role, handler, payload, args):
+        # Public endpoints act with no permissions at all, never as trusted code
+        mask = get_manager(RolePermission).mask_for(role) if role is not None else 0
+        with acting_as(mask):
+            return handler(payload, *args)
+
+    async def dispatch(self, method, target, headers, body):
+        """Runs one request; returns (HTTP status, response payload)."""
+        path, _, _ = target.partition("?")
+        route = self.routes.get((method, path))
+        args = ()
+        if route is None and method == "GET" and path.startswith("/products/"):
+            route, args = (self.get_product, True), (urllib.parse.unquote(path[len("/products/"):]),)
+        if route is None:
+            return 404, {"error": f"No endpoint {method} {path}"}
+        handler, needs_token = route
+        try:
+            role = self._role_for(headers) if needs_token else None
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                raise ApiError(400, "The body is not valid JSON")
+            if not isinstance(payload, dict):
+                raise ApiError(400, "The body must be a JSON object")
+            with timed(f"api.{handler.__name__}"):
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.pool, functools.partial(self._call, role, handler, payload, args)
+                )
+            return 200, result
+        except ApiError as error:
+            return error.status, {"error": str(error)}
+        except PermissionDenied as error:
+            return 403, {"error": str(error)}
+        except ConflictError as error:
+            return 409, {"error": str(error)}
+        except (ValueError, TypeError, KeyError) as error:
+            return 400, {"error": str(error)}
+        except Exception:
+            traceback.print_exc()
+            metrics.count("api.failed")
+            return 500, {"error": "Internal error"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request"}, False)
+                    break
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"error": f"Bodies are limited to {MAX_BODY} bytes"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self.dispatch(method, target, headers, body)
+                metrics.count(f"api.status_{status}")
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, default=to_json_default).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {http.client.responses.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8502, started=None):
+        """Serves until cancelled; started(port) is called once the socket listens."""
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        if started is not None:
+            started(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    def start_in_thread(self, host="127.0.0.1", port=0):
+        """
+        Runs the server on a daemon thread, e.g. for tests and benchmarks.
+
+        Returns:
+            int: The port it listens on (a free one when port is 0).
+        """
+        ready = threading.Event()
+        ports = []
+
+        def started(bound_port):
+            ports.append(bound_port)
+            ready.set()
+
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(host, port, started),), name="api-server", daemon=True)
+        thread.start()
+        ready.wait()
+        return ports[0]
+
+
+class ApiClient:
+    """
+    Minimal blocking client over one keep-alive connection.
+
+    Example:
+        client = ApiClient("127.0.0.1", 8502)
+        client.login("admin", "admin")
+        client.call("POST", "/products/get", {"ids": [1, 2, 3]})
+    """
+
+    def __init__(self, host="127.0.0.1", port=8502, timeout=30):
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.token = None
+
+    def login(self, username, password):
+        self.token = self.call("POST", "/login", {"username": username, "password": password})[1]["token"]
+
+    def call(self, method, path, payload=None):
+        """Returns (HTTP status, decoded JSON response)."""
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        body = json.dumps(payload) if payload is not None else None
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inventory management JSON API")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=8502, help="port to listen on")
+    args = parser.parse_args()
+    print(f"Serving the inventory API on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(InventoryApi().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Generates synthetic products.json, users.json and roles.json for benchmarks.
+
+Usage (from the inventory_management_system directory):
+    python benchmarks/generate_data.py <rows> <output directory> [seed]
+
+Writes <output directory>/data/{products,users,roles}.json in the same format
+as the bundled data files, so the app can be started from <output directory>.
+Products and users get <rows> records each, roles one per 100 rows (at least
+the three bundled roles). All users share the password "password".
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import atomic_write_json
+from passwords import hash_password
+from permissions import PERMISSIONS
+
+CATEGORIES = [
+    "Electronics", "Furniture", "Garden", "Kitchen", "Office", "Toys",
+    "Sports", "Books", "Clothing", "Accessories", "Tools", "Health",
+]
+NOUNS = [
+    "Chair", "Lamp", "Desk", "Cable", "Mug", "Kettle", "Shelf", "Drill",
+    "Ball", "Notebook", "Jacket", "Charger", "Monitor", "Pillow", "Hose",
+]
+ADJECTIVES = ["Basic", "Deluxe", "Compact", "Pro", "Mini", "Classic", "Smart", "Eco"]
+
+
+def generate_products(rows, rng):
+    return [
+        {
+            "product_id": product_id,
+            "name": f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {product_id}",
+            "category": rng.choice(CATEGORIES),
+            "price": round(rng.uniform(1, 500), 2),
+            # Skewed towards low stock so the low-stock views have work to do
+            "stock_quantity": int(rng.expovariate(1 / 60)),
+        }
+        for product_id in range(rows)
+    ]
+
+
+def generate_roles(rows):
+    roles = [
+        {"role_id": 1, "name": "admin", "permission_level": list(PERMISSIONS)},
+        {"role_id": 2, "name": "user", "permission_level": ["view_product"]},
+        {"role_id": 3, "name": "accountant", "permission_level": ["view_user", "view_roles", "view_product"]},
+    ]
+    for role_id in range(4, max(rows // 100, 3) + 1):
+        roles.append({
+            "role_id": role_id,
+            "name": f"role_{role_id}",
+            "permission_level": PERMISSIONS[:role_id % len(PERMISSIONS) + 1],
+        })
+    return roles
+
+
+def generate_users(rows, roles, rng):
+    # One hash for everyone: hashing a million passwords would dominate the run
+    password = hash_password("password")
+    names = [role["name"] for role in roles]
+    return [
+        {"user_id": user_id, "username": f"user{user_id}", "password": password, "role": rng.choice(names)}
+        for user_id in range(1, rows + 1)
+    ]
+
+
+def generate(directory, rows, seed=0):
+    """
+    Writes the three data files for rows records into directory/data.
+
+    Returns:
+        str: The data directory.
+    """
+    rng = random.Random(seed)
+    data_dir = os.path.join(directory, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    roles = generate_roles(rows)
+    atomic_write_json(os.path.join(data_dir, "products.json"), generate_products(rows, rng))
+    atomic_write_json(os.path.join(data_dir, "users.json"), generate_users(rows, roles, rng))
+    atomic_write_json(os.path.join(data_dir, "roles.json"), roles)
+    return data_dir
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    rows, directory = int(sys.argv[1]), sys.argv[2]
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    data_dir = generate(directory, rows, seed)
+    print(f"Wrote {rows} products and users to {data_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Times the manager classes and a headless render of the product page on
+synthetic data, and writes the results as JSON.
+
+Usage (from the inventory_management_system directory):
+    python benchmarks/run_benchmarks.py [--sizes 1000,100000,1000000] [--repeat 20]
+                                        [--output results.json] [--compare previous.json]
+
+For every size, fresh data is generated in a temporary directory (see
+generate_data.py). Each operation is run --repeat times; write operations
+persist like they do in the app, so their cost grows with the catalog when
+INVENTORY_STORAGE=json. The report lists the median, p95, min and mean time of
+every operation in milliseconds, and the memory the loaded product records
+take as ProductRecords and as plain dicts. --compare prints the ratio of each
+median to the one in an earlier report.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from benchmarks.generate_data import generate
+from product import Product
+from user import User
+from role_permission import RolePermission
+from repository import clear_managers
+from storage import STORAGE_MODE, JsonStorage
+from product_record import ProductRecord
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+
+def summarize(timings):
+    """Milliseconds statistics of a list of durations in seconds."""
+    timings = sorted(timings)
+    return {
+        "n": len(timings),
+        "median_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "min_ms": timings[0] * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+    }
+
+
+def measure(function, arguments):
+    """Calls function once per entry of arguments and returns the durations."""
+    timings = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def measure_memory(products_file):
+    """
+    Bytes held by the loaded product records, as ProductRecords (what Product
+    keeps) and as the plain dicts the JSON parser returns.
+    """
+    results = {}
+    for name, record_type in (("records", ProductRecord), ("dict_records", None)):
+        tracemalloc.start()
+        records = JsonStorage(products_file, "product_id", record_type).load()
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name] = {"mb": retained / 1e6, "bytes_per_product": retained / max(len(records), 1)}
+        del records
+    results["reduction"] = 1 - results["records"]["mb"] / results["dict_records"]["mb"]
+    return results
+
+
+def bench_managers(data_dir, rows, repeat, rng):
+    results = {}
+    products_file = os.path.join(data_dir, "products.json")
+
+    start = time.perf_counter()
+    product_manager = Product(products_file)
+    results["product_load"] = summarize([time.perf_counter() - start])
+    start = time.perf_counter()
+    User(os.path.join(data_dir, "users.json"))
+    results["user_load"] = summarize([time.perf_counter() - start])
+    start = time.perf_counter()
+    RolePermission(os.path.join(data_dir, "roles.json"))
+    results["role_load"] = summarize([time.perf_counter() - start])
+
+    ids = [(rng.randrange(rows),) for _ in range(max(repeat, 1000))]
+    # Before the catalog is materialised, lookups go through the on-disk offset index
+    results["get_product_by_id_cold"] = summarize(measure(product_manager.get_product_by_id, ids))
+    start = time.perf_counter()
+    product_manager.products
+    results["product_materialise"] = summarize([time.perf_counter() - start])
+    # The first load parsed the JSON and wrote the binary snapshot; later starts read that
+    start = time.perf_counter()
+    Product(products_file).products
+    results["product_materialise_snapshot"] = summarize([time.perf_counter() - start])
+    start = time.perf_counter()
+    User(os.path.join(data_dir, "users.json"))
+    results["user_load_snapshot"] = summarize([time.perf_counter() - start])
+    results["get_product_by_id"] = summarize(measure(product_manager.get_product_by_id, ids))
+
+    # The first search builds the trigram index; time it on its own
+    start = time.perf_counter()
+    product_manager.search_products("lamp")
+    results["search_products_first"] = summarize([time.perf_counter() - start])
+    queries = [("lamp",), ("Pro Desk",), ("123",), ("zzz",), ("Chair 9",)] * max(repeat // 5, 1)
+    results["search_products"] = summarize(measure(product_manager.search_products, queries))
+
+    start = time.perf_counter()
+    product_manager.filter_products(10)
+    results["filter_products_first"] = summarize([time.perf_counter() - start])
+    thresholds = [(threshold,) for threshold in (0, 5, 10, 50)] * max(repeat // 4, 1)
+    results["filter_products"] = summarize(measure(product_manager.filter_products, thresholds))
+
+    new_ids = [f"bench-{number}" for number in range(repeat)]
+    results["add_product"] = summarize(measure(product_manager.add_product, [
+        ({"product_id": product_id, "name": f"Bench Item {product_id}", "category": "Bench",
+          "price": 9.99, "stock_quantity": 25},)
+        for product_id in new_ids
+    ]))
+    results["update_product"] = summarize(measure(product_manager.update_product, [
+        (product_id, {"product_id": product_id, "name": f"Bench Item {product_id}", "category": "Bench",
+                      "price": 19.99, "stock_quantity": 30})
+        for product_id in new_ids
+    ]))
+    results["delete_product"] = summarize(measure(product_manager.delete_product, [
+        (product_id,) for product_id in new_ids
+    ]))
+    return results
+
+
+def bench_render(directory, repeat):
+    """Renders the product management page headlessly: first (cold) run and warm reruns."""
+    from streamlit.testing.v1 import AppTest
+
+    clear_managers()
+    previous_directory = os.getcwd()
+    # The app opens data/*.json relative to the working directory
+    os.chdir(directory)
+    try:
+        app = AppTest.from_file(os.path.join(APP_DIR, "main.py"), default_timeout=900)
+        app.session_state["logged_in"] = True
+        app.session_state["role"] = "admin"
+        app.session_state["page"] = "product_management"
+        start = time.perf_counter()
+        app.run()
+        cold = time.perf_counter() - start
+        if app.exception:
+            raise RuntimeError(f"Rendering the product page failed: {app.exception}")
+        warm = []
+        for _ in range(max(repeat // 4, 3)):
+            start = time.perf_counter()
+            app.run()
+            warm.append(time.perf_counter() - start)
+    finally:
+        os.chdir(previous_directory)
+        clear_managers()
+    return {"render_product_management_cold": summarize([cold]), "render_product_management": summarize(warm)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, previous):
+    """Prints median ratios new / previous for every operation present in both reports."""
+    for size, operations in report["results"].items():
+        for operation, stats in operations.items():
+            before = previous.get("results", {}).get(size, {}).get(operation)
+            if before and before["median_ms"]:
+                ratio = stats["median_ms"] / before["median_ms"]
+                flag = "  <-- slower" if ratio > 1.2 else ""
+                print(f"{size:>8} {operation:<34} {before['median_ms']:>10.3f} -> {stats['median_ms']:>10.3f} ms  x{ratio:.2f}{flag}")
+    for size, memory in report.get("memory", {}).items():
+        before = previous.get("memory", {}).get(size)
+        if before:
+            print(f"{size:>8} {'product records memory':<34} {before['records']['mb']:>10.1f} -> {memory['records']['mb']:>10.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inventory management benchmarks")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma separated row counts")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per operation")
+    parser.add_argument("--output", default=None, help="report file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="earlier report to compare against")
+    parser.add_argument("--no-render", action="store_true", help="skip the AppTest page render")
+    args = parser.parse_args()
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "storage": STORAGE_MODE,
+        "repeat": args.repeat,
+        "results": {},
+        "memory": {},
+    }
+    for rows in (int(size) for size in args.sizes.split(",")):
+        directory = tempfile.mkdtemp(prefix=f"inventory-bench-{rows}-")
+        try:
+            print(f"Generating {rows} rows...", flush=True)
+            data_dir = generate(directory, rows)
+            results = bench_managers(data_dir, rows, args.repeat, random.Random(rows))
+            if not args.no_render:
+                results.update(bench_render(directory, args.repeat))
+            memory = measure_memory(os.path.join(data_dir, "products.json"))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        report["results"][str(rows)] = results
+        report["memory"][str(rows)] = memory
+        for operation, stats in results.items():
+            print(f"{rows:>8} {operation:<34} median {stats['median_ms']:>10.3f} ms  p95 {stats['p95_ms']:>10.3f} ms")
+        print(
+            f"{rows:>8} {'product records memory':<34} {memory['records']['mb']:>10.1f} MB "
+            f"({memory['records']['bytes_per_product']:.0f} B/product, "
+            f"{memory['reduction']:.0%} less than dicts at {memory['dict_records']['bytes_per_product']:.0f} B/product)"
+        )
+
+    output = args.output or os.path.join(
+        APP_DIR, "benchmarks", "results", datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=4)
+    print(f"Report written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            compare(report, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
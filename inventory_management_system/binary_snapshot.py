@@ -0,0 +1,65 @@
+import os
+import pickle
+import tempfile
+
+from instrumentation import metrics
+
+# Set INVENTORY_BINARY_SNAPSHOT=0 to always parse the JSON data files
+BINARY_SNAPSHOTS = os.environ.get("INVENTORY_BINARY_SNAPSHOT", "1") != "0"
+
+# Written first in every snapshot; files with another header are ignored
+FORMAT = ("inventory-snapshot", 1)
+
+
+class _DataUnpickler(pickle.Unpickler):
+    """Unpickler that only builds plain data (lists, dicts, strings, numbers...), never arbitrary classes."""
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"binary snapshots hold plain data only, found {module}.{name}")
+
+
+def write_snapshot(path, signature, records):
+    """
+    Writes records as a pickle (protocol 5) next to the JSON file they mirror.
+
+    The snapshot is a cache of the JSON file: it is tagged with the JSON file's
+    signature and ignored as soon as that file changes, so it is not fsynced.
+
+    Parameters:
+        path (str): Snapshot file, e.g. "data/products.json.pickle".
+        signature: file_signature() of the JSON file the records were read from or written to.
+        records (list): Plain dict records.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".pickle")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump((FORMAT, signature, records), file, protocol=5)
+            metrics.observe("storage.bytes_written", file.tell())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_snapshot(path, signature):
+    """
+    Returns the records of the snapshot at path if it was written for signature.
+
+    Returns:
+        list or None: The records, or None if the snapshot is missing, stale or unreadable.
+    """
+    try:
+        with open(path, "rb") as file:
+            header, saved_signature, records = _DataUnpickler(file).load()
+            size = file.tell()
+    except FileNotFoundError:
+        return None
+    except (pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        # Torn or foreign file: the JSON data file is the source of truth
+        return None
+    if header != FORMAT or saved_signature != signature:
+        return None
+    metrics.observe("storage.bytes_read", size)
+    return records
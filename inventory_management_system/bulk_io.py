@@ -0,0 +1,159 @@
+import csv
+import json
+
+# Import schemas: field -> (converter, required)
+PRODUCT_SCHEMA = {
+    "product_id": ("id", True),
+    "name": ("str", True),
+    "category": ("str", True),
+    "price": ("float", True),
+    "stock_quantity": ("int", True),
+    "reorder_level": ("int", False),
+}
+USER_SCHEMA = {
+    "user_id": ("id", True),
+    "username": ("str", True),
+    "role": ("str", True),
+    "password": ("str", False),
+}
+
+# Columns written by the exports; passwords are never exported
+PRODUCT_EXPORT_FIELDS = ["product_id", "name", "category", "price", "stock_quantity", "reorder_level"]
+USER_EXPORT_FIELDS = ["user_id", "username", "role"]
+
+
+def _convert(value, converter):
+    if converter == "int":
+        if isinstance(value, bool):
+            raise ValueError
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError
+        return int(number)
+    if converter == "float":
+        if isinstance(value, bool):
+            raise ValueError
+        return float(value)
+    if isinstance(value, str):
+        return value.strip()
+    # JSONL IDs may be numbers; keep them as they are
+    return value if converter == "id" else str(value)
+
+
+def read_rows(file, file_format):
+    """
+    Yields (line number, row dict) from a CSV (with header) or JSONL text stream.
+
+    Rows are parsed one at a time, so the input is never held in memory.
+    A JSONL line that is not a JSON object is yielded with row=None.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def coerce_row(row, schema):
+    """
+    Converts a raw row to a record following schema.
+
+    Returns:
+        tuple: (record, None) on success or (None, error message).
+    """
+    if row is None:
+        return None, "Not a valid JSON object."
+    record = {}
+    for field, (converter, required) in schema.items():
+        value = row.get(field)
+        if value is None or value == "":
+            if required:
+                # Left empty so validate_fields reports it with its usual message
+                record[field] = value
+            continue
+        try:
+            record[field] = _convert(value, converter)
+        except (TypeError, ValueError):
+            return None, f"{field.replace('_', ' ').capitalize()} must be a number."
+    return record, None
+
+
+def import_records(file, file_format, schema, validate, upsert, progress=None, progress_every=1000):
+    """
+    Reads and validates every row of file, then upserts the valid ones in one call.
+
+    Nothing reaches the manager before the whole file was read, so a file
+    that turns out to be unreadable halfway (not UTF-8, broken CSV quoting)
+    imports nothing. Reading takes no lock; only upsert holds the manager's
+    write transaction, while it applies and saves the rows.
+
+    Parameters:
+        file: Text stream with CSV or JSONL content.
+        file_format (str): "csv" or "jsonl".
+        schema (dict): PRODUCT_SCHEMA or USER_SCHEMA.
+        validate (callable): Returns an error message for a record, or None
+            (InventorySystem.validate_fields).
+        upsert (callable): Manager bulk upsert that also saves the data
+            (upsert_products, upsert_users); returns (inserted, updated).
+        progress (callable, optional): Called with the number of rows read every progress_every rows.
+
+    Returns:
+        dict: {"rows", "inserted", "updated", "errors": [(line number, message), ...],
+        "failed": why the file could not be read (then nothing was imported), or None}
+    """
+    report = {"rows": 0, "inserted": 0, "updated": 0, "errors": [], "failed": None}
+    records = []
+    line_number = 0
+    try:
+        for line_number, row in read_rows(file, file_format):
+            report["rows"] += 1
+            record, error = coerce_row(row, schema)
+            if error is None:
+                error = validate(record)
+            if error:
+                report["errors"].append((line_number, error))
+            else:
+                records.append(record)
+            if progress and report["rows"] % progress_every == 0:
+                progress(report["rows"])
+    except UnicodeDecodeError:
+        report["failed"] = "The file is not UTF-8 encoded text."
+    except csv.Error as error:
+        report["failed"] = f"The file is not valid CSV: {error}."
+    if report["failed"]:
+        report["errors"].append((line_number + 1, report["failed"]))
+        return report
+
+    if records:
+        report["inserted"], report["updated"] = upsert(records)
+    return report
+
+
+def export_records(records, file, file_format, fields):
+    """
+    Writes records to a text stream as CSV or JSONL, one row at a time.
+
+    Parameters:
+        records (iterable): Records to export.
+        file: Writable text stream.
+        file_format (str): "csv" or "jsonl".
+        fields (list): Columns to write; other record keys are left out.
+    """
+    if file_format == "csv":
+        writer = csv.DictWriter(file, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+        return
+
+    for record in records:
+        file.write(json.dumps({field: record[field] for field in fields if field in record}) + "\n")
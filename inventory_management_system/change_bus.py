@@ -0,0 +1,223 @@
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+
+from instrumentation import metrics
+from product_record import to_json_default
+from storage import comparable_signature
+
+# Set INVENTORY_CHANGE_FEED=0 to stop writing and following the <data file>.changes feeds
+CHANGE_FEED = os.environ.get("INVENTORY_CHANGE_FEED", "1") != "0"
+# Seconds between two checks of the feed files for changes made by other processes
+POLL_INTERVAL = float(os.environ.get("INVENTORY_CHANGE_POLL", "1.0"))
+# A feed file larger than this is replaced by an empty one at the next write
+FEED_MAX_BYTES = 4 << 20
+
+_sources = itertools.count(1)
+
+
+def as_signature(value):
+    """Turns a signature that went through JSON (lists) back into the tuples file_signature() returns."""
+    if isinstance(value, list):
+        return tuple(as_signature(item) for item in value)
+    return value
+
+
+class FileFeed:
+    """
+    Append-only JSON-lines file of the change events of one data file.
+
+    Every process appends the events of its writes (under the data file's
+    lock) and reads the lines other processes appended since its last poll.
+    Events are notifications only: the data files stay the source of truth, so
+    the feed is never fsynced and is simply replaced by an empty file when it
+    grows past FEED_MAX_BYTES.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Only events written from now on are of interest
+        self.inode, self.offset = self._position()
+
+    def _position(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def append(self, event):
+        line = json.dumps(dict(event, pid=os.getpid()), separators=(",", ":"), default=to_json_default) + "\n"
+        inode, size = self._position()
+        if size > FEED_MAX_BYTES:
+            # A new inode tells readers to start over at the top of the new file
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".changes")
+            os.close(fd)
+            os.replace(temp_path, self.path)
+        with open(self.path, "a") as file:
+            file.write(line)
+        metrics.observe("change_bus.bytes_written", len(line))
+
+    def read_new(self):
+        """Returns the events other processes appended since the last call."""
+        inode, size = self._position()
+        if inode != self.inode:
+            # Created or replaced since the last poll
+            self.inode, self.offset = inode, 0
+        if size <= self.offset:
+            return []
+        with open(self.path, "rb") as file:
+            file.seek(self.offset)
+            data = file.read(size - self.offset)
+        # A line still being written is left for the next poll
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        events = []
+        for line in data[:end].splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("pid") != os.getpid():
+                events.append(event)
+        return events
+
+
+class ChangeBus:
+    """
+    Publish/subscribe feed of record-level changes, one topic per data file.
+
+    Writers publish an event per write: the changes as (op, key, record)
+    tuples, plus the data file's signature before ("base") and after
+    ("signature") the write. Subscribers in this process get it right away,
+    other processes through the topic's FileFeed, which is polled every
+    POLL_INTERVAL seconds. Both are delivered by one background thread, never
+    on the publisher's thread, which holds its manager's locks.
+
+    A subscriber that is exactly at "base" can apply the changes and move to
+    "signature" without reading the data files; one that is not (it missed an
+    event) lets its manager reload as before.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # topic -> list of weak references to subscriber callbacks
+        self.subscribers = {}
+        # topic -> FileFeed
+        self.feeds = {}
+        # Events published in this process, waiting for the delivery thread
+        self.local_events = deque()
+        self.thread = None
+
+    def subscribe(self, topic, callback):
+        """Registers a bound method for the events of topic; it is dropped when its object is garbage collected."""
+        with self.condition:
+            self.subscribers.setdefault(topic, []).append(weakref.WeakMethod(callback))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="change-bus", daemon=True)
+                self.thread.start()
+
+    def watch(self, topic, path):
+        """Follows (and writes) the file feed at path for topic."""
+        if not CHANGE_FEED:
+            return
+        with self.condition:
+            if topic not in self.feeds:
+                self.feeds[topic] = FileFeed(path)
+
+    def publish(self, topic, event):
+        """Appends event to the topic's file feed and queues it for the subscribers of this process."""
+        feed = self.feeds.get(topic)
+        if feed is not None:
+            feed.append(event)
+        metrics.count("change_bus.published")
+        with self.condition:
+            if self.subscribers.get(topic):
+                self.local_events.append((topic, event))
+                self.condition.notify()
+
+    def _deliver(self, topic, event):
+        with self.condition:
+            references = self.subscribers.get(topic, [])
+            # Drop the subscribers that were garbage collected
+            references[:] = [reference for reference in references if reference() is not None]
+            callbacks = [reference() for reference in references]
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(event)
+            except Exception:
+                traceback.print_exc()
+                metrics.count("change_bus.failed")
+
+    def _run(self):
+        next_poll = time.monotonic() + POLL_INTERVAL
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.local_events, max(next_poll - time.monotonic(), 0))
+                local_events = list(self.local_events)
+                self.local_events.clear()
+            for topic, event in local_events:
+                self._deliver(topic, event)
+            if time.monotonic() < next_poll:
+                continue
+            next_poll = time.monotonic() + POLL_INTERVAL
+            for topic, feed in list(self.feeds.items()):
+                try:
+                    events = feed.read_new()
+                except OSError:
+                    continue
+                for event in events:
+                    self._deliver(topic, event)
+
+
+# Shared by every manager of the process
+bus = ChangeBus()
+
+
+class ChangeFollower:
+    """
+    Connects a manager to the bus: publishes its writes and applies the writes of others.
+
+    The manager must provide apply_remote_changes(changes, signature), which patches
+    its in-memory records, indexes and totals with the changes and sets
+    storage.known_signature to signature.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.topic = os.path.abspath(manager.data_file)
+        # Tells our own events apart from those of other instances of this process
+        self.source = f"{os.getpid()}:{next(_sources)}"
+        bus.subscribe(self.topic, self.on_event)
+        bus.watch(self.topic, manager.data_file + ".changes")
+
+    def published(self, base, changes):
+        """Announces a write that took the data files from signature base to storage.known_signature."""
+        bus.publish(self.topic, {
+            "source": self.source,
+            "base": base,
+            "signature": self.manager.storage.known_signature,
+            # Copies: the live records may change again before the event is delivered
+            "changes": [[op, key, None if record is None else dict(record)] for op, key, record in changes],
+        })
+
+    def on_event(self, event):
+        if event["source"] == self.source:
+            return
+        manager = self.manager
+        with manager.lock:
+            if manager.writer.pending or comparable_signature(manager.storage.known_signature) != comparable_signature(event["base"]):
+                # We are not at the state the event starts from: the next access reloads as usual
+                metrics.count("change_bus.skipped")
+                return
+            manager.apply_remote_changes(event["changes"], as_signature(event["signature"]))
+        metrics.count("change_bus.applied")
@@ -0,0 +1,176 @@
+import functools
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Set INVENTORY_METRICS=0 to leave every method unwrapped
+METRICS_ENABLED = os.environ.get("INVENTORY_METRICS", "1") != "0"
+# Where the diagnostics page writes the Prometheus text dump
+METRICS_FILE = os.environ.get("INVENTORY_METRICS_FILE", "data/metrics.prom")
+# Samples kept per timer / observation; percentiles cover the most recent ones
+SAMPLE_SIZE = 2048
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Series:
+    """Count and sum of every sample, plus a window of the latest ones for percentiles."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {quantile: 0.0 for quantile in QUANTILES}
+        return {quantile: ordered[min(len(ordered) - 1, int(len(ordered) * quantile))] for quantile in QUANTILES}
+
+
+class Metrics:
+    """
+    Process-wide timers, counters and value observations.
+
+    Timers record durations in seconds (see timed / instrument_methods),
+    observations record any other per-call value such as bytes written by a
+    persist or widgets emitted by a page. Both keep count, sum and p50/p95/p99.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.observations = {}
+        self.counters = {}
+
+    def record_time(self, name, seconds):
+        with self.lock:
+            series = self.timers.get(name)
+            if series is None:
+                series = self.timers[name] = Series()
+            series.add(seconds)
+
+    def observe(self, name, value):
+        with self.lock:
+            series = self.observations.get(name)
+            if series is None:
+                series = self.observations[name] = Series()
+            series.add(value)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+            self.observations.clear()
+            self.counters.clear()
+
+    def rows(self, kind="timers"):
+        """Table rows for the diagnostics page: name, count, total and percentiles."""
+        with self.lock:
+            items = [(name, series.count, series.total, series.quantiles()) for name, series in getattr(self, kind).items()]
+        scale = 1000 if kind == "timers" else 1
+        return [
+            {
+                "name": name,
+                "count": count,
+                "total": total * scale,
+                "p50": quantiles[0.5] * scale,
+                "p95": quantiles[0.95] * scale,
+                "p99": quantiles[0.99] * scale,
+            }
+            for name, count, total, quantiles in sorted(items)
+        ]
+
+    def prometheus_text(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for metric, help_text, series_by_name in (
+                ("inventory_duration_seconds", "Duration of instrumented calls and page renders.", self.timers),
+                ("inventory_observation", "Per-call values such as bytes per persist or widgets per page.", self.observations),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} summary")
+                for name, series in sorted(series_by_name.items()):
+                    label = _label(name)
+                    for quantile, value in series.quantiles().items():
+                        lines.append(f'{metric}{{name="{label}",quantile="{quantile}"}} {value:.9g}')
+                    lines.append(f'{metric}_sum{{name="{label}"}} {series.total:.9g}')
+                    lines.append(f'{metric}_count{{name="{label}"}} {series.count}')
+            lines.append("# HELP inventory_events_total Counted events.")
+            lines.append("# TYPE inventory_events_total counter")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'inventory_events_total{{name="{_label(name)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=None):
+        """Writes prometheus_text() to path (default METRICS_FILE) atomically, e.g. for a node_exporter textfile collector."""
+        path = path or METRICS_FILE
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".prom")
+        with os.fdopen(fd, "w") as file:
+            file.write(self.prometheus_text())
+        os.replace(temp_path, path)
+        return path
+
+
+def _label(name):
+    return name.replace("\\", "\\\\").replace('"', '\\"')
+
+
+# Shared by every session of the server process
+metrics = Metrics()
+# Per-thread count of UI elements emitted by the running script (see main.install_element_counter)
+element_counter = threading.local()
+
+
+@contextmanager
+def timed(name):
+    """Times the block under name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record_time(name, time.perf_counter() - start)
+
+
+def instrument_methods(prefix, predicate=None):
+    """
+    Class decorator timing every public method (or those accepted by predicate)
+    as "<prefix>.<method name>". Properties and private methods are left alone.
+    """
+
+    def decorator(cls):
+        if not METRICS_ENABLED:
+            return cls
+        for attribute, value in list(vars(cls).items()):
+            if attribute.startswith("_") or not callable(value) or isinstance(value, (staticmethod, classmethod, type)):
+                continue
+            if predicate is not None and not predicate(attribute):
+                continue
+            setattr(cls, attribute, _timed_method(f"{prefix}.{attribute}", value))
+        return cls
+
+    return decorator
+
+
+def _timed_method(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.record_time(name, time.perf_counter() - start)
+    return wrapper
@@ -1,14 +1,117 @@
 from product import Product
 from user import User
 from role_permission import RolePermission
+from repository import ConflictError, get_manager
+from record_index import normalize_id
+from permissions import acting_as, current_mask, has_permission, parse_permissions
+import bulk_io
+from stock_ledger import MOVEMENT_KINDS
+from scan_session import ScanSession
+from instrumentation import instrument_methods, metrics, timed
+import functools
+import io
+import math
 import streamlit as st
 import pandas as pd
 
+# Page sizes offered by the paginated management tables
+PAGE_SIZES = [25, 50, 100, 250]
+
+def rerun_scoped(streamlit_decorator):
+    """
+    Turns an InventorySystem method into a fragment or dialog
+    (rerun_scoped(st.fragment), rerun_scoped(st.dialog("Title"))).
+
+    Widgets inside it rerun only the method, not main(), so the wrapper sets
+    up what main() does for a full rerun: it acts with the permissions of
+    the user the page was built for, picks up changes other processes made
+    to the data files, and times the partial rerun.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with acting_as(self.mask), timed(f"fragment.{method.__name__}"):
+                self.load_managers()
+                return method(self, *args, **kwargs)
+        return streamlit_decorator(wrapper)
+    return decorator
+
+@instrument_methods("page", lambda name: name.startswith("display_"))
 class InventorySystem:
     def __init__(self):
-        self.product_manager = Product()
-        self.user_manager = User()
-        self.role_permission_manager = RolePermission()
+        self.load_managers()
+        # Permissions of the logged-in user, restored on fragment reruns (see rerun_scoped)
+        self.mask = current_mask()
+
+    def load_managers(self):
+        """Fetches the shared managers; get_manager() reloads any whose files changed since."""
+        # Managers are shared per process and only reload when their file changes
+        self.product_manager = get_manager(Product)
+        self.user_manager = get_manager(User)
+        self.role_permission_manager = get_manager(RolePermission)
+
+    def can(self, *permissions):
+        """True if the logged-in user's role holds every one of permissions."""
+        mask = current_mask()
+        return mask is None or has_permission(mask, *permissions)
+
+    def cached(self, name, arguments, snapshot, compute):
+        """
+        Returns compute() from this session's cache while neither the arguments
+        nor the data changed, so paging and row selection do not query again.
+
+        Parameters:
+            name (str): Cache slot, one per table.
+            arguments: The filter; compared with ==.
+            snapshot: The manager's record list (e.g. Product.snapshot). Managers
+                replace it on every change, so it is compared by identity.
+            compute (callable): Runs the query.
+        """
+        cache = st.session_state.setdefault("query_cache", {})
+        entry = cache.get(name)
+        if entry is not None and entry[0] == arguments and entry[1] is snapshot:
+            metrics.count("query_cache.hit")
+            return entry[2]
+        metrics.count("query_cache.miss")
+        result = compute()
+        cache[name] = (arguments, snapshot, result)
+        return result
+
+    def cached_products(self, product_filter):
+        """query_products(**product_filter), cached per session."""
+        # Transfers change the stock per location without touching the catalog
+        arguments = (product_filter, self.product_manager.locations.transfers.offset)
+        return self.cached(
+            "products", arguments, self.product_manager.snapshot,
+            lambda: self.product_manager.query_products(**product_filter),
+        )
+
+    def cached_users(self, user_filter):
+        """Users matching a (field label, value) filter, cached per session; answered by the trigram indexes."""
+        filter_option, filter_value = user_filter
+        fields = {"User ID": "user_id", "Username": "username", "Role": "role"}
+
+        def compute():
+            if filter_option in fields:
+                return self.user_manager.search_users(filter_value, field=fields[filter_option])
+            return self.user_manager.users
+
+        return self.cached("users", user_filter, self.user_manager.users, compute)
+
+    def cached_roles(self, role_filter):
+        """Roles matching a (field label, value) filter, cached per session; IDs and names use the trigram indexes."""
+        filter_option, filter_value = role_filter
+        fields = {"Role ID": "role_id", "Role Name": "name"}
+
+        def compute():
+            roles = self.role_permission_manager.roles
+            if filter_option in fields:
+                return self.role_permission_manager.search_roles(filter_value, field=fields[filter_option])
+            if filter_option == "Permission Level":
+                return [role for role in roles if "permission_level" in role and str(filter_value).lower() in str(role["permission_level"]).lower()]
+            return roles
+
+        return self.cached("roles", role_filter, self.role_permission_manager.roles, compute)
 
     def validate_fields(self, fields):
         """
@@ -34,8 +137,202 @@ class InventorySystem:
         
         return None  # No errors found
 
+    def paginate(self, records, key):
+        """
+        Renders page size / page number controls and returns only the current page.
+
+        Parameters:
+            records (list): All records matching the active filter.
+            key (str): Prefix for the widget keys, unique per table.
+
+        Returns:
+            list: The records of the selected page.
+        """
+        size_column, page_column, info_column = st.columns([2, 2, 4])
+        with size_column:
+            page_size = st.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size")
+        page_count = max(1, math.ceil(len(records) / page_size))
+        # A filter or a larger page size can leave the stored page number out of range
+        if st.session_state.get(f"{key}_page", 1) > page_count:
+            st.session_state[f"{key}_page"] = page_count
+        with page_column:
+            page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key=f"{key}_page")
+        with info_column:
+            st.caption(f"{len(records)} records - page {page} of {page_count}")
+
+        start = (page - 1) * page_size
+        return records[start:start + page_size]
+
+    def display_record_grid(self, records, columns, key, extra_columns=None):
+        """
+        Shows one page of records as a single selectable table.
+
+        Only the visible page is turned into a DataFrame, so the amount of data
+        sent to the browser does not depend on the size of the dataset.
+
+        Parameters:
+            records (list): All records matching the active filter.
+            columns (list): Record fields to show; the first one is the record ID.
+            key (str): Prefix for the widget keys, unique per table.
+            extra_columns (dict, optional): Column name -> function of a record,
+                computed for the visible page only.
+
+        Returns:
+            dict or None: The selected record, if a row is selected.
+        """
+        page_records = self.paginate(records, key)
+        frame = pd.DataFrame(page_records, columns=columns)
+        # IDs are a mix of ints and strings in the data files
+        frame[columns[0]] = frame[columns[0]].astype(str)
+        for name, value in (extra_columns or {}).items():
+            frame[name] = [value(record) for record in page_records]
+        event = st.dataframe(frame, hide_index=True, on_select="rerun", selection_mode="single-row", key=f"{key}_grid")
+
+        rows = event.selection.rows
+        if rows and rows[0] < len(page_records):
+            return page_records[rows[0]]
+        return None
+
     def display_home(self):
         st.subheader("Welcome to Inventory Management System")
+        # Every logged-in user lands here; the dashboard shows catalog data
+        if not self.can("view_product"):
+            st.write("Use the menu on the left to get started.")
+            return
+        self.display_inventory_totals()
+        self.display_low_stock()
+        self.display_top_sellers()
+
+    def display_inventory_totals(self):
+        # Running totals kept up to date by every product change, never recomputed here
+        totals = self.product_manager.aggregates
+
+        value_column, sku_column, units_column, out_column = st.columns(4)
+        value_column.metric("Inventory Value", f"{totals.total_value:,.2f} USD")
+        sku_column.metric("Products (SKUs)", totals.sku_count)
+        units_column.metric("Units in Stock", totals.total_units)
+        out_column.metric("Out of Stock", totals.out_of_stock)
+
+        if totals.categories:
+            frame = pd.DataFrame.from_dict(totals.categories, orient="index")
+            frame.index.name = "category"
+            st.dataframe(frame.sort_index(), column_config={"value": st.column_config.NumberColumn(format="%.2f")})
+
+        locations = self.product_manager.locations
+        if len(locations.names) > 1:
+            # Added up from the per-location totals; other partitions are not loaded for this
+            units = self.product_manager.location_totals()
+            st.markdown("#### Stock by Location")
+            st.dataframe(
+                pd.DataFrame({
+                    "location": [locations.names[location] for location in units],
+                    "units": list(units.values()),
+                }),
+                hide_index=True,
+            )
+
+    def location_choice(self, label, key, include_all=False):
+        """
+        Location selectbox, preselecting this terminal's location (INVENTORY_LOCATION).
+
+        Returns:
+            str or None: The selected location ID; None for "All locations" or
+            when there is only one location.
+        """
+        locations = self.product_manager.locations
+        if len(locations.names) < 2:
+            return None
+        options = ([None] if include_all else []) + list(locations.names)
+        # A terminal serving one location starts on it
+        index = options.index(locations.local[0]) if len(locations.local) == 1 else 0
+        return st.selectbox(
+            label, options, index=index, key=key,
+            format_func=lambda location: "All locations" if location is None else locations.names[location],
+        )
+
+    def display_low_stock(self):
+        # Served from the reorder-level index, so this does not scan the catalog
+        low_stock = self.product_manager.low_stock_products()
+
+        st.markdown("#### Low Stock")
+        if not low_stock:
+            st.write("All products are above their reorder level.")
+            return
+
+        counts_column, list_column = st.columns([2, 4])
+        with counts_column:
+            st.metric("Products to reorder", len(low_stock))
+            counts = self.product_manager.low_stock_counts(low_stock)
+            st.dataframe(
+                pd.DataFrame({"category": list(counts), "products": list(counts.values())}),
+                hide_index=True,
+            )
+        with list_column:
+            frame = pd.DataFrame(low_stock[:100], columns=["product_id", "name", "category", "stock_quantity"])
+            frame["product_id"] = frame["product_id"].astype(str)
+            frame["reorder_level"] = [self.product_manager.reorder_level(prod) for prod in low_stock[:100]]
+            st.dataframe(frame, hide_index=True)
+            if len(low_stock) > 100:
+                st.caption(f"Showing the 100 most urgent of {len(low_stock)} products.")
+
+    def display_top_sellers(self, days=30):
+        # Summed from the ledger's daily rollups, not from raw movements
+        sold = self.product_manager.units_moved(days, "sale")
+
+        st.markdown(f"#### Top Sellers (last {days} days)")
+        if not sold:
+            st.write("No sales recorded.")
+            return
+        top = sorted(sold.items(), key=lambda item: item[1], reverse=True)[:10]
+        frame = pd.DataFrame(top, columns=["product_id", "units_sold"])
+        frame.insert(1, "name", [
+            (self.product_manager.get_product_by_id(key) or {}).get("name") for key, _ in top
+        ])
+        frame["per_day"] = (frame["units_sold"] / days).round(2)
+        st.dataframe(frame, hide_index=True)
+
+    def display_stock_movement_form(self, product):
+        """Books a receipt, sale or adjustment for the selected product."""
+        with st.expander(f"Record stock movement for '{product['name']}'"):
+            with st.form(key="stock_movement_form"):
+                kind = st.selectbox("Movement", MOVEMENT_KINDS)
+                location = self.location_choice("Location", "stock_movement_location")
+                quantity = st.number_input("Quantity (adjustments may be negative)", step=1, value=0)
+                submit_button = st.form_submit_button(label="Record")
+
+                if submit_button:
+                    if quantity == 0:
+                        st.error("Quantity must not be 0.")
+                    elif self.product_manager.record_movement(product["product_id"], kind, int(quantity), location):
+                        st.success(f"{kind.capitalize()} of {abs(int(quantity))} recorded.")
+                        # Only the product table fragment needs to be redrawn
+                        st.rerun(scope="fragment")
+                    else:
+                        st.error("Stock cannot go below 0.")
+
+        if len(self.product_manager.locations.names) > 1:
+            self.display_transfer_form(product)
+
+    def display_transfer_form(self, product):
+        """Moves units of the selected product between two locations."""
+        with st.expander(f"Transfer stock of '{product['name']}'"):
+            with st.form(key="stock_transfer_form"):
+                from_column, to_column = st.columns(2)
+                with from_column:
+                    source = self.location_choice("From", "stock_transfer_source")
+                with to_column:
+                    target = self.location_choice("To", "stock_transfer_target")
+                quantity = st.number_input("Quantity", min_value=1, step=1, value=1)
+                submit_button = st.form_submit_button(label="Transfer")
+
+                if submit_button:
+                    if source == target:
+                        st.error("Choose two different locations.")
+                    elif self.product_manager.transfer_stock(product["product_id"], int(quantity), source, target):
+                        st.success(f"Transferred {int(quantity)} units.")
+                        st.rerun(scope="fragment")
+                    else:
+                        st.error("Not enough stock at the source location.")
 
     def display_product_management(self):
         st.subheader("Product Management")
@@ -44,57 +341,80 @@ class InventorySystem:
             # Add Product button at the top-right
             col1, col2 = st.columns([4, 1])
             with col2:
-                if st.session_state.get("role", "user") == "admin":
+                if self.can("add_product"):
                     if st.button("Add Product", key="add_product_button_main"):
                         st.session_state.page = "add_product"  # Navigate to the add product form
+                        st.rerun()
 
-            # Display Filters for Product Table
-            filter_column, value_column = st.columns([2, 4])
-            with filter_column:
-                filter_option = st.selectbox("Search By", ["Product ID", "Product Name", "Category", "Stock Quantity"])
-            with value_column:
-                filter_value = st.text_input(f"Enter {filter_option}", "")
+        self.display_product_table()
 
-            filter_button = st.button("Filter Products", key="filter_products_button")
-            filtered_data = self.product_manager.products
-
-            if filter_button:
-                # Apply filtering based on user input
-                if filter_option == "Product ID":
-                    filtered_data = [prod for prod in filtered_data if str(filter_value).lower() in str(prod["product_id"]).lower()]
-                elif filter_option == "Product Name":
-                    filtered_data = [prod for prod in filtered_data if str(filter_value).lower() in str(prod["name"]).lower()]
-                elif filter_option == "Category":
-                    filtered_data = [prod for prod in filtered_data if str(filter_value).lower() in str(prod["category"]).lower()]
-                elif filter_option == "Stock Quantity":
-                    try:
-                        filter_value_int = int(filter_value)
-                        filtered_data = [prod for prod in filtered_data if prod["stock_quantity"] == filter_value_int]
-                    except ValueError:
-                        st.error("Please enter a valid stock quantity number.")
-                        filtered_data = []
+    @rerun_scoped(st.fragment)
+    def display_product_table(self):
+        """Filters, product table and row actions; using them reruns only this fragment."""
+        with st.container():
+            # Display Filters for Product Table; every filled-in field must match
+            id_column, name_column, category_column = st.columns(3)
+            with id_column:
+                product_id = st.text_input("Product ID", "")
+            with name_column:
+                name = st.text_input("Product Name", "")
+            with category_column:
+                category = st.text_input("Category", "")
+            stock_min_column, stock_max_column, price_min_column, price_max_column = st.columns(4)
+            with stock_min_column:
+                stock_min = st.number_input("Min Stock", min_value=0, step=1, value=None)
+            with stock_max_column:
+                stock_max = st.number_input("Max Stock", min_value=0, step=1, value=None)
+            with price_min_column:
+                price_min = st.number_input("Min Price", min_value=0.0, step=0.01, value=None)
+            with price_max_column:
+                price_max = st.number_input("Max Price", min_value=0.0, step=0.01, value=None)
+            # Min/Max Stock apply to the units at the chosen location
+            location = self.location_choice("Location", "product_filter_location", include_all=True)
+
+            # Keep the applied filter, otherwise selecting a row (a rerun) would reset it
+            if st.button("Filter Products", key="filter_products_button"):
+                st.session_state.product_filter = {
+                    "product_id": product_id,
+                    "name": name,
+                    "category": category,
+                    "stock_range": (stock_min, stock_max),
+                    "price_range": (price_min, price_max),
+                    "location": location,
+                }
+            product_filter = st.session_state.get("product_filter", {"location": location})
+            filtered_data = self.cached_products(product_filter)
 
             # Display the product list or no data message
             if len(filtered_data) == 0:
                 st.write("No products found.")
-            else:
-                for product in filtered_data:
-                    product_row = f"**{product['name']}** - {product['category']} - {product['price']} USD"
-                    col1, col2, col3 = st.columns([4, 2, 2])
-                    
-                    with col1:
-                        st.write(product_row)
-                    with col2:
-                        if st.session_state.get("role", "user") == "admin":
-                            if st.button("Update", key=f"update_button_{product['product_id']}"):
-                                st.session_state.product_id_to_update = product['product_id']
-                                st.session_state.page = "update_product"  # Redirect to update page
+                return
+
+            extra_columns = None
+            if product_filter.get("location"):
+                # Units at the filtered location next to the total
+                location_stock = self.product_manager.stock_at(product_filter["location"])
+                extra_columns = {"location_stock": lambda prod: location_stock.get(normalize_id(prod["product_id"]), 0)}
+            product = self.display_record_grid(
+                filtered_data, ["product_id", "name", "category", "price", "stock_quantity"], "products", extra_columns
+            )
+
+            if self.can("edit_product") or self.can("delete_product"):
+                col1, col2, col3 = st.columns([2, 2, 4])
+                with col1:
+                    if st.button("Update", key="update_product_button", disabled=product is None or not self.can("edit_product")):
+                        st.session_state.product_id_to_update = product['product_id']
+                        # Version the admin is editing; the update fails if it changes meanwhile
+                        st.session_state.product_version_to_update = product.get('version', 0)
+                        st.session_state.update_conflict = False
+                        st.session_state.page = "update_product"  # Redirect to update page
+                        st.rerun()
+                with col2:
+                    if st.button("Delete", key="delete_product_button", disabled=product is None or not self.can("delete_product")):
+                        self.delete_product(product['product_id'])  # Ask for confirmation in a dialog
 
-                    with col3:
-                        if st.session_state.get("role", "user") == "admin":
-                            if st.button("Delete", key=f"delete_button_{product['product_id']}"):
-                                st.session_state.page = "delete_product"  # Redirect to delete page
-                                self.delete_product(product['product_id'])  # Trigger delete function
+                if product is not None and self.can("edit_product"):
+                    self.display_stock_movement_form(product)
 
     def display_add_product_form(self):
         st.subheader("Add New Product")
@@ -134,11 +454,13 @@ class InventorySystem:
                         "price": price,
                         "stock_quantity": stock_quantity
                     }
-                    self.product_manager.add_product(new_product)
-                    st.success(f"Product '{name}' added successfully!")
-                    
-                    st.session_state.page = "product_management"  # Redirect back to product management
-                    st.rerun()  # Triggers the rerun
+                    if self.product_manager.add_product(new_product):
+                        st.success(f"Product '{name}' added successfully!")
+
+                        st.session_state.page = "product_management"  # Redirect back to product management
+                        st.rerun()  # Triggers the rerun
+                    else:
+                        st.error(f"A product with ID '{product_id}' already exists.")
             elif cancel_button:
                 # If "Cancel" button is clicked, go back to the main listing page
                 st.session_state.page = "product_management"
@@ -187,29 +509,58 @@ class InventorySystem:
                                     "price": price,
                                     "stock_quantity": stock_quantity
                                 }
-                                self.product_manager.update_product(product_id, updated_product)
-                                st.success(f"Product '{name}' updated successfully!")
-                                st.session_state.page = "product_management"  # Redirect back to product management
-                                st.rerun()  # Triggers the rerun
+                                try:
+                                    updated = self.product_manager.update_product(
+                                        product_id, updated_product,
+                                        expected_version=st.session_state.get("product_version_to_update"),
+                                    )
+                                except ConflictError:
+                                    st.session_state.update_conflict = True
+                                else:
+                                    if updated:
+                                        st.success(f"Product '{name}' updated successfully!")
+                                        st.session_state.page = "product_management"  # Redirect back to product management
+                                        st.rerun()  # Triggers the rerun
+                                    else:
+                                        st.error(f"Product '{product_id}' was deleted by someone else. Your changes were not saved.")
                     elif cancel_button:
                         # If "Cancel" button is clicked, go back to the main listing page
                         st.session_state.page = "product_management"
                         st.rerun()  
 
+                if st.session_state.get("update_conflict"):
+                    self.display_update_conflict("product_version_to_update", product)
+            else:
+                st.error(f"Product '{product_id}' no longer exists; it was deleted by someone else.")
+
+    def display_update_conflict(self, version_key, record):
+        """Explains a failed compare-and-swap update and lets the admin retry on top of the latest version."""
+        st.error(
+            "This record was changed by someone else while you were editing it. "
+            "Your changes were not saved. Retry to apply them on top of the latest version."
+        )
+        if st.button("Retry", key="retry_update_button"):
+            st.session_state[version_key] = record.get("version", 0)
+            st.session_state.update_conflict = False
+            st.rerun()
+
+    @rerun_scoped(st.dialog("Delete Product"))
     def delete_product(self, product_id):
-        # This function will show the delete confirmation
+        # Modal confirmation; clicks inside it rerun only the dialog
         product = self.product_manager.get_product_by_id(product_id)
 
         if product:
             st.warning(f"Are you sure you want to delete '{product['name']}'?")
-            confirm_delete = st.button("Confirm Deletion", key=f"confirm_delete_button_{product_id}")
-
-            # In the delete_product method
-            if confirm_delete:
+            confirm_column, cancel_column = st.columns(2)
+            if confirm_column.button("Confirm Deletion", key=f"confirm_delete_button_{product_id}"):
                 self.product_manager.delete_product(product_id)
                 st.success(f"Product '{product['name']}' deleted successfully!")
-                st.session_state.page = "product_management"
+                # Closes the dialog and redraws the page without the product
+                st.rerun()
+            if cancel_column.button("Cancel", key=f"cancel_delete_button_{product_id}"):
                 st.rerun()
+        else:
+            st.write("This product no longer exists.")
 
     def display_user_management(self):
         st.subheader("User Management")
@@ -218,10 +569,17 @@ class InventorySystem:
             # Add User button with a unique key
             col1, col2 = st.columns([4, 1])
             with col2:
-                if st.session_state.get("role", "user") == "admin":
+                if self.can("add_user"):
                     if st.button("Add User", key="unique_add_user_button"):  # Ensure unique key
                         st.session_state.page = "add_user"  # Navigate to the add user form
+                        st.rerun()
 
+        self.display_user_table()
+
+    @rerun_scoped(st.fragment)
+    def display_user_table(self):
+        """Filter, user table and row actions; using them reruns only this fragment."""
+        with st.container():
             # Display Filters for User Table
             filter_column, value_column = st.columns([2, 4])
             with filter_column:
@@ -229,43 +587,32 @@ class InventorySystem:
             with value_column:
                 filter_value = st.text_input(f"Enter {filter_option}", "")
 
-            filter_button = st.button("Filter Users", key="filter_users_button")  # Ensure unique key
-            filtered_data = self.user_manager.users
-
-            if filter_button:
-                # Apply filtering based on user input
-                if filter_option == "User ID":
-                    filtered_data = [usr for usr in filtered_data if "user_id" in usr and str(filter_value).lower() in str(usr["user_id"]).lower()]
-                elif filter_option == "Username":
-                    filtered_data = [usr for usr in filtered_data if "username" in usr and str(filter_value).lower() in str(usr["username"]).lower()]
-                elif filter_option == "Role":
-                    filtered_data = [usr for usr in filtered_data if "role" in usr and str(filter_value).lower() in str(usr["role"]).lower()]
+            # Keep the applied filter, otherwise selecting a row (a rerun) would reset it
+            if st.button("Filter Users", key="filter_users_button"):  # Ensure unique key
+                st.session_state.user_filter = (filter_option, filter_value)
+            filtered_data = self.cached_users(st.session_state.get("user_filter", (None, "")))
 
             # Display the user list or no data message
             if len(filtered_data) == 0:
                 st.write("No users found.")
-            else:
-                for idx, user in enumerate(filtered_data):
-                    # Check for 'user_id' key to avoid KeyError
-                    if "user_id" in user:
-                        user_row = f"**{user.get('username', 'Unknown User')}** - {user.get('role', 'No Role')}"
-                        col1, col2, col3 = st.columns([4, 2, 2])
-                        
-                        with col1:
-                            st.write(user_row)
-                        with col2:
-                            if st.session_state.get("role", "user") == "admin":
-                                # Ensure unique key for each button in the loop
-                                if st.button("Update", key=f"update_user_{user['user_id']}_{idx}"):
-                                    st.session_state.user_id_to_update = user['user_id']
-                                    st.session_state.page = "update_user"  # Redirect to update page
-                        with col3:
-                            if st.session_state.get("role", "user") == "admin":
-                                # Ensure unique key for each button in the loop
-                                if st.button("Delete", key=f"delete_user_{user['user_id']}_{idx}"):
-                                    self.delete_user(user['user_id'])
-                    else:
-                        st.error("User data is missing a 'user_id' field. Please check data consistency.")
+                return
+
+            # Passwords are never sent to the browser
+            user = self.display_record_grid(filtered_data, ["user_id", "username", "role"], "users")
+
+            if self.can("edit_user") or self.can("delete_user"):
+                col1, col2, col3 = st.columns([2, 2, 4])
+                with col1:
+                    if st.button("Update", key="update_user_button", disabled=user is None or not self.can("edit_user")):
+                        st.session_state.user_id_to_update = user['user_id']
+                        # Version the admin is editing; the update fails if it changes meanwhile
+                        st.session_state.user_version_to_update = user.get('version', 0)
+                        st.session_state.update_conflict = False
+                        st.session_state.page = "update_user"  # Redirect to update page
+                        st.rerun()
+                with col2:
+                    if st.button("Delete", key="delete_user_button", disabled=user is None or not self.can("delete_user")):
+                        self.delete_user(user['user_id'])  # Ask for confirmation in a dialog
 
     def display_add_user_form(self):
         st.subheader("Add New User")
@@ -273,6 +620,7 @@ class InventorySystem:
         with st.form(key='add_user_form'):
             user_id = st.text_input("User ID")
             username = st.text_input("Username")
+            password = st.text_input("Password", type="password")
             role = st.text_input("Role")
             # submit_button = st.form_submit_button(label='Add User')
             # Add two submit buttons for "Add Product" and "Cancel"
@@ -287,13 +635,16 @@ class InventorySystem:
                 new_user = {
                     "user_id": user_id,
                     "username": username,
+                    "password": password,  # Hashed by the user manager before it is stored
                     "role": role
                 }
-                self.user_manager.add_user(new_user)
-                st.success(f"User '{username}' added successfully!")
+                if self.user_manager.add_user(new_user):
+                    st.success(f"User '{username}' added successfully!")
 
-                st.session_state.page = "user_management"  # Redirect back to product management
-                st.rerun()  # Triggers the rerun
+                    st.session_state.page = "user_management"  # Redirect back to product management
+                    st.rerun()  # Triggers the rerun
+                else:
+                    st.error(f"A user with ID '{user_id}' already exists.")
             elif cancel_button:
                 # If "Cancel" button is clicked, go back to the main listing page
                 st.session_state.page = "product_management"
@@ -309,6 +660,7 @@ class InventorySystem:
                 with st.form(key="update_user_form"):
                     username = st.text_input("Username", value=user["username"])
                     role = st.text_input("Role", value=user["role"])
+                    password = st.text_input("New Password", type="password", placeholder="Leave empty to keep the current password")
                     submit_button = st.form_submit_button(label="Update User")
 
                     if submit_button:
@@ -317,23 +669,42 @@ class InventorySystem:
                             "username": username,
                             "role": role
                         }
-                        self.user_manager.update_user(user_id, updated_user)
-                        st.success(f"User '{username}' updated successfully!")
-                        st.session_state.page = "user_management"
-                        st.rerun()
+                        if password:
+                            updated_user["password"] = password
+                        try:
+                            updated = self.user_manager.update_user(
+                                user_id, updated_user, expected_version=st.session_state.get("user_version_to_update")
+                            )
+                        except ConflictError:
+                            st.session_state.update_conflict = True
+                        else:
+                            if updated:
+                                st.success(f"User '{username}' updated successfully!")
+                                st.session_state.page = "user_management"
+                                st.rerun()
+                            else:
+                                st.error(f"User '{user_id}' was deleted by someone else. Your changes were not saved.")
+
+                if st.session_state.get("update_conflict"):
+                    self.display_update_conflict("user_version_to_update", user)
+            else:
+                st.error(f"User '{user_id}' no longer exists; it was deleted by someone else.")
 
+    @rerun_scoped(st.dialog("Delete User"))
     def delete_user(self, user_id):
         user = self.user_manager.get_user_by_id(user_id)
 
         if user:
             st.warning(f"Are you sure you want to delete '{user['username']}'?")
-            confirm_delete = st.button("Confirm Deletion", key=f"confirm_delete_user_{user_id}")
-
-            if confirm_delete:
+            confirm_column, cancel_column = st.columns(2)
+            if confirm_column.button("Confirm Deletion", key=f"confirm_delete_user_{user_id}"):
                 self.user_manager.delete_user(user_id)
                 st.success(f"User '{user['username']}' deleted successfully!")
-                st.session_state.page = "user_management"
-                #st.rerun()
+                st.rerun()
+            if cancel_column.button("Cancel", key=f"cancel_delete_user_{user_id}"):
+                st.rerun()
+        else:
+            st.write("This user no longer exists.")
 
     def display_role_permission_management(self):
         st.subheader("Role & Permission Management")
@@ -342,9 +713,17 @@ class InventorySystem:
             # Add Role button with a unique key
             col1, col2 = st.columns([4, 1])
             with col2:
-                if st.button("Add Role", key="unique_add_role_button"):
-                    st.session_state.page = "add_role"  # Navigate to add role form
+                if self.can("add_role"):
+                    if st.button("Add Role", key="unique_add_role_button"):
+                        st.session_state.page = "add_role"  # Navigate to add role form
+                        st.rerun()
+
+        self.display_role_table()
 
+    @rerun_scoped(st.fragment)
+    def display_role_table(self):
+        """Filter, role table and row actions; using them reruns only this fragment."""
+        with st.container():
             # Display Filters for Role Table
             filter_column, value_column = st.columns([2, 4])
             with filter_column:
@@ -352,38 +731,28 @@ class InventorySystem:
             with value_column:
                 filter_value = st.text_input(f"Enter {filter_option}", "")
 
-            filter_button = st.button("Filter Roles", key="filter_roles_button")
-            filtered_data = self.role_permission_manager.roles
-
-            if filter_button:
-                # Apply filtering based on user input
-                if filter_option == "Role ID":
-                    filtered_data = [role for role in filtered_data if "role_id" in role and str(filter_value).lower() in str(role["role_id"]).lower()]
-                elif filter_option == "Role Name":
-                    filtered_data = [role for role in filtered_data if "name" in role and str(filter_value).lower() in str(role["name"]).lower()]
-                elif filter_option == "Permission Level":
-                    filtered_data = [role for role in filtered_data if "permission_level" in role and str(filter_value).lower() in str(role["permission_level"]).lower()]
+            # Keep the applied filter, otherwise selecting a row (a rerun) would reset it
+            if st.button("Filter Roles", key="filter_roles_button"):
+                st.session_state.role_filter = (filter_option, filter_value)
+            filtered_data = self.cached_roles(st.session_state.get("role_filter", (None, "")))
 
             # Display the role list or no data message
             if len(filtered_data) == 0:
                 st.write("No roles found.")
-            else:
-                for idx, role in enumerate(filtered_data):
-                    if "role_id" in role:
-                        role_row = f"**{role.get('role_id', 'Unknown ID')}** - {role.get('name', 'Unknown Name')}"
-                        col1, col2, col3 = st.columns([4, 2, 2])
-                        
-                        with col1:
-                            st.write(role_row)
-                        with col2:
-                            if st.button("Update", key=f"update_role_{role['role_id']}_{idx}"):
-                                st.session_state.role_id_to_update = role['role_id']
-                                st.session_state.page = "update_role"
-                        with col3:
-                            if st.button("Delete", key=f"delete_role_{role['role_id']}_{idx}"):
-                                self.delete_role(role['role_id'])
-                    else:
-                        st.error("Role data is missing a 'role_id' field. Please check data consistency.")
+                return
+
+            role = self.display_record_grid(filtered_data, ["role_id", "name", "permission_level"], "roles")
+
+            if self.can("edit_role") or self.can("delete_role"):
+                col1, col2, col3 = st.columns([2, 2, 4])
+                with col1:
+                    if st.button("Update", key="update_role_button", disabled=role is None or not self.can("edit_role")):
+                        st.session_state.role_id_to_update = role['role_id']
+                        st.session_state.page = "update_role"
+                        st.rerun()
+                with col2:
+                    if st.button("Delete", key="delete_role_button", disabled=role is None or not self.can("delete_role")):
+                        self.delete_role(role['role_id'])  # Ask for confirmation in a dialog
 
     def display_add_role_form(self):
         st.subheader("Add New Role")
@@ -391,20 +760,23 @@ class InventorySystem:
         with st.form(key='add_role_form'):
             role_id = st.text_input("Role ID")
             name = st.text_input("Role Name")
-            permission_level = st.text_input("Permission Level")
+            permission_level = st.text_input("Permission Level", placeholder="e.g. view_product, add_product")
             submit_button = st.form_submit_button(label='Add Role')
 
             if submit_button:
                 new_role = {
                     "role_id": role_id,
                     "name": name,
-                    "permission_level": permission_level
+                    # Stored as a list of names, like the roles shipped in roles.json
+                    "permission_level": parse_permissions(permission_level)
                 }
-                self.role_permission_manager.add_role(new_role)
-                st.success(f"Role '{name}' added successfully!")
+                if self.role_permission_manager.add_role(new_role):
+                    st.success(f"Role '{name}' added successfully!")
 
-                st.session_state.page = "role_permission_management"
-                st.rerun()
+                    st.session_state.page = "role_permission_management"
+                    st.rerun()
+                else:
+                    st.error(f"A role with ID '{role_id}' already exists.")
 
     def display_update_role_form(self):
         if 'role_id_to_update' in st.session_state:
@@ -415,30 +787,213 @@ class InventorySystem:
                 st.subheader("Update Role")
                 with st.form(key="update_role_form"):
                     name = st.text_input("Role Name", value=role["name"])
-                    permission_level = st.text_input("Permission Level", value=role["permission_level"])
+                    permission_level = st.text_input(
+                        "Permission Level", value=", ".join(parse_permissions(role.get("permission_level")))
+                    )
                     submit_button = st.form_submit_button(label="Update Role")
 
                     if submit_button:
                         updated_role = {
                             "role_id": role_id,
                             "name": name,
-                            "permission_level": permission_level
+                            "permission_level": parse_permissions(permission_level)
                         }
                         self.role_permission_manager.update_role(role_id, updated_role)
                         st.success(f"Role '{name}' updated successfully!")
                         st.session_state.page = "role_permission_management"
                         st.rerun()
 
+    @rerun_scoped(st.dialog("Delete Role"))
     def delete_role(self, role_id):
         role = self.role_permission_manager.get_role_by_id(role_id)
 
         if role:
             st.warning(f"Are you sure you want to delete '{role['name']}'?")
-            confirm_delete = st.button("Confirm Deletion", key=f"confirm_delete_role_{role_id}")
-
-            if confirm_delete:
+            confirm_column, cancel_column = st.columns(2)
+            if confirm_column.button("Confirm Deletion", key=f"confirm_delete_role_{role_id}"):
                 self.role_permission_manager.delete_role(role_id)
                 st.success(f"Role '{role['name']}' deleted successfully!")
-                st.session_state.page = "role_permission_management"
                 st.rerun()
-        # st.write("Contents of my_list:", st.session_state)
+            if cancel_column.button("Cancel", key=f"cancel_delete_role_{role_id}"):
+                st.rerun()
+        else:
+            st.write("This role no longer exists.")
+
+    def display_scan_session(self):
+        """
+        Scan mode for receiving (or counting out) many products in a row.
+
+        Scans are added up per product in the session's ScanSession and the
+        batch is booked with one write when it is committed, instead of one
+        update form and one data file write per product.
+        """
+        st.subheader("Scan Session")
+        session = st.session_state.get("scan_session")
+        if session is None:
+            session = st.session_state.scan_session = ScanSession()
+
+        kind_column, location_column = st.columns(2)
+        with kind_column:
+            # The kind is fixed once the first product is scanned
+            session.kind = st.selectbox(
+                "Movement", MOVEMENT_KINDS, index=MOVEMENT_KINDS.index(session.kind), disabled=len(session) > 0
+            )
+        with location_column:
+            session.location = self.location_choice("Location", "scan_location")
+
+        # A scanner types the ID and presses Enter, which submits the form and clears it for the next scan
+        with st.form(key="scan_form", clear_on_submit=True):
+            id_column, quantity_column = st.columns([3, 1])
+            with id_column:
+                product_id = st.text_input("Product ID", placeholder="Scan or type a product ID")
+            with quantity_column:
+                quantity = st.number_input("Quantity", step=1, value=1)
+            scanned = st.form_submit_button("Add")
+
+        if scanned and product_id.strip():
+            product = self.product_manager.get_product_by_id(product_id.strip())
+            if product is None:
+                st.error(f"No product with ID '{product_id.strip()}'.")
+            elif quantity == 0 or (quantity < 0 and session.kind != "adjustment"):
+                st.error("Quantity must be positive (adjustments may be negative, but not 0).")
+            else:
+                session.add(product["product_id"], int(quantity))
+                st.caption(f"Last scan: {int(quantity)} x {product['name']}")
+
+        commit_column, undo_column, discard_column = st.columns([2, 2, 4])
+        with commit_column:
+            commit = st.button("Commit batch", key="scan_commit", disabled=not session.tally)
+        with undo_column:
+            undo = st.button("Undo last scan", key="scan_undo", disabled=not session.history)
+        with discard_column:
+            discard = st.button("Discard batch", key="scan_discard", disabled=not session.tally)
+
+        if commit:
+            products, units = len(session), session.units()
+            if session.commit(self.product_manager):
+                st.success(f"Booked {units} units of {products} products in one write.")
+            else:
+                st.error("A product no longer exists or its stock would go below 0; nothing was booked.")
+        if undo:
+            session.undo()
+        if discard:
+            st.session_state.scan_session = session = ScanSession(session.kind, session.location)
+
+        if not session.tally:
+            st.write("No products scanned yet.")
+            return
+        st.caption(f"{len(session)} products, {session.units()} units, {len(session.history)} scans")
+        sign = -1 if session.kind == "sale" else 1
+        rows = []
+        for product_id, units, scans in session.tally.values():
+            product = self.product_manager.get_product_by_id(product_id) or {}
+            stock = product.get("stock_quantity")
+            rows.append({
+                "product_id": str(product_id),
+                "name": product.get("name"),
+                "scans": scans,
+                "units": units,
+                "stock_quantity": stock,
+                "after_commit": stock + sign * units if isinstance(stock, int) else None,
+            })
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+
+    def display_bulk_import_export(self):
+        st.subheader("Import / Export")
+
+        datasets = [
+            dataset for dataset, kind in [("Products", "product"), ("Users", "user")]
+            if self.can(f"add_{kind}", f"edit_{kind}")
+        ]
+        if not datasets:
+            st.error("You do not have permission to import or export data.")
+            return
+        dataset = st.radio("Data", datasets, horizontal=True)
+        if dataset == "Products":
+            manager, schema = self.product_manager, bulk_io.PRODUCT_SCHEMA
+            upsert, records, fields = manager.upsert_products, manager.products, bulk_io.PRODUCT_EXPORT_FIELDS
+        else:
+            manager, schema = self.user_manager, bulk_io.USER_SCHEMA
+            upsert, records, fields = manager.upsert_users, manager.users, bulk_io.USER_EXPORT_FIELDS
+
+        st.markdown("#### Import")
+        st.caption(f"CSV with a header row or JSON Lines. Columns: {', '.join(schema)}. Existing IDs are updated.")
+        uploaded = st.file_uploader("File", type=["csv", "jsonl"], key=f"import_{dataset}")
+        if uploaded is not None and st.button("Import", key="bulk_import_button"):
+            file_format = "csv" if uploaded.name.lower().endswith(".csv") else "jsonl"
+            progress_bar = st.progress(0.0, text="Importing...")
+
+            def progress(rows):
+                # The upload is read as a stream; its position tells how far we are
+                progress_bar.progress(min(uploaded.tell() / max(uploaded.size, 1), 1.0), text=f"{rows} rows read")
+
+            text = io.TextIOWrapper(uploaded, encoding="utf-8-sig", newline="")
+            # The file is read without holding the manager lock; the upsert at
+            # the end applies and saves the valid rows in one write transaction
+            report = bulk_io.import_records(text, file_format, schema, self.validate_fields, upsert, progress=progress)
+            progress_bar.progress(1.0, text=f"{report['rows']} rows read")
+
+            if report["failed"]:
+                st.error(f"Nothing was imported. {report['failed']}")
+            else:
+                st.success(f"{report['inserted']} added, {report['updated']} updated, {len(report['errors'])} rejected.")
+            if report["errors"]:
+                st.dataframe(pd.DataFrame(report["errors"], columns=["line", "error"]), hide_index=True)
+
+        st.markdown("#### Export")
+        export_column, format_column = st.columns([2, 4])
+        with format_column:
+            export_format = st.radio("Format", ["csv", "jsonl"], horizontal=True, key="export_format")
+        with export_column:
+            def export_data():
+                # Built when Download is clicked, not on every rerun of the page;
+                # Streamlit serves the whole file from memory
+                text = io.StringIO(newline="")
+                bulk_io.export_records(records, text, export_format, fields)
+                return text.getvalue()
+
+            st.download_button(
+                "Download",
+                data=export_data,
+                file_name=f"{dataset.lower()}.{export_format}",
+                mime="text/csv" if export_format == "csv" else "application/jsonl",
+                key="bulk_export_button",
+                on_click="ignore",
+            )
+
+    def display_diagnostics(self):
+        st.subheader("Diagnostics")
+        st.caption("Collected since the server process started, over all sessions. Percentiles cover the latest samples.")
+
+        st.markdown("#### Timings (ms)")
+        timings = metrics.rows("timers")
+        if timings:
+            st.dataframe(pd.DataFrame(timings).round(3), hide_index=True)
+        else:
+            st.write("Nothing timed yet.")
+
+        st.markdown("#### Bytes per Persist and Elements per Page")
+        observations = metrics.rows("observations")
+        if observations:
+            st.dataframe(pd.DataFrame(observations).round(1), hide_index=True)
+        else:
+            st.write("Nothing observed yet.")
+
+        export_column, reset_column = st.columns([2, 4])
+        with export_column:
+            if st.button("Write Prometheus File", key="write_metrics_button"):
+                st.success(f"Metrics written to {metrics.write_prometheus()}")
+        with reset_column:
+            if st.button("Reset Metrics", key="reset_metrics_button"):
+                metrics.reset()
+                st.rerun()
+
+        st.markdown("#### Profiling")
+        # Kept outside the widget state so it survives navigating to other pages
+        st.session_state.profile_reruns = st.toggle(
+            "Profile every rerun with cProfile (slows the app down)", value=st.session_state.get("profile_reruns", False)
+        )
+        if st.session_state.get("last_profile"):
+            page, report = st.session_state.last_profile
+            with st.expander(f"Last profiled rerun: {page}"):
+                st.code(report)
@@ -1,10 +1,54 @@
+import cProfile
+import functools
+import io
+import pstats
 import streamlit as st
+from streamlit.delta_generator import DeltaGenerator
 from inventory_system import InventorySystem
 from user import User
+from role_permission import RolePermission
+from repository import get_manager
+from permissions import acting_as, has_permission
+from instrumentation import element_counter, metrics, timed
+
+# Permissions a page needs; pages not listed here are open to every logged-in user
+PAGE_PERMISSIONS = {
+    "view_product": ("view_product",),
+    "product_management": ("view_product",),
+    "add_product": ("add_product",),
+    "update_product": ("edit_product",),
+    "scan_session": ("edit_product",),
+    "user_management": ("view_user",),
+    "add_user": ("add_user",),
+    "update_user": ("edit_user",),
+    "role_permission_management": ("view_roles",),
+    "add_role": ("add_role",),
+    "update_role": ("edit_role",),
+    "diagnostics": ("view_diagnostics",),
+}
+
+def install_element_counter():
+    """
+    Counts every element (widget, text, table...) Streamlit emits, per script thread.
+
+    The counter lives in the instrumentation module: this script's globals are
+    recreated on every rerun, but the patched method stays installed.
+    """
+    original = DeltaGenerator._enqueue
+    if getattr(original, "counts_elements", False):
+        return
+
+    @functools.wraps(original)
+    def _enqueue(self, *args, **kwargs):
+        element_counter.count = getattr(element_counter, "count", 0) + 1
+        return original(self, *args, **kwargs)
+
+    _enqueue.counts_elements = True
+    DeltaGenerator._enqueue = _enqueue
 
 def login_screen():
     st.title("Login")
-    user_manager = User()  # Assuming User class handles login verification
+    user_manager = get_manager(User)  # Assuming User class handles login verification
 
     # Login form with automatic submission on Enter
     with st.form(key="login_form"):
@@ -36,35 +80,48 @@ def check_session_status():
     else:
         st.session_state.logged_in = False
 
-def display_sidebar(role):
+def display_sidebar(mask):
     st.sidebar.title("Inventory System")
     # Button to Home
     if st.sidebar.button("Home"):
         st.session_state.page = "home"
 
-    if role == "admin":
-        #st.sidebar.write("Admin Options:")
-
-        # Button to Manage Products
-        if st.sidebar.button("Manage Products"):
+    # Buttons are shown per permission bit of the logged-in role
+    if has_permission(mask, "view_product"):
+        label = "Manage Products" if has_permission(mask, "add_product") else "View Products"
+        if st.sidebar.button(label):
             st.session_state.page = "product_management"
 
-        # Button to Manage Users
-        if st.sidebar.button("Manage Users"):
-            st.session_state.page = "user_management"
+    # Batched stock movements from a barcode scanner
+    if has_permission(mask, "edit_product") and st.sidebar.button("Scan Session"):
+        st.session_state.page = "scan_session"
 
-        # Button to Manage Role & Permissions
-        if st.sidebar.button("Role Permissions"):
-            st.session_state.page = "role_permission_management"
-    else:
-        if st.sidebar.button("View Products"):
-            st.session_state.page = "product_management"
+    # Button to Manage Users
+    if has_permission(mask, "view_user") and st.sidebar.button("Manage Users"):
+        st.session_state.page = "user_management"
+
+    # Button to Manage Role & Permissions
+    if has_permission(mask, "view_roles") and st.sidebar.button("Role Permissions"):
+        st.session_state.page = "role_permission_management"
 
-def display_modules():
+    # Button to bulk Import / Export products and users
+    if (has_permission(mask, "add_product", "edit_product") or has_permission(mask, "add_user", "edit_user")) \
+            and st.sidebar.button("Import / Export"):
+        st.session_state.page = "bulk_import_export"
+
+    # Timings, counters and profiling of the running server
+    if has_permission(mask, "view_diagnostics") and st.sidebar.button("Diagnostics"):
+        st.session_state.page = "diagnostics"
+
+def display_modules(mask):
     
     if 'page' not in st.session_state:
         st.session_state.page = "home" 
 
+    if not has_permission(mask, *PAGE_PERMISSIONS.get(st.session_state.page, ())):
+        st.error("You do not have permission to view this page.")
+        return
+
     # Initialize the inventory system
     inventory_system = InventorySystem()
 
@@ -78,6 +135,8 @@ def display_modules():
         inventory_system.display_update_product_form()  # Display the Update Product form
     elif st.session_state.page == "product_management":
         inventory_system.display_product_management()  # Display Product List
+    elif st.session_state.page == "scan_session":
+        inventory_system.display_scan_session()  # Display the batched stock scan page
     elif st.session_state.page == "add_user":
         inventory_system.display_add_user_form()  # Display Add User form
     elif st.session_state.page == "update_user":
@@ -90,6 +149,10 @@ def display_modules():
         inventory_system.display_add_role_form()
     elif st.session_state.page == "update_role":
         inventory_system.display_update_role_form()
+    elif st.session_state.page == "bulk_import_export":
+        inventory_system.display_bulk_import_export()  # Display bulk Import / Export
+    elif st.session_state.page == "diagnostics":
+        inventory_system.display_diagnostics()  # Display timings and profiling
         
 def main():
 
@@ -99,8 +162,10 @@ def main():
 
     if st.session_state.logged_in:
         role = st.session_state.get("role", "user")
+        # The role's permissions are compiled to a bitmask once per role change
+        mask = get_manager(RolePermission).mask_for(role)
         # Show menus sidebar
-        display_sidebar(role)
+        display_sidebar(mask)
 
         # Optional logout button to clear session and reset query params
         if st.button("Logout"):
@@ -108,11 +173,29 @@ def main():
             st.query_params = {}  # Clear query parameters
             st.rerun()
         
-        # Display modules based on condition
-        display_modules()
+        # Display modules based on condition; manager calls check the same mask.
+        # Each rerun is timed per page, and optionally profiled (see the diagnostics page)
+        page = st.session_state.get("page", "home")
+        profiler = cProfile.Profile() if st.session_state.get("profile_reruns") else None
+        element_counter.count = 0
+        with acting_as(mask), timed(f"rerun.{page}"):
+            if profiler:
+                profiler.enable()
+            try:
+                display_modules(mask)
+            finally:
+                if profiler:
+                    profiler.disable()
+                    report = io.StringIO()
+                    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(30)
+                    st.session_state.last_profile = (page, report.getvalue())
+                metrics.observe(f"elements.{page}", element_counter.count)
         
     else:
         login_screen()
 
-# Main execution start here...        
-main()
\ No newline at end of file
+# Main execution start here; Streamlit runs this file as __main__, while
+# importing it (e.g. from tests or the API process) renders nothing
+if __name__ == "__main__":
+    install_element_counter()
+    main()
@@ -0,0 +1,30 @@
+"""
+One-shot migration of the JSON data files into the SQLite database.
+
+Usage (from this directory):
+    python migrate_to_sqlite.py [database file]
+
+Afterwards start the app with INVENTORY_STORAGE=sqlite. Tables that already
+exist are overwritten with the current contents of the JSON files.
+"""
+import sys
+
+from storage import SqliteStorage
+
+DATA_FILES = [
+    ("data/products.json", "product_id"),
+    ("data/users.json", "user_id"),
+    ("data/roles.json", "role_id"),
+]
+
+
+def main():
+    db_file = sys.argv[1] if len(sys.argv) > 1 else None
+    for data_file, key_field in DATA_FILES:
+        storage = SqliteStorage(data_file, key_field, db_file=db_file)
+        storage.import_json()
+        print(f"Migrated {len(storage.load())} records from {data_file} into {storage.db_file}:{storage.table}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import heapq
+
+# Markers around every indexed text, so "^ab" style grams anchor prefix queries
+START, END = "\x02", "\x03"
+
+
+class NgramIndex:
+    """
+    Inverted n-gram (trigram by default) index over one text field.
+
+    Every text is lower-cased and split into overlapping n-grams; each gram
+    maps to the set of record keys containing it. A substring query intersects
+    the posting sets of its own grams, smallest first, and then confirms the
+    few remaining candidates with a real substring test. Queries shorter than n
+    have no grams to look up and fall back to scanning the stored texts.
+
+    Add, update and remove only touch the grams of the record concerned.
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self.postings = {}
+        self.texts = {}
+
+    def _grams(self, text):
+        padded = START + text + END
+        return {padded[i:i + self.n] for i in range(len(padded) - self.n + 1)}
+
+    def add(self, key, text):
+        if key in self.texts:
+            self.remove(key)
+        text = "" if text is None else str(text).lower()
+        self.texts[key] = text
+        for gram in self._grams(text):
+            self.postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        text = self.texts.pop(key, None)
+        if text is None:
+            return
+        for gram in self._grams(text):
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+
+    def _candidates(self, pattern):
+        """Keys whose text contains every gram of pattern, or None if pattern is too short."""
+        grams = [pattern[i:i + self.n] for i in range(len(pattern) - self.n + 1)]
+        if not grams:
+            return None
+        postings = sorted((self.postings.get(gram, ()) for gram in set(grams)), key=len)
+        candidates = set(postings[0])
+        for keys in postings[1:]:
+            if not candidates:
+                break
+            candidates &= keys
+        return candidates
+
+    def search(self, query):
+        """Returns the set of keys whose text contains query (case-insensitive)."""
+        query = str(query).lower()
+        candidates = self._candidates(query)
+        if candidates is None:
+            return {key for key, text in self.texts.items() if query in text}
+        return {key for key in candidates if query in self.texts[key]}
+
+    def prefix(self, query):
+        """Returns the set of keys whose text starts with query (case-insensitive)."""
+        query = str(query).lower()
+        candidates = self._candidates(START + query)
+        if candidates is None:
+            return {key for key, text in self.texts.items() if text.startswith(query)}
+        return {key for key in candidates if self.texts[key].startswith(query)}
+
+    def ranked(self, query, limit=10):
+        """
+        Returns up to limit keys containing query, best match first.
+
+        Exact matches rank first, then prefixes, then matches at the start of a
+        word, then any other substring; ties go to the shorter text.
+        """
+        query = str(query).lower()
+
+        def score(key):
+            text = self.texts[key]
+            if text == query:
+                rank = 0
+            elif text.startswith(query):
+                rank = 1
+            elif (" " + query) in text:
+                rank = 2
+            else:
+                rank = 3
+            return (rank, len(text), text)
+
+        return heapq.nsmallest(limit, self.search(query), key=score)
@@ -0,0 +1,196 @@
+import codecs
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+
+from record_index import normalize_id
+
+# Bytes read from the data file per parser refill
+CHUNK_SIZE = 1 << 20
+
+# Whitespace before the array, and separators between its elements
+_LEADING = re.compile(r"\s*")
+_SEPARATOR = re.compile(r"[\s,]*")
+
+# Columns of the index file, one value per record, sorted by key hash.
+# Each column is stored contiguously so searchsorted() runs on the mapped file.
+COLUMNS = (("hash", np.dtype("<u8")), ("offset", np.dtype("<u8")), ("length", np.dtype("<u4")))
+
+
+def iter_json_array(path, chunk_size=CHUNK_SIZE):
+    """
+    Streams the elements of a top-level JSON array from a file.
+
+    The file is read chunk by chunk and each element is decoded as soon as it
+    is complete, so the text of the whole file is never held in memory.
+
+    Yields:
+        tuple: (byte offset, byte length, element) for every element, in file order.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    # Records share their key strings, as they would with json.load
+    keys = {}
+    with open(path, "rb") as file:
+        buffer = ""
+        position = 0
+        # buffer[mark] is at byte mark_offset of the file; the mark only moves
+        # forward, so every character is encoded at most once
+        mark = 0
+        mark_offset = 0
+        is_ascii = True
+        eof = False
+        started = False
+
+        def byte_offset(index):
+            """Byte offset of buffer[index] in the file; moves the mark to index."""
+            nonlocal mark, mark_offset
+            # Files written by atomic_write_json are ASCII, where chars == bytes
+            mark_offset += index - mark if is_ascii else len(buffer[mark:index].encode("utf-8"))
+            mark = index
+            return mark_offset
+
+        while True:
+            position = (_SEPARATOR if started else _LEADING).match(buffer, position).end()
+            if position < len(buffer):
+                if not started:
+                    if buffer[position] != "[":
+                        raise ValueError(f"{path} does not contain a JSON array")
+                    started = True
+                    position += 1
+                    continue
+                if buffer[position] == "]":
+                    return
+                try:
+                    element, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    end = None
+                # An element ending exactly at the buffer end may be a cut-off number
+                if end is not None and (end < len(buffer) or eof):
+                    if isinstance(element, dict):
+                        element = {keys.setdefault(key, key): value for key, value in element.items()}
+                    start = byte_offset(position)
+                    yield start, byte_offset(end) - start, element
+                    position = end
+                    continue
+            elif eof:
+                if started:
+                    raise ValueError(f"{path} ends before its JSON array is closed")
+                raise ValueError(f"{path} is empty")
+
+            # Need more text: drop what was consumed and read the next chunk
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            byte_offset(position)
+            buffer = buffer[position:] + utf8.decode(chunk, final=eof)
+            position = mark = 0
+            is_ascii = buffer.isascii()
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class OffsetIndex:
+    """
+    On-disk index from record ID to the byte range of the record in a JSON data file.
+
+    Entries are (64-bit key hash, offset, length), sorted by hash and stored
+    column by column after a one-line JSON header that names the data file
+    signature they were built for. Lookups memory-map the columns and
+    binary-search the hashes, then
+    seek into the data file and decode just that record, so a single product
+    can be served without loading the catalog.
+    """
+
+    def __init__(self, path, data_file, key_field):
+        self.path = path
+        self.data_file = data_file
+        self.key_field = key_field
+        self.columns = None
+        self.signature = None
+
+    def open(self, signature):
+        """Maps the index if it was built for signature; returns False if it is missing or stale."""
+        try:
+            with open(self.path, "rb") as file:
+                header = json.loads(file.readline())
+                start = file.tell()
+        except (FileNotFoundError, ValueError):
+            return False
+        # storage imports this module, so its helper is imported on use
+        from storage import comparable_signature
+
+        if header.get("signature") != comparable_signature(signature):
+            return False
+        count = header["count"]
+        columns = {}
+        for name, dtype in COLUMNS:
+            if count:
+                columns[name] = np.memmap(self.path, dtype=dtype, mode="r", offset=start, shape=(count,))
+            else:
+                columns[name] = np.zeros(0, dtype=dtype)
+            start += count * dtype.itemsize
+        self.columns = columns
+        self.signature = signature
+        return True
+
+    def build(self, signature, locations):
+        """
+        Writes a new index for the data file and maps it.
+
+        Parameters:
+            signature: file_signature() of the data file the locations belong to.
+            locations (iterable): (record ID, offset, length) in file order.
+        """
+        hashes, offsets, lengths = [], [], []
+        for key, offset, length in locations:
+            hashes.append(key_hash(normalize_id(key)))
+            offsets.append(offset)
+            lengths.append(length)
+        hashes = np.array(hashes, dtype=COLUMNS[0][1])
+        # Stable, so the first of duplicated IDs is found first (like RecordIndex)
+        order = np.argsort(hashes, kind="stable")
+        columns = [hashes[order], np.array(offsets, dtype=COLUMNS[1][1])[order], np.array(lengths, dtype=COLUMNS[2][1])[order]]
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".offsets")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write((json.dumps({"signature": signature, "count": len(hashes)}) + "\n").encode("ascii"))
+                for column in columns:
+                    file.write(column.tobytes())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.columns = None
+        self.open(signature)
+
+    def build_from_file(self, signature):
+        """Builds the index with one streaming pass over the data file, keeping no records."""
+        self.build(signature, (
+            (record.get(self.key_field), offset, length)
+            for offset, length, record in iter_json_array(self.data_file)
+        ))
+
+    def get(self, key):
+        """Returns the record with the given ID read straight from the data file, or None."""
+        key = normalize_id(key)
+        hashed = np.uint64(key_hash(key))
+        hashes = self.columns["hash"]
+        position = int(np.searchsorted(hashes, hashed))
+        with open(self.data_file, "rb") as file:
+            while position < len(hashes) and hashes[position] == hashed:
+                file.seek(int(self.columns["offset"][position]))
+                record = json.loads(file.read(int(self.columns["length"][position])))
+                if normalize_id(record.get(self.key_field)) == key:
+                    return record
+                position += 1
+        return None
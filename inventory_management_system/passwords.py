@@ -0,0 +1,87 @@
+import base64
+import functools
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# PBKDF2-SHA256 iterations for new hashes; raise it as hardware gets faster.
+# Stored hashes keep their own count and are upgraded on the next login.
+PASSWORD_ITERATIONS = int(os.environ.get("INVENTORY_PASSWORD_ITERATIONS", "600000"))
+# Logins hashing at the same time; a burst beyond this queues instead of
+# starving every other session of CPU
+PASSWORD_WORKERS = int(os.environ.get("INVENTORY_PASSWORD_WORKERS", "4"))
+
+ALGORITHM = "pbkdf2_sha256"
+
+# hashlib releases the GIL while it hashes, so the pool runs hashes in parallel
+# with the script threads of other sessions
+_pool = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="password-hash")
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+
+
+def hash_password(password, iterations=None):
+    """
+    Returns a salted hash of password, encoded as "pbkdf2_sha256$<iterations>$<salt>$<hash>".
+    """
+    iterations = iterations or PASSWORD_ITERATIONS
+    salt = os.urandom(16)
+    return f"{ALGORITHM}${iterations}${_b64(salt)}${_b64(_pbkdf2(password, salt, iterations))}"
+
+
+def is_hashed(value):
+    return isinstance(value, str) and value.startswith(ALGORITHM + "$")
+
+
+def needs_rehash(stored):
+    """True if stored is plaintext or was hashed with a different iteration count."""
+    if not is_hashed(stored):
+        return True
+    return int(stored.split("$")[1]) != PASSWORD_ITERATIONS
+
+
+@functools.cache
+def _dummy_hash():
+    # Checked when the username is unknown, so a miss costs as much as a wrong password
+    return hash_password("")
+
+
+def verify_password(password, stored):
+    """
+    Checks password against a stored hash in constant time.
+
+    Parameters:
+        password (str): Password as typed at login.
+        stored (str or None): Stored hash; None for an unknown user.
+
+    Returns:
+        bool: True if the password matches.
+    """
+    if not is_hashed(stored):
+        # Unknown user, or a record that has not been migrated yet: still pay
+        # for one hash so the response time does not reveal which it was
+        verify_password(password, _dummy_hash())
+        return stored is not None and hmac.compare_digest(str(password).encode("utf-8"), str(stored).encode("utf-8"))
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        candidate = _pbkdf2(str(password), base64.b64decode(salt), int(iterations))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(candidate, base64.b64decode(digest))
+
+
+def verify_password_async(password, stored):
+    """Runs verify_password on the hashing pool and returns its Future."""
+    return _pool.submit(verify_password, password, stored)
+
+
+def hash_passwords(passwords):
+    """Hashes several passwords on the pool, returning the hashes in the same order."""
+    return list(_pool.map(hash_password, passwords))
@@ -0,0 +1,101 @@
+import contextvars
+import functools
+import re
+import threading
+from contextlib import contextmanager
+
+# Known permissions, one bit each. Names found in roles.json that are not in
+# this list get the next free bit the first time they are seen.
+PERMISSIONS = [
+    "view_product", "add_product", "edit_product", "delete_product",
+    "view_user", "add_user", "edit_user", "delete_user",
+    "view_roles", "add_role", "edit_role", "delete_role",
+    "view_diagnostics",
+]
+_bits = {name: 1 << position for position, name in enumerate(PERMISSIONS)}
+_bits_lock = threading.Lock()
+
+# Mask of the user the current script run (or request) acts for; None means
+# trusted code such as migrations and maintenance scripts
+_current_mask = contextvars.ContextVar("permission_mask", default=None)
+
+
+class PermissionDenied(Exception):
+    """Raised when the acting user's role lacks a permission required by a manager method."""
+
+
+def permission_bit(name):
+    bit = _bits.get(name)
+    if bit is None:
+        with _bits_lock:
+            bit = _bits.setdefault(name, 1 << len(_bits))
+    return bit
+
+
+def parse_permissions(permission_level):
+    """Accepts a list of names or a comma/space separated string, as entered in the role forms."""
+    if isinstance(permission_level, str):
+        return [name for name in re.split(r"[\s,]+", permission_level) if name]
+    return [str(name).strip() for name in permission_level or [] if str(name).strip()]
+
+
+def compile_mask(role):
+    """Compiles a role record's permission_level into an integer bitmask."""
+    mask = 0
+    for name in parse_permissions(role.get("permission_level")):
+        mask |= permission_bit(name)
+    return mask
+
+
+def permissions_mask(*permissions):
+    mask = 0
+    for name in permissions:
+        mask |= permission_bit(name)
+    return mask
+
+
+def has_permission(mask, *permissions):
+    """True if mask grants every one of permissions."""
+    required = permissions_mask(*permissions)
+    return mask & required == required
+
+
+@contextmanager
+def acting_as(mask):
+    """Makes every guarded manager call inside the block check against mask."""
+    token = _current_mask.set(mask)
+    try:
+        yield
+    finally:
+        _current_mask.reset(token)
+
+
+def current_mask():
+    """Mask of the acting user, or None outside acting_as."""
+    return _current_mask.get()
+
+
+def check_permission(*permissions):
+    """Raises PermissionDenied unless the acting user holds every one of permissions."""
+    mask = _current_mask.get()
+    if mask is not None and not has_permission(mask, *permissions):
+        raise PermissionDenied(f"Permission '{', '.join(permissions)}' is required.")
+
+
+def requires_permission(*permissions):
+    """
+    Decorator guarding a manager method: the call raises PermissionDenied
+    unless the acting user (see acting_as) holds every one of permissions.
+    The required mask is compiled once, so each call is a single bit test.
+    """
+    required = permissions_mask(*permissions)
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            mask = _current_mask.get()
+            if mask is not None and mask & required != required:
+                raise PermissionDenied(f"Permission '{', '.join(permissions)}' is required.")
+            return method(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,52 +1,563 @@
 import json
+import os
+import threading
+from collections import Counter
 
+from storage import make_storage
+from record_index import RecordIndex, normalize_id
+from product_frame import ProductFrame
+from stock_index import StockIndex
+from aggregates import InventoryAggregates
+from stock_locations import StockLocations
+from product_record import ProductRecord
+from repository import ConflictError, write_transaction
+from write_behind import WriteBehind
+from permissions import requires_permission
+from instrumentation import instrument_methods
+
+# Reorder level used when neither the product nor its category defines one
+DEFAULT_REORDER_LEVEL = 10
+
+def in_range(value, bounds):
+    """True if value lies within (min, max); None bounds are open, non-numbers never match."""
+    low, high = bounds or (None, None)
+    if low is None and high is None:
+        return True
+    if not isinstance(value, (int, float)):
+        return False
+    return (low is None or value >= low) and (high is None or value <= high)
+
+@instrument_methods("product")
 class Product:
     def __init__(self, data_file="data/products.json"):
         self.data_file = data_file
+        # The instance is shared by all sessions, so mutations hold this lock
+        self.lock = threading.RLock()
+        # Hash index on product_id backing every lookup and mutation, plus
+        # trigram indexes for substring search on the text fields
+        self._index = RecordIndex("product_id", text_fields=("product_id", "name", "category"))
+        self._loaded = False
+        # JSON file, snapshot + journal or SQLite table, depending on INVENTORY_STORAGE.
+        # Records are held as compact ProductRecords rather than dicts.
+        self.storage = make_storage(data_file, "product_id", record_type=ProductRecord)
+        # Columnar copy for query_products(), rebuilt lazily after a mutation
+        self.frame = None
+        # Per-category reorder levels, stored next to the data file
+        self.reorder_levels_file = os.path.join(os.path.dirname(data_file), "reorder_levels.json")
+        # Running dashboard totals, saved next to the data file
+        self.aggregates_file = os.path.splitext(data_file)[0] + ".aggregates.json"
+        # Append-only stock movement history, one partition per location;
+        # stock_quantity is a cache of the product's balance over all of them
+        self.locations = StockLocations(data_file)
+        # Writes changes now or in batches, depending on INVENTORY_DURABILITY; the
+        # totals are saved after each write, tagged with the files' new signature
+        self.writer = WriteBehind(
+            self, on_flush=lambda: self.aggregates.save(self.aggregates_file, self.storage.known_signature)
+        )
         self.load_data()
 
+    @property
+    def products(self):
+        with self.lock:
+            return self.index.records()
+
+    @property
+    def snapshot(self):
+        """
+        Changes whenever the catalog does, without loading it: the record list
+        once loaded, before that the storage signature (compare by identity).
+        """
+        if not self._loaded:
+            return self.storage.known_signature
+        return self.products
+
+    @property
+    def ledger(self):
+        """The movement ledger of the default location, which holds the opening balance of every product."""
+        return self.locations.partition(self.locations.default)
+
+    @property
+    def index(self):
+        """The in-memory catalog; it is loaded from storage on first use after load_data()."""
+        if not self._loaded:
+            with self.lock:
+                if not self._loaded:
+                    self._load_records()
+        return self._index
+
     def load_data(self):
-        with open(self.data_file, "r") as file:
-            self.products = json.load(file)
+        """
+        Prepares the manager for the current data file without parsing it.
+
+        The dashboard totals come from their saved copy (or a streaming pass if
+        it is stale), and get_product_by_id is answered through the storage's
+        on-disk lookup. The catalog itself is only materialised by the first
+        call that needs all products.
+        """
+        with self.lock:
+            self._loaded = False
+            self.storage.known_signature = self.storage.signature()
+            self.aggregates = InventoryAggregates.load(
+                self.aggregates_file, self.storage.known_signature, self.storage.iter_records
+            )
+            self._aggregates_signature = self.storage.known_signature
+            self.reorder_levels = self.load_reorder_levels()
+            self.locations.refresh()
+            # Sorted stock indexes, built on first use and then maintained by every mutation
+            self.stock_index = None
+            self.reorder_index = None
+            self.frame = None
+
+    def _load_records(self):
+        records = self.storage.load()
+        self._index.load(records)
+        self._loaded = True
+        if self.storage.known_signature != self._aggregates_signature:
+            # The file changed between load_data() and now
+            self.aggregates = InventoryAggregates.recompute(records)
+            self._aggregates_signature = self.storage.known_signature
+        self._reconcile_stock()
+
+    def _reconcile_stock(self):
+        """
+        Brings cached stock_quantity values in line with the ledgers (e.g. after
+        a crash between the two writes). Skipped on a terminal that loads only
+        some locations, which cannot add up the totals.
+        """
+        for key, balance in self.locations.ledger_totals().items():
+            record = self.index.get(key)
+            if record is not None and record.get("stock_quantity") != balance:
+                self.aggregates.remove(record)
+                record["stock_quantity"] = balance
+                self.aggregates.add(record)
+
+    def load_reorder_levels(self):
+        """Reads {"default": n, "categories": {category: n}}; a missing file means defaults only."""
+        try:
+            with open(self.reorder_levels_file, "r") as file:
+                levels = json.load(file)
+        except FileNotFoundError:
+            levels = {}
+        levels.setdefault("default", DEFAULT_REORDER_LEVEL)
+        levels.setdefault("categories", {})
+        return levels
+
+    def reorder_level(self, product):
+        """Stock level at or below which a product needs reordering: its own, its category's or the default."""
+        level = product.get("reorder_level")
+        if level is None:
+            level = self.reorder_levels["categories"].get(product.get("category"), self.reorder_levels["default"])
+        return level
+
+    def _reorder_slack(self, product):
+        stock = product.get("stock_quantity")
+        if not isinstance(stock, (int, float)):
+            return None
+        return stock - self.reorder_level(product)
+
+    def _build_stock_indexes(self):
+        if self.stock_index is None:
+            items = self.index.items()
+            self.stock_index = StockIndex((key, prod.get("stock_quantity")) for key, prod in items)
+            self.reorder_index = StockIndex((key, self._reorder_slack(prod)) for key, prod in items)
+
+    def _stock_changed(self, old_key, product=None):
+        """Moves a product inside the stock indexes after it was added, updated (product) or deleted."""
+        if self.stock_index is None:
+            return
+        self.stock_index.remove(normalize_id(old_key))
+        self.reorder_index.remove(normalize_id(old_key))
+        if product is not None:
+            key = normalize_id(product.get("product_id"))
+            self.stock_index.set(key, product.get("stock_quantity"))
+            self.reorder_index.set(key, self._reorder_slack(product))
 
     def save_data(self):
-        with open(self.data_file, "w") as file:
-            json.dump(self.products, file, indent=4)
+        with write_transaction(self, refresh=False):
+            self.storage.save(self.index.records())
+            self.writer.clear()
+            self.aggregates.save(self.aggregates_file, self.storage.known_signature)
+            self.locations.checkpoint()
+
+    def _persist(self, op, product_id, product=None):
+        # The writer saves the totals after the change (see __init__)
+        self.writer.record_change(op, product_id, product)
+
+    def _stock_movements(self, old_stock, record, movements):
+        """
+        Queues the ledger movements ({location: [movement]}) that take a
+        product from old_stock to its new stock_quantity. Direct edits are
+        booked as adjustments at the home location (StockLocations.home); a
+        product without history first gets an opening adjustment of its old
+        stock at the default location.
+        """
+        new_stock = record.get("stock_quantity")
+        if not isinstance(new_stock, int) or isinstance(new_stock, bool):
+            return
+        home = self.locations.home
+        # The total over every location; a terminal that does not have every
+        # partition loaded trusts the cached stock_quantity instead
+        balance = self.locations.ledger_total(record["product_id"])
+        if balance is None:
+            balance = old_stock if isinstance(old_stock, int) and not isinstance(old_stock, bool) else 0
+            opening = self.locations.opening(record["product_id"], balance, home)
+            if opening:
+                movements.setdefault(self.locations.default, []).extend(opening)
+        if new_stock != balance:
+            movements.setdefault(home, []).append((record["product_id"], "adjustment", new_stock - balance, None))
+
+    def _insert(self, product, movements):
+        product = ProductRecord.from_mapping(product)
+        # Every record carries a version that each update increments (optimistic concurrency)
+        product.setdefault("version", 1)
+        self.index.put(product)
+        self._stock_changed(product["product_id"], product)
+        self.aggregates.add(product)
+        self._stock_movements(None, product, movements)
+        return product
+
+    def _update(self, product_id, updated_product, movements):
+        record = self.index.get(product_id)
+        if record is None:
+            return None
+        old_stock = record.get("stock_quantity")
+        # Take the old values out of the totals before the record changes in place
+        self.aggregates.remove(record)
+        self.index.update(product_id, dict(updated_product, version=record.get("version", 0) + 1))
+        self.aggregates.add(record)
+        self._stock_changed(product_id, record)
+        self._stock_movements(old_stock, record, movements)
+        return record
 
+    @requires_permission("add_product")
     def add_product(self, product):
-        self.products.append(product)
-        self.save_data()
+        with write_transaction(self):
+            # Product IDs are unique; adding an existing one would shadow it
+            if product["product_id"] in self.index:
+                return False
+            movements = {}
+            product = self._insert(product, movements)
+            # The ledger is written first: it is the source of truth for stock
+            self.locations.book(movements)
+            self._persist("put", product["product_id"], product)
+            return True
+
+    @requires_permission("edit_product")
+    def update_product(self, product_id, updated_product, expected_version=None):
+        """
+        Applies updated_product to the product with the given ID.
+
+        Pass the version the caller read as expected_version to make this a
+        compare-and-swap: if anyone updated the product since, ConflictError is
+        raised and nothing is written.
+        """
+        with write_transaction(self):
+            current = self.index.get(product_id)
+            if expected_version is not None and current is not None and current.get("version", 0) != expected_version:
+                raise ConflictError(f"Product '{product_id}' was changed by someone else.")
+            movements = {}
+            record = self._update(product_id, updated_product, movements)
+            if record is None:
+                return False
+            self.locations.book(movements)
+            self._persist("put", product_id, record)
+            return True
+
+    @requires_permission("add_product", "edit_product")
+    def upsert_products(self, products, persist=True):
+        """
+        Inserts or updates (matched on product_id) a batch of products.
+
+        With persist=False the changes stay in memory until save_data() is
+        called, so a bulk import can write the data file once at the end.
 
-    def update_product(self, product_id, updated_product):
-        for idx, prod in enumerate(self.products):
-            if prod["product_id"] == product_id:
-                self.products[idx].update(updated_product)
+        Returns:
+            tuple: (number inserted, number updated)
+        """
+        inserted = updated = 0
+        with write_transaction(self):
+            movements = {}
+            for product in products:
+                if self._update(product["product_id"], product, movements) is None:
+                    self._insert(product, movements)
+                    inserted += 1
+                else:
+                    updated += 1
+            # One ledger write for the whole batch
+            self.locations.book(movements)
+            if persist:
                 self.save_data()
-                return True
-        return False
+        return inserted, updated
 
+    @requires_permission("delete_product")
     def delete_product(self, product_id):
-        # Filter out the product with the matching product_id
-        updated_products = [prod for prod in self.products if prod["product_id"] != product_id]
+        with write_transaction(self):
+            product = self.index.pop(product_id)
+            if product is None:
+                # If no product was found with the given ID
+                return True
+            # Take its stock off every location, or the location totals would keep counting it
+            self.locations.refresh()
+            self.locations.book(self.locations.closing(product_id))
+            self._stock_changed(product_id)
+            self.aggregates.remove(product)
+            self._persist("delete", product_id)
+            return True
+
+    @requires_permission("edit_product")
+    def record_movements(self, movements, location=None):
+        """
+        Books stock movements and updates the cached stock_quantity of each product.
+
+        Parameters:
+            movements (list): (product_id, kind, quantity) tuples, kind being
+                "receipt", "sale" or "adjustment". Receipt and sale quantities
+                are positive; adjustments are signed.
+            location (str, optional): Location the movements happen at (default: the default location).
+
+        Returns:
+            bool: False (and nothing is written) if a product does not exist or
+            a movement would take its stock at the location below zero.
+        """
+        location = location or self.locations.default
+        with write_transaction(self):
+            # Transfers do not touch the data file, so the reload may not have seen them
+            self.locations.refresh()
+            stock = {}
+            change = {}
+            opening = []
+            for product_id, kind, quantity in movements:
+                key = normalize_id(product_id)
+                record = self.index.get(key)
+                if record is None:
+                    return False
+                if key not in stock:
+                    # First movement of a product: open its history with the current stock
+                    current = record.get("stock_quantity") or 0
+                    opening += self.locations.opening(key, current, location)
+                    stock[key] = self.locations.stock(key, location, current)
+                    change[key] = 0
+                delta = -abs(quantity) if kind == "sale" else abs(quantity) if kind == "receipt" else quantity
+                stock[key] += delta
+                change[key] += delta
+                if stock[key] < 0:
+                    return False
 
-        # If the list size has changed, update the products and save the data
-        if len(updated_products) != len(self.products):
-            self.products = updated_products
-            self.save_data()
+            booked = [(product_id, kind, quantity, None) for product_id, kind, quantity in movements]
+            if location == self.locations.default:
+                self.ledger.append(opening + booked)
+            else:
+                # The opening goes first: until it is booked the stock counts as being at the default location
+                self.ledger.append(opening)
+                self.locations.append(location, booked)
+            for key in stock:
+                record = self.index.get(key)
+                self.aggregates.remove(record)
+                stock_quantity = (record.get("stock_quantity") or 0) + change[key]
+                self.index.update(key, {"stock_quantity": stock_quantity, "version": record.get("version", 0) + 1})
+                self.aggregates.add(record)
+                self._stock_changed(key, record)
+            # One write for every product the movements touched
+            self.writer.record_changes([("put", key, self.index.get(key)) for key in stock])
             return True
-        else:
-            # If no product was found with the given ID
+
+    def apply_remote_changes(self, changes, signature):
+        """
+        Applies products written by another instance (see change_bus) to the
+        catalog, stock indexes and totals instead of reloading the data file.
+
+        Parameters:
+            changes (list): [op, key, record] entries as published by the writer.
+            signature: The storage signature after those changes.
+        """
+        with self.lock:
+            # The writer booked its stock movements before publishing
+            self.locations.refresh()
+            if not self._loaded:
+                # No catalog to patch; load_data() reads the totals the writer saved
+                self.load_data()
+                return
+            for op, key, record in changes:
+                old = self.index.get(key)
+                if old is not None:
+                    self.aggregates.remove(old)
+                if op == "delete":
+                    self.index.pop(key)
+                    self._stock_changed(key)
+                    continue
+                record = self.index.replace(key, ProductRecord(record))
+                self.aggregates.add(record)
+                self._stock_changed(key, record)
+            self.storage.known_signature = signature
+            self._aggregates_signature = signature
+
+    def record_movement(self, product_id, kind, quantity, location=None):
+        """Books a single stock movement; see record_movements."""
+        return self.record_movements([(product_id, kind, quantity)], location)
+
+    @requires_permission("edit_product")
+    def transfer_stock(self, product_id, quantity, source, target):
+        """
+        Moves units of a product from one location to another.
+
+        The transfer is one record in the transfer ledger, so it is booked
+        completely or not at all. The product's stock_quantity (its total over
+        all locations) does not change, so the data file is not written.
+
+        Returns:
+            bool: False if the product does not exist, the quantity is not
+            positive, the locations are the same or source holds fewer units.
+        """
+        if quantity <= 0 or source == target:
+            return False
+        with write_transaction(self):
+            self.locations.refresh()
+            record = self.index.get(product_id)
+            if record is None:
+                return False
+            current = record.get("stock_quantity") or 0
+            if self.locations.stock(product_id, source, current) < quantity:
+                return False
+            # A product that never moved is first given a history at the default location
+            self.ledger.append(self.locations.opening(product_id, current, target))
+            self.locations.transfer(product_id, source, target, quantity)
             return True
 
+    @requires_permission("view_product")
+    def stock_at(self, location):
+        """Units per product at a location: {product key: units} (see StockLocations.stock_at)."""
+        with self.lock:
+            self.locations.refresh()
+            catalog = ()
+            if location == self.locations.default:
+                catalog = ((key, prod.get("stock_quantity")) for key, prod in self.index.items())
+            return self.locations.stock_at(location, catalog)
+
+    @requires_permission("view_product")
+    def location_totals(self):
+        """Units in stock per location, from the per-partition totals: {location: units}."""
+        with self.lock:
+            self.locations.refresh()
+            return self.locations.totals(self.aggregates.total_units)
+
+    @requires_permission("view_product")
+    def units_moved(self, days=30, kind="sale", product_id=None):
+        """Units sold (or received/adjusted) per product over the last days, from the ledgers' daily rollups."""
+        with self.lock:
+            return self.locations.units_moved(days, kind, product_id)
+
+    def _query_storage(self, **criteria):
+        """
+        Cold start: answers a query from the storage's indexed columns instead of
+        materialising the catalog. Returns None once the catalog is loaded, or if
+        the storage cannot run queries.
+        """
+        if self._loaded or not self.storage.supports_queries:
+            return None
+        with self.lock:
+            if self._loaded:
+                return None
+            products = self.storage.query(**criteria)
+            for product in products:
+                balance = self.locations.ledger_total(product.get("product_id"))
+                if balance is not None:
+                    product["stock_quantity"] = balance
+            return products
+
+    @requires_permission("view_product")
     def search_products(self, query):
-        return [prod for prod in self.products if query.lower() in prod["name"].lower()]
+        products = self._query_storage(contains={"name": query})
+        if products is not None:
+            return products
+        with self.lock:
+            return self.index.search("name", query)
 
+    @requires_permission("view_product")
+    def suggest_products(self, query, limit=10):
+        """Type-ahead: up to limit products whose name contains query, best match first."""
+        with self.lock:
+            return self.index.ranked_search("name", query, limit)
+
+    @requires_permission("view_product")
     def filter_products(self, low_stock_threshold):
-        return [prod for prod in self.products if prod["stock_quantity"] <= low_stock_threshold]
-    
+        products = self._query_storage(ranges={"stock_quantity": (None, low_stock_threshold)}, order_by="stock_quantity")
+        if products is not None:
+            return products
+        # Served from the sorted stock index: O(log n + k), lowest stock first
+        with self.lock:
+            self._build_stock_indexes()
+            return [self.index.get(key) for key in self.stock_index.at_most(low_stock_threshold)]
+
+    def low_stock_products(self):
+        """Returns the products at or below their reorder level, most urgent first."""
+        with self.lock:
+            self._build_stock_indexes()
+            return [self.index.get(key) for key in self.reorder_index.at_most(0)]
+
+    def low_stock_counts(self, products=None):
+        """Returns {category: number of low-stock products}, largest first."""
+        if products is None:
+            products = self.low_stock_products()
+        return dict(Counter(prod.get("category") for prod in products).most_common())
+
+    @requires_permission("view_product")
+    def query_products(self, product_id=None, name=None, category=None, stock_range=None, price_range=None, location=None):
+        """
+        Composite product filter: returns the products matching every given criterion.
+
+        Text criteria are answered by the trigram indexes; the ranges are then
+        checked on those candidates only. Range-only queries run as vectorised
+        masks over a columnar copy of the catalog (see ProductFrame), which is
+        rebuilt on the first query after a mutation.
+
+        With a location, only the products that are or were stocked there
+        (for the default location: every product) match, and stock_range applies to the units
+        at that location.
+
+        Until the catalog is loaded, queries without a location are answered by
+        the storage's indexed columns if it has them (sqlite).
+        """
+        if not location:
+            products = self._query_storage(
+                contains={"product_id": product_id, "name": name, "category": category},
+                ranges={"stock_quantity": stock_range, "price": price_range},
+            )
+            if products is not None:
+                return products
+        with self.lock:
+            keys = None
+            for field, value in (("product_id", product_id), ("name", name), ("category", category)):
+                if value:
+                    matches = self.index.text_index(field).search(value)
+                    keys = matches if keys is None else keys & matches
+            if location:
+                stock = self.stock_at(location)
+                located = {key for key in stock if key in self.index}
+                keys = located if keys is None else keys & located
+                return [
+                    prod for prod in self.index.records_for(keys)
+                    if in_range(stock[normalize_id(prod.get("product_id"))], stock_range) and in_range(prod.get("price"), price_range)
+                ]
+            if keys is not None:
+                return [
+                    prod for prod in self.index.records_for(keys)
+                    if in_range(prod.get("stock_quantity"), stock_range) and in_range(prod.get("price"), price_range)
+                ]
+
+            records = self.index.records()
+            if self.frame is None or self.frame.records is not records:
+                self.frame = ProductFrame(records)
+            frame = self.frame
+        return frame.query(stock_range=stock_range, price_range=price_range)
+
     def get_product_by_id(self, product_id):
-        
-        for prod in self.products:
-            if prod["product_id"] == product_id:
-                return prod
-        return None
+        if not self._loaded and self.storage.supports_lookup:
+            # Cold start: read just this record instead of materialising the catalog
+            with self.lock:
+                if not self._loaded:
+                    product = self.storage.lookup(product_id)
+                    balance = self.locations.ledger_total(product_id)
+                    if product is not None and balance is not None:
+                        product["stock_quantity"] = balance
+                    return product
+        return self.index.get(product_id)
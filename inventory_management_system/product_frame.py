@@ -0,0 +1,70 @@
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+# Arrow-backed strings run str.contains() in native code instead of a Python loop
+STRING_DTYPE = "string[pyarrow]" if importlib.util.find_spec("pyarrow") else "string"
+
+
+class ProductFrame:
+    """
+    Columnar copy of the product catalog used for vectorised filtering.
+
+    Text columns are lower-cased once when the frame is built and numeric
+    columns get float dtypes, so a filter is a handful of boolean masks over
+    whole columns instead of a Python loop over every product. Row i of the
+    frame is records[i], which is how matches are mapped back to the records.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        # Built column by column: from_records() goes through a slow path for
+        # records that are mappings but not dicts (ProductRecord)
+        frame = pd.DataFrame({
+            field: [record.get(field) for record in records]
+            for field in ("product_id", "name", "category", "price", "stock_quantity")
+        })
+        self.product_id = self._lowered(frame["product_id"])
+        self.name = self._lowered(frame["name"])
+        # Few distinct categories: match against those and compare integer codes
+        self.category = pd.Categorical(frame["category"].astype(str).str.lower())
+        # Missing or malformed numbers become NaN, which never matches a range
+        self.price = pd.to_numeric(frame["price"], errors="coerce").to_numpy(dtype=np.float64)
+        self.stock_quantity = pd.to_numeric(frame["stock_quantity"], errors="coerce").to_numpy(dtype=np.float64)
+
+    @staticmethod
+    def _lowered(column):
+        return column.astype(str).astype(STRING_DTYPE).str.lower()
+
+    def query(self, product_id=None, name=None, category=None, stock_range=None, price_range=None):
+        """
+        Returns the records matching every given criterion (AND).
+
+        Parameters:
+            product_id (str, optional): Substring of the product ID.
+            name (str, optional): Substring of the product name.
+            category (str, optional): Substring of the category.
+            stock_range (tuple, optional): (min, max) stock quantity, either bound may be None.
+            price_range (tuple, optional): (min, max) price, either bound may be None.
+
+        Returns:
+            list: Matching records in catalog order.
+        """
+        mask = np.ones(len(self.records), dtype=bool)
+        for column, value in ((self.product_id, product_id), (self.name, name)):
+            if value:
+                mask &= column.str.contains(str(value).lower(), regex=False).to_numpy(dtype=bool, na_value=False)
+        if category:
+            matching = [code for code, text in enumerate(self.category.categories) if str(category).lower() in text]
+            mask &= np.isin(self.category.codes, matching)
+        for column, bounds in ((self.stock_quantity, stock_range), (self.price, price_range)):
+            low, high = bounds or (None, None)
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+
+        if mask.all():
+            return self.records
+        return list(map(self.records.__getitem__, np.flatnonzero(mask).tolist()))
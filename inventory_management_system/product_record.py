@@ -0,0 +1,117 @@
+import sys
+from collections.abc import Mapping, MutableMapping
+
+# Fields every product has get a slot; anything else (reorder_level, fields
+# added by imports...) goes to a per-record dict that most records never need
+FIELDS = ("product_id", "name", "category", "price", "stock_quantity", "version")
+_FIELD_SET = frozenset(FIELDS)
+# Stands for an unset slot in getattr() defaults (None is a valid field value)
+_MISSING = object()
+
+
+class ProductRecord(MutableMapping):
+    """
+    Compact, dict-compatible product record.
+
+    A plain dict costs ~200 bytes per product before its values; a slotted
+    object with the same fields costs about a third of that. Category names
+    repeat across the whole catalog, so they are interned and every product
+    of a category shares one string. The class is a MutableMapping, so
+    record["name"], record.get(...), dict(record), update() and "in" work as
+    they did with dicts. The JSON writers encode it with to_json_default().
+    """
+
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, data=(), **fields):
+        self.extra = None
+        if type(data) is dict and not fields:
+            # Fast path for freshly parsed records: skip MutableMapping.update()
+            for key, value in data.items():
+                if key in _FIELD_SET:
+                    if key == "category" and type(value) is str:
+                        value = sys.intern(value)
+                    setattr(self, key, value)
+                else:
+                    self[key] = value
+        else:
+            self.update(data, **fields)
+
+    @classmethod
+    def from_mapping(cls, data):
+        """Returns data as a ProductRecord (records are returned unchanged)."""
+        return data if isinstance(data, cls) else cls(data)
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def get(self, key, default=None):
+        # Hot path of every index and filter, so skip the KeyError round trip
+        if key in _FIELD_SET:
+            return getattr(self, key, default)
+        return self.extra.get(key, default) if self.extra else default
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            if key == "category" and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self.extra and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return hasattr(self, key)
+        return bool(self.extra) and key in self.extra
+
+    def __iter__(self):
+        for field in FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self):
+        # Called for every record the JSON writers encode, so no __iter__/__getitem__ round trips
+        data = {field: value for field in FIELDS if (value := getattr(self, field, _MISSING)) is not _MISSING}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def copy(self):
+        return ProductRecord(self)
+
+
+def to_json_default(value):
+    """json.dump(default=...) hook: encodes ProductRecord (and other mappings) as objects."""
+    if type(value) is ProductRecord:
+        return value.to_dict()
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,145 @@
+from ngram_index import NgramIndex
+
+
+def normalize_id(value):
+    """
+    Normalises a record ID so that 1, "1" and " 1 " all map to the same key.
+
+    The JSON files mix integer and string IDs (forms submit strings), so every
+    lookup goes through this function before touching an index.
+    """
+    if value is None:
+        return None
+    return str(value).strip()
+
+
+class RecordIndex:
+    """
+    Insertion-ordered hash index of records keyed on their normalised primary key.
+
+    Lookups, inserts, updates and deletes are O(1). The list returned by
+    records() is a snapshot that is rebuilt lazily after a mutation, so readers
+    in other sessions never iterate a container that is being modified.
+
+    Fields listed in text_fields can be searched by substring through an
+    NgramIndex. Each one is built on its first search and from then on kept
+    up to date by put/update/pop.
+    """
+
+    def __init__(self, key_field, records=(), text_fields=()):
+        self.key_field = key_field
+        self.text_fields = text_fields
+        self.load(records)
+
+    def load(self, records):
+        self._records = {}
+        for record in records:
+            # Keep the first occurrence of a duplicated ID, like the old linear scans did
+            self._records.setdefault(normalize_id(record.get(self.key_field)), record)
+        # Insertion sequence of every key, used to return search hits in record order
+        self._sequence = {key: position for position, key in enumerate(self._records)}
+        self._next_sequence = len(self._sequence)
+        self._text_indexes = {}
+        self._snapshot = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return normalize_id(key) in self._records
+
+    def get(self, key):
+        return self._records.get(normalize_id(key))
+
+    def items(self):
+        """(key, record) pairs in insertion order."""
+        return self._records.items()
+
+    def _added(self, key, record):
+        if key not in self._sequence:
+            self._sequence[key] = self._next_sequence
+            self._next_sequence += 1
+        for field, text_index in self._text_indexes.items():
+            text_index.add(key, record.get(field))
+
+    def _removed(self, key):
+        del self._sequence[key]
+        for text_index in self._text_indexes.values():
+            text_index.remove(key)
+
+    def put(self, record):
+        key = normalize_id(record.get(self.key_field))
+        self._records[key] = record
+        self._added(key, record)
+        self._snapshot = None
+
+    def update(self, key, changes):
+        """Applies changes to the record with the given key; re-keys it if its ID changed."""
+        key = normalize_id(key)
+        record = self._records.get(key)
+        if record is None:
+            return None
+        record.update(changes)
+        new_key = normalize_id(record.get(self.key_field))
+        if new_key != key:
+            del self._records[key]
+            self._removed(key)
+            self._records[new_key] = record
+        self._added(new_key, record)
+        self._snapshot = None
+        return record
+
+    def replace(self, key, record):
+        """Stores record in place of the one with the given key (keeping its position), or adds it."""
+        key = normalize_id(key)
+        new_key = normalize_id(record.get(self.key_field))
+        if new_key != key:
+            self.pop(key)
+        self._records[new_key] = record
+        self._added(new_key, record)
+        self._snapshot = None
+        return record
+
+    def pop(self, key):
+        key = normalize_id(key)
+        record = self._records.pop(key, None)
+        if record is not None:
+            self._removed(key)
+            self._snapshot = None
+        return record
+
+    def records(self):
+        if self._snapshot is None:
+            self._snapshot = list(self._records.values())
+        return self._snapshot
+
+    def text_index(self, field):
+        """Returns the NgramIndex of a text field, building it on first use."""
+        text_index = self._text_indexes.get(field)
+        if text_index is None:
+            if field not in self.text_fields:
+                raise KeyError(f"'{field}' is not a searchable field")
+            text_index = NgramIndex()
+            for key, record in self._records.items():
+                text_index.add(key, record.get(field))
+            self._text_indexes[field] = text_index
+        return text_index
+
+    def records_for(self, keys):
+        """Returns the records of the given keys in insertion order."""
+        if len(keys) > len(self._records) // 8:
+            # For large hit sets one ordered pass beats sorting the keys
+            return [record for key, record in self._records.items() if key in keys]
+        return [self._records[key] for key in sorted(keys, key=self._sequence.__getitem__)]
+
+    def search(self, field, query):
+        """Returns the records whose field contains query (case-insensitive), in insertion order."""
+        return self.records_for(self.text_index(field).search(query))
+
+    def prefix_search(self, field, query, limit=None):
+        """Returns the records whose field starts with query, in insertion order."""
+        return self.records_for(self.text_index(field).prefix(query))[:limit]
+
+    def ranked_search(self, field, query, limit=10):
+        """Returns up to limit records whose field contains query, best match first."""
+        return [self._records[key] for key in self.text_index(field).ranked(query, limit)]
@@ -0,0 +1,105 @@
+import threading
+from contextlib import contextmanager
+
+from storage import file_lock
+
+# Process-wide registry of manager instances, shared by every Streamlit session
+_registry_lock = threading.Lock()
+_managers = {}
+# (manager class, data file) -> lock held while that manager is constructed, so
+# loading one data file does not hold up sessions asking for the others
+_construction_locks = {}
+
+
+def get_manager(manager_class, data_file=None):
+    """
+    Returns the shared instance of a manager class (Product, User, RolePermission).
+
+    The data file is parsed once per server process. Later calls only stat the
+    file and reload it when its mtime or size changed since the last load/save.
+
+    Parameters:
+        manager_class (type): The manager class to instantiate.
+        data_file (str, optional): Data file to use instead of the class default.
+
+    Returns:
+        object: The cached manager instance.
+    """
+    key = (manager_class, data_file)
+    manager = _managers.get(key)
+    if manager is None:
+        with _registry_lock:
+            construction_lock = _construction_locks.setdefault(key, threading.Lock())
+        with construction_lock:
+            manager = _managers.get(key)
+            if manager is None:
+                manager = manager_class(data_file) if data_file else manager_class()
+                _managers[key] = manager
+                return manager
+
+    with manager.lock:
+        reload_if_changed(manager)
+    return manager
+
+
+def reload_if_changed(manager):
+    """
+    Reloads a manager if another process changed its files since our last load/save.
+
+    Changes still queued in the manager's write-behind queue are written first
+    (on top of the other process's version), so the reload does not drop them.
+    Call with manager.lock held.
+    """
+    if manager.storage.changed_on_disk():
+        manager.writer.flush()
+        # The flush reloads when it merged with a newer version; otherwise reload here
+        if manager.storage.changed_on_disk():
+            manager.load_data()
+
+
+class ConflictError(Exception):
+    """Raised when a record was changed by someone else since the caller read it; reload and retry."""
+
+
+@contextmanager
+def write_transaction(manager, refresh=True):
+    """
+    Serialises a mutation of a manager across threads and processes.
+
+    Holds the manager lock and the storage's advisory file lock. Unless
+    refresh is False, the data is reloaded first if another process wrote it
+    since our last load/save, so our write never overwrites their change and
+    version checks see the latest records. Nested transactions on the same
+    manager only take the locks once.
+
+    With INVENTORY_DURABILITY=group, leaving the outermost transaction waits
+    (after releasing the locks) until its changes are on disk.
+    """
+    with manager.lock:
+        storage = manager.storage
+        if storage.lock_depth:
+            storage.lock_depth += 1
+            try:
+                yield
+            finally:
+                storage.lock_depth -= 1
+            return
+
+        with file_lock(storage.lock_file):
+            # Set first, so a flush during the refresh nests instead of re-locking the file
+            storage.lock_depth = 1
+            try:
+                if refresh:
+                    reload_if_changed(manager)
+                yield
+            finally:
+                storage.lock_depth = 0
+        # Changes queued up to here, taken while no other thread can add any
+        queued = manager.writer.queued
+    manager.writer.wait_durable(queued)
+
+
+def clear_managers():
+    """Drops every cached manager so the next get_manager() call reloads from disk."""
+    with _registry_lock:
+        _managers.clear()
@@ -1,40 +1,102 @@
-import json
+import threading
 
+from storage import make_storage
+from record_index import RecordIndex
+from repository import write_transaction
+from write_behind import WriteBehind
+from permissions import compile_mask, requires_permission
+from instrumentation import instrument_methods
+
+@instrument_methods("role")
 class RolePermission:
     def __init__(self, data_file="data/roles.json"):
         self.data_file = data_file
+        # The instance is shared by all sessions, so mutations hold this lock
+        self.lock = threading.RLock()
+        # Hash index on role_id backing every lookup and mutation, plus
+        # trigram indexes for substring search on the text fields
+        self.index = RecordIndex("role_id", text_fields=("role_id", "name"))
+        # JSON file, snapshot + journal or SQLite table, depending on INVENTORY_STORAGE
+        self.storage = make_storage(data_file, "role_id")
+        # Writes changes now or in batches, depending on INVENTORY_DURABILITY
+        self.writer = WriteBehind(self)
         self.load_data()
 
+    @property
+    def roles(self):
+        with self.lock:
+            return self.index.records()
+
     def load_data(self):
-        with open(self.data_file, "r") as file:
-            self.roles = json.load(file)
+        with self.lock:
+            self.index.load(self.storage.load())
+            # role name -> permission bitmask, compiled once per load and per role change
+            self.permission_masks = {role.get("name"): compile_mask(role) for role in self.index.records()}
+
+    def mask_for(self, role_name):
+        """Returns the permission bitmask of a role name (0 for unknown roles)."""
+        return self.permission_masks.get(role_name, 0)
+
+    def _recompile(self, old_role=None, new_role=None):
+        if old_role is not None:
+            self.permission_masks.pop(old_role.get("name"), None)
+        if new_role is not None:
+            self.permission_masks[new_role.get("name")] = compile_mask(new_role)
 
     def save_data(self):
-        with open(self.data_file, "w") as file:
-            json.dump(self.roles, file, indent=4)
+        with write_transaction(self, refresh=False):
+            self.storage.save(self.index.records())
+            self.writer.clear()
 
+    @requires_permission("add_role")
     def add_role(self, role):
-        self.roles.append(role)
-        self.save_data()
+        with write_transaction(self):
+            # Role IDs are unique; adding an existing one would shadow it
+            if role["role_id"] in self.index:
+                return False
+            self.index.put(role)
+            self._recompile(new_role=role)
+            self.writer.record_change("put", role["role_id"], role)
+            return True
+
+    @requires_permission("edit_role")
+    def update_role(self, role_id, updated_role):
+        # Roles are keyed on role_id, which is what the management pages pass in
+        with write_transaction(self):
+            record = self.index.get(role_id)
+            if record is None:
+                return False
+            self._recompile(old_role=record)
+            self.index.update(role_id, updated_role)
+            self._recompile(new_role=record)
+            self.writer.record_change("put", role_id, record)
+            return True
 
-    def update_role(self, role_name, updated_role):
-        for idx, role in enumerate(self.roles):
-            if role["name"] == role_name:
-                self.roles[idx].update(updated_role)
-                self.save_data()
-                return True
-        return False
+    @requires_permission("delete_role")
+    def delete_role(self, role_id):
+        with write_transaction(self):
+            role = self.index.pop(role_id)
+            if role is not None:
+                self._recompile(old_role=role)
+                self.writer.record_change("delete", role_id)
 
-    def delete_role(self, role_name):
-        self.roles = [role for role in self.roles if role["name"] != role_name]
-        self.save_data()
+    def apply_remote_changes(self, changes, signature):
+        """Applies roles written by another instance (see change_bus) instead of reloading the data file."""
+        with self.lock:
+            for op, key, record in changes:
+                old = self.index.get(key)
+                if old is not None:
+                    self._recompile(old_role=old)
+                if op == "delete":
+                    self.index.pop(key)
+                else:
+                    self._recompile(new_role=self.index.replace(key, record))
+            self.storage.known_signature = signature
 
-    def search_roles(self, query):
-        return [role for role in self.roles if query.lower() in role["name"].lower()]
+    @requires_permission("view_roles")
+    def search_roles(self, query, field="name"):
+        with self.lock:
+            return self.index.search(field, query)
 
     def get_role_by_id(self, role_id):
-        
-        for role in self.roles:
-            if role["role_id"] == role_id:
-                return role
-        return None
\ No newline at end of file
+        return self.index.get(role_id)
@@ -0,0 +1,74 @@
+from record_index import normalize_id
+
+
+class ScanSession:
+    """
+    Stock movements scanned one product at a time and committed together.
+
+    Every scan adds its quantity to the product's running total in a dict
+    keyed on the normalised product ID, so a pallet of hundreds of scans holds
+    one entry per SKU. commit() books the whole tally with a single
+    Product.record_movements() call: one ledger append and one data file
+    write, and nothing at all if any product would go below zero.
+    """
+
+    def __init__(self, kind="receipt", location=None):
+        """
+        Parameters:
+            kind (str): Movement kind booked for every scan ("receipt", "sale" or "adjustment").
+            location (str, optional): Location the movements happen at.
+        """
+        self.kind = kind
+        self.location = location
+        # product key -> [product_id as scanned, units, scans]
+        self.tally = {}
+        # Keys in scan order, for undo
+        self.history = []
+
+    def __len__(self):
+        return len(self.tally)
+
+    def add(self, product_id, quantity=1):
+        """
+        Adds a scan to the tally. An entry stays while it has scans, even when
+        its units net out to 0, so undo() can take each of them back.
+        """
+        key = normalize_id(product_id)
+        entry = self.tally.setdefault(key, [product_id, 0, 0])
+        entry[1] += quantity
+        entry[2] += 1
+        self.history.append((key, quantity))
+
+    def undo(self):
+        """Takes back the last scan; the entry goes once its last scan is undone."""
+        if not self.history:
+            return
+        key, quantity = self.history.pop()
+        entry = self.tally[key]
+        entry[1] -= quantity
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self.tally[key]
+
+    def units(self):
+        """Total units over every scan."""
+        return sum(entry[1] for entry in self.tally.values())
+
+    def movements(self):
+        """The tally as (product_id, kind, quantity) tuples for record_movements; products netting 0 units are left out."""
+        return [(product_id, self.kind, units) for product_id, units, _ in self.tally.values() if units]
+
+    def commit(self, product_manager):
+        """
+        Books the tally in one go and empties the session.
+
+        Returns:
+            bool: False (the tally is kept and nothing is written) if a product
+            no longer exists or its stock would go below zero.
+        """
+        movements = self.movements()
+        if movements and not product_manager.record_movements(movements, self.location):
+            return False
+        self.tally.clear()
+        self.history.clear()
+        return True
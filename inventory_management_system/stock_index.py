@@ -0,0 +1,41 @@
+from bisect import bisect_left, bisect_right, insort
+
+
+class StockIndex:
+    """
+    Records keys ordered by a numeric value (stock quantity, stock minus reorder level, ...).
+
+    Entries live in a plain list of (value, key) tuples kept sorted with
+    bisect, so "everything at or below x" is a binary search followed by a
+    slice: O(log n + k). Moving or removing a key is a binary search plus a
+    list insert/delete, which is a memmove in C and cheap even for 1M entries.
+    Keys whose value is not a number are left out of the index.
+    """
+
+    def __init__(self, items=()):
+        self.build(items)
+
+    def build(self, items):
+        """Replaces the index contents with (key, value) pairs."""
+        self.values = {key: value for key, value in items if key is not None and isinstance(value, (int, float))}
+        self.entries = sorted((value, key) for key, value in self.values.items())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set(self, key, value):
+        self.remove(key)
+        if key is not None and isinstance(value, (int, float)):
+            self.values[key] = value
+            insort(self.entries, (value, key))
+
+    def remove(self, key):
+        value = self.values.pop(key, None)
+        if value is not None:
+            position = bisect_left(self.entries, (value, key))
+            del self.entries[position]
+
+    def at_most(self, threshold):
+        """Returns the keys whose value is <= threshold, lowest value first."""
+        end = bisect_right(self.entries, (threshold, "\U0010ffff"))
+        return [key for _, key in self.entries[:end]]
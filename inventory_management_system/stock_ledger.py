@@ -0,0 +1,247 @@
+import json
+import os
+import struct
+import time
+
+from storage import atomic_write_json
+from record_index import normalize_id
+from instrumentation import metrics
+
+# Movement kinds; the position is the code stored in the ledger
+MOVEMENT_KINDS = ["receipt", "sale", "adjustment"]
+
+# One fixed-size little-endian record per movement:
+# timestamp (float64), product key id (uint32), kind (uint8), signed quantity (int64)
+RECORD = struct.Struct("<dIBq")
+
+HOUR = 3600
+DAY = 86400
+# Hourly buckets older than this are dropped; daily buckets are kept forever
+HOURLY_RETENTION = 7 * DAY
+# Rollups are checkpointed after this many movements (and on every full save)
+CHECKPOINT_EVERY = 500
+
+
+class StockLedger:
+    """
+    Append-only log of stock movements with precomputed rollups.
+
+    Movements are appended to <name>.bin as fixed-size binary records. Product
+    IDs are stored once in <name>.keys (one per line) and referred to by their
+    line number. For every product the ledger keeps the running balance and
+    per-hour and per-day totals of received, sold and adjusted units, so
+    questions like "units sold in the last 30 days" add up at most 30 daily
+    buckets instead of scanning the log.
+
+    The rollups are checkpointed to <name>.rollups.json together with the log
+    offset they cover; loading reads the checkpoint and replays only the
+    movements appended after it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keys_file = os.path.splitext(path)[0] + ".keys"
+        self.rollups_file = os.path.splitext(path)[0] + ".rollups.json"
+        self.load()
+
+    def load(self):
+        self._reload_keys()
+        self.offset = 0
+        self.balances = {}
+        # bucket start (epoch seconds) -> product key -> [received, sold, adjusted]
+        self.hourly = {}
+        self.daily = {}
+        self._load_checkpoint()
+        self.pending = 0
+        self.refresh()
+
+    def _read_keys(self):
+        try:
+            with open(self.keys_file, "rb") as file:
+                content = file.read()
+        except FileNotFoundError:
+            content = b""
+        if content and not content.endswith(b"\n"):
+            # A key still being written (or torn by a crash): no movement refers
+            # to it yet. Left alone here; append() repairs it under the lock.
+            content = content[:content.rfind(b"\n") + 1]
+        self.keys_size = len(content)
+        return content.decode("utf-8").splitlines()
+
+    def _reload_keys(self):
+        self.keys = self._read_keys()
+        self.key_ids = {key: key_id for key_id, key in enumerate(self.keys)}
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.rollups_file, "r") as file:
+                saved = json.load(file)
+            size = os.path.getsize(self.path)
+        except (FileNotFoundError, ValueError):
+            return
+        if saved.get("offset", 0) > size:
+            # The log was replaced or truncated; rebuild from scratch
+            return
+        self.offset = saved["offset"]
+        self.balances = saved["balances"]
+        self.hourly = {int(bucket): totals for bucket, totals in saved["hourly"].items()}
+        self.daily = {int(bucket): totals for bucket, totals in saved["daily"].items()}
+
+    def refresh(self):
+        """
+        Applies movements appended since the last load (also by other processes).
+
+        Runs without a lock, so it only reads: a partial last record may be an
+        append still in progress and stays for the next refresh.
+        """
+        try:
+            with open(self.path, "rb") as file:
+                file.seek(self.offset)
+                data = file.read()
+        except FileNotFoundError:
+            return
+        usable = len(data) - len(data) % RECORD.size
+        records = list(RECORD.iter_unpack(data[:usable]))
+        if any(key_id >= len(self.keys) for _, key_id, _, _ in records):
+            # Another process registered new product IDs
+            self._reload_keys()
+        for timestamp, key_id, kind, quantity in records:
+            if key_id >= len(self.keys):
+                # Its key is not readable yet; retry from here next time
+                break
+            self._apply(timestamp, self.keys[key_id], kind, quantity)
+            self.offset += RECORD.size
+
+    def _repair(self):
+        """
+        Drops a torn last key or record left by a process that crashed
+        mid-append, so our append starts aligned. Call only while holding the
+        lock that serialises appends.
+        """
+        try:
+            with open(self.keys_file, "r+b") as file:
+                content = file.read()
+                if content and not content.endswith(b"\n"):
+                    file.truncate(content.rfind(b"\n") + 1)
+        except FileNotFoundError:
+            pass
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size % RECORD.size:
+            with open(self.path, "r+b") as file:
+                file.truncate(size - size % RECORD.size)
+
+    def _apply(self, timestamp, key, kind, quantity):
+        self.balances[key] = self.balances.get(key, 0) + quantity
+        for buckets, width in ((self.hourly, HOUR), (self.daily, DAY)):
+            totals = buckets.setdefault(int(timestamp // width) * width, {}).setdefault(key, [0, 0, 0])
+            # Sales are stored as negative quantities but counted as units sold
+            totals[kind] += -quantity if MOVEMENT_KINDS[kind] == "sale" else quantity
+
+    def append(self, movements):
+        """
+        Appends movements and folds them into the rollups.
+
+        Callers serialise appends across processes (Product holds its file
+        lock), so the ledger itself takes no lock.
+
+        Parameters:
+            movements (list): (product_id, kind, quantity, timestamp or None) tuples.
+                Receipts add abs(quantity), sales remove abs(quantity),
+                adjustments are signed.
+        """
+        if not movements:
+            return
+        self._repair()
+        self.refresh()
+        if os.path.exists(self.keys_file) and os.path.getsize(self.keys_file) != self.keys_size:
+            self._reload_keys()
+        encoded = []
+        new_keys = []
+        now = time.time()
+        for product_id, kind, quantity, timestamp in movements:
+            code = MOVEMENT_KINDS.index(kind)
+            if kind == "sale":
+                quantity = -abs(quantity)
+            elif kind == "receipt":
+                quantity = abs(quantity)
+            key = normalize_id(product_id)
+            key_id = self.key_ids.get(key)
+            if key_id is None:
+                key_id = self.key_ids[key] = len(self.keys)
+                self.keys.append(key)
+                new_keys.append(key)
+            encoded.append((timestamp or now, key_id, code, int(quantity), key))
+        if new_keys:
+            # IDs go to disk before the movements that refer to them
+            data = "".join(key + "\n" for key in new_keys).encode("utf-8")
+            with open(self.keys_file, "ab") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            self.keys_size += len(data)
+        with open(self.path, "ab") as file:
+            file.write(b"".join(RECORD.pack(*entry[:4]) for entry in encoded))
+            metrics.observe("storage.bytes_written", RECORD.size * len(encoded))
+            file.flush()
+            os.fsync(file.fileno())
+        for timestamp, _, code, quantity, key in encoded:
+            self._apply(timestamp, key, code, quantity)
+        self.offset += RECORD.size * len(encoded)
+
+        self.pending += len(encoded)
+        if self.pending >= CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Saves the rollups, dropping hourly buckets past their retention."""
+        cutoff = time.time() - HOURLY_RETENTION
+        self.hourly = {bucket: totals for bucket, totals in self.hourly.items() if bucket >= cutoff}
+        atomic_write_json(
+            self.rollups_file,
+            {"offset": self.offset, "balances": self.balances, "hourly": self.hourly, "daily": self.daily},
+            indent=None,
+        )
+        self.pending = 0
+
+    def balance(self, product_id):
+        """Net stock of a product according to the ledger, or None if it has no movements."""
+        return self.balances.get(normalize_id(product_id))
+
+    def units_moved(self, days=30, kind="sale", product_id=None, now=None):
+        """
+        Units of one movement kind over the last days, from the daily rollups.
+
+        The window covers whole UTC days: today and the days - 1 before it.
+
+        Returns:
+            dict or int: product key -> units, or the units of product_id.
+        """
+        code = MOVEMENT_KINDS.index(kind)
+        start = (int((now or time.time()) // DAY) - days + 1) * DAY
+        key = normalize_id(product_id) if product_id is not None else None
+        totals = {}
+        for bucket, products in self.daily.items():
+            if bucket < start:
+                continue
+            if key is not None:
+                if key in products:
+                    totals[key] = totals.get(key, 0) + products[key][code]
+                continue
+            for product_key, counts in products.items():
+                if counts[code]:
+                    totals[product_key] = totals.get(product_key, 0) + counts[code]
+        if key is not None:
+            return totals.get(key, 0)
+        return totals
+
+    def hourly_series(self, product_id, hours=24, now=None):
+        """Received, sold and adjusted units per hour for the last hours: [(bucket start, [r, s, a]), ...]."""
+        key = normalize_id(product_id)
+        current = int((now or time.time()) // HOUR) * HOUR
+        return [
+            (bucket, self.hourly.get(bucket, {}).get(key, [0, 0, 0]))
+            for bucket in range(current - (hours - 1) * HOUR, current + HOUR, HOUR)
+        ]
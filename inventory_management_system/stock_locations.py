@@ -0,0 +1,278 @@
+import json
+import os
+import re
+
+from stock_ledger import StockLedger
+from storage import atomic_write_json
+from record_index import normalize_id
+
+# Comma-separated IDs of the locations this process works with, e.g. the
+# warehouse a terminal stands in; unset means every location
+LOCAL_LOCATIONS = [location.strip() for location in os.environ.get("INVENTORY_LOCATION", "").split(",") if location.strip()]
+
+# Used when the data directory has no locations.json
+DEFAULT_LOCATIONS = [{"location_id": "main", "name": "Main warehouse"}]
+
+# Location IDs are part of the partition file names
+LOCATION_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# A transfer is booked in the transfer ledger under "<product key>\t<from>\t<to>"
+ROUTE_SEPARATOR = "\t"
+
+
+def load_locations(path):
+    """
+    Reads the list of locations: [{"location_id": "main", "name": "Main warehouse"}, ...].
+
+    The first location is the default one. A missing file means a single
+    "main" location, i.e. the stock model from before locations existed.
+    """
+    try:
+        with open(path, "r") as file:
+            locations = json.load(file)
+    except FileNotFoundError:
+        locations = DEFAULT_LOCATIONS
+    if not locations:
+        raise ValueError(f"{path} lists no locations")
+    for location in locations:
+        if not LOCATION_ID.match(str(location.get("location_id", ""))):
+            raise ValueError(f"Invalid location ID '{location.get('location_id')}' in {path}")
+    return locations
+
+
+class StockLocations:
+    """
+    Stock of the product catalog, partitioned by location (warehouse).
+
+    Every location has its own StockLedger, <data file>.<location>.movements.bin,
+    which is loaded on first use only: a terminal started with
+    INVENTORY_LOCATION=<id> reads its own partition and none of the others.
+    The default (first) location keeps the original <data file>.movements.bin,
+    and a product that never moved is wholly stocked there: its stock is the
+    catalog's stock_quantity. Before a product's first movement anywhere else,
+    its default partition gets an opening balance, so this stays true.
+
+    Transfers between locations are single records in a shared transfer
+    ledger (<data file>.transfers.bin), so a transfer is booked completely or
+    not at all, and the stock at a location is its partition balance plus the
+    net transfers in. stock_quantity in the catalog is the total over every
+    location, which a transfer does not change.
+
+    Each partition other than the default saves its unit total next to its
+    ledger (<partition>.totals.json) after every append, so cross-location
+    totals read one small file per location instead of its ledger.
+
+    Direct edits of stock_quantity are booked at the process's home location:
+    the first of INVENTORY_LOCATION, or the default location.
+    """
+
+    def __init__(self, data_file, local=None):
+        """
+        Parameters:
+            data_file (str): The product data file; partitions are stored next to it.
+            local (list, optional): Locations to load right away (default INVENTORY_LOCATION, or all).
+        """
+        self.base = os.path.splitext(data_file)[0]
+        self.locations = load_locations(os.path.join(os.path.dirname(data_file), "locations.json"))
+        self.names = {location["location_id"]: location.get("name") or location["location_id"] for location in self.locations}
+        self.default = self.locations[0]["location_id"]
+        self.local = list(local or LOCAL_LOCATIONS or self.names)
+        self.home = self.local[0]
+        # location -> StockLedger, for the partitions loaded so far
+        self.partitions = {}
+        for location in self.local:
+            self.partition(location)
+        self.transfers = StockLedger(self.base + ".transfers.bin")
+        # location -> product key -> net units transferred in, rebuilt when the transfer ledger grows
+        self._deltas = {}
+        self._deltas_offset = 0
+
+    def partition_path(self, location):
+        if location == self.default:
+            return self.base + ".movements.bin"
+        return f"{self.base}.{location}.movements.bin"
+
+    def _totals_file(self, location):
+        return os.path.splitext(self.partition_path(location))[0] + ".totals.json"
+
+    def partition(self, location):
+        """Returns the ledger of a location, loading it on first use."""
+        ledger = self.partitions.get(location)
+        if ledger is None:
+            if location not in self.names:
+                raise ValueError(f"Unknown location '{location}'")
+            ledger = self.partitions[location] = StockLedger(self.partition_path(location))
+        return ledger
+
+    @property
+    def fully_loaded(self):
+        """True once every partition is in memory, so totals per product can be added up."""
+        return len(self.partitions) == len(self.names)
+
+    def refresh(self):
+        """Applies movements and transfers appended by other processes to the loaded partitions."""
+        for ledger in self.partitions.values():
+            ledger.refresh()
+        self.transfers.refresh()
+
+    def checkpoint(self):
+        for ledger in self.partitions.values():
+            ledger.checkpoint()
+        if self.transfers.offset:
+            self.transfers.checkpoint()
+
+    def transfer_deltas(self):
+        """location -> product key -> net units transferred in (negative when more went out)."""
+        if self._deltas_offset != self.transfers.offset:
+            deltas = {}
+            for route, quantity in self.transfers.balances.items():
+                key, source, target = route.rsplit(ROUTE_SEPARATOR, 2)
+                outgoing = deltas.setdefault(source, {})
+                outgoing[key] = outgoing.get(key, 0) - quantity
+                incoming = deltas.setdefault(target, {})
+                incoming[key] = incoming.get(key, 0) + quantity
+            self._deltas, self._deltas_offset = deltas, self.transfers.offset
+        return self._deltas
+
+    def stock(self, product_id, location, catalog_stock=0):
+        """
+        Units of a product at a location.
+
+        Parameters:
+            catalog_stock (int): The product's stock_quantity; all of it is at
+                the default location until the product's first movement.
+        """
+        balance = self.partition(location).balance(product_id)
+        if balance is None:
+            balance = (catalog_stock or 0) if location == self.default else 0
+        return balance + self.transfer_deltas().get(location, {}).get(normalize_id(product_id), 0)
+
+    def stock_at(self, location, catalog=()):
+        """
+        Units per product at a location: {product key: units}.
+
+        Other locations only list the products that were ever stocked there.
+        For the default location pass the catalog as (key, stock_quantity)
+        pairs, which covers the products that never moved.
+        """
+        stock = dict(self.partition(location).balances)
+        if location == self.default:
+            for key, quantity in catalog:
+                if key not in stock:
+                    stock[key] = quantity if isinstance(quantity, int) and not isinstance(quantity, bool) else 0
+        for key, delta in self.transfer_deltas().get(location, {}).items():
+            stock[key] = stock.get(key, 0) + delta
+        return stock
+
+    def opening(self, product_id, catalog_stock, location):
+        """
+        Movements that open the default partition's history of a product before
+        its first movement at location: none if it already has a history.
+        """
+        if self.partition(self.default).balance(product_id) is not None:
+            return []
+        if location == self.default and not catalog_stock:
+            return []
+        # Booked even when 0: stock booked elsewhere must not count as default stock too
+        return [(normalize_id(product_id), "adjustment", catalog_stock or 0, None)]
+
+    def append(self, location, movements):
+        """Books movements in a location's partition and saves its unit total."""
+        if not movements:
+            return
+        ledger = self.partition(location)
+        ledger.append(movements)
+        if location != self.default:
+            atomic_write_json(
+                self._totals_file(location), {"offset": ledger.offset, "units": sum(ledger.balances.values())}, indent=None
+            )
+
+    def book(self, movements):
+        """Appends {location: movements}; the default partition goes first, as it holds the openings."""
+        for location in sorted(movements, key=lambda location: location != self.default):
+            self.append(location, movements[location])
+
+    def closing(self, product_id):
+        """
+        Movements that take a product's stock to 0 at every location, for
+        book(): {location: [movement]}. Loads every partition.
+        """
+        key = normalize_id(product_id)
+        if self.partition(self.default).balance(key) is None:
+            # Never moved: the stock was only ever in the catalog
+            return {}
+        closing = {}
+        for location in self.names:
+            stock = self.stock(key, location)
+            if stock:
+                # Partition balance plus net transfers in comes to 0
+                closing[location] = [(key, "adjustment", -stock, None)]
+        return closing
+
+    def transfer(self, product_id, source, target, quantity):
+        """Books a transfer as one record of the transfer ledger; the caller checked the stock at source."""
+        for location in (source, target):
+            if location not in self.names:
+                raise ValueError(f"Unknown location '{location}'")
+        route = ROUTE_SEPARATOR.join((normalize_id(product_id), source, target))
+        self.transfers.append([(route, "adjustment", quantity, None)])
+
+    def _partition_units(self, location):
+        ledger = self.partitions.get(location)
+        if ledger is None:
+            try:
+                with open(self._totals_file(location), "r") as file:
+                    saved = json.load(file)
+                if saved["offset"] == os.path.getsize(self.partition_path(location)):
+                    return saved["units"]
+            except (FileNotFoundError, ValueError, KeyError):
+                pass
+            # Missing or stale (written by a process that crashed): read the partition itself
+            ledger = self.partition(location)
+        return sum(ledger.balances.values())
+
+    def totals(self, catalog_units):
+        """
+        Units per location, in the order of locations.json: {location: units}.
+
+        Partitions that are not loaded contribute their saved totals. The
+        default location holds whatever the others do not, so its total is
+        derived from the catalog's total units (InventoryAggregates).
+        """
+        deltas = self.transfer_deltas()
+        units = {}
+        for location in self.names:
+            if location != self.default:
+                units[location] = self._partition_units(location) + sum(deltas.get(location, {}).values())
+        units[self.default] = catalog_units - sum(units.values())
+        return {location: units[location] for location in self.names}
+
+    def ledger_total(self, product_id):
+        """A product's stock over every location according to the ledgers, or None if unknown (or not all partitions are loaded)."""
+        if not self.fully_loaded:
+            return None
+        balances = [ledger.balance(product_id) for ledger in self.partitions.values()]
+        if all(balance is None for balance in balances):
+            return None
+        # Transfers move stock between locations and add up to zero
+        return sum(balance for balance in balances if balance is not None)
+
+    def ledger_totals(self):
+        """{product key: stock over every location} for the products with a history; empty unless every partition is loaded."""
+        if not self.fully_loaded:
+            return {}
+        totals = {}
+        for ledger in self.partitions.values():
+            for key, balance in ledger.balances.items():
+                totals[key] = totals.get(key, 0) + balance
+        return totals
+
+    def units_moved(self, days=30, kind="sale", product_id=None):
+        """units_moved() of StockLedger added up over the local partitions."""
+        if product_id is not None:
+            return sum(self.partition(location).units_moved(days, kind, product_id) for location in self.local)
+        totals = {}
+        for location in self.local:
+            for key, units in self.partition(location).units_moved(days, kind).items():
+                totals[key] = totals.get(key, 0) + units
+        return totals
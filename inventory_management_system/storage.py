@@ -0,0 +1,633 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from record_index import normalize_id
+from instrumentation import metrics
+from offset_index import OffsetIndex, iter_json_array
+from product_record import ProductRecord, to_json_default
+from binary_snapshot import BINARY_SNAPSHOTS, read_snapshot, write_snapshot
+
+# Storage mode for the data files: "json" rewrites the whole file on every
+# mutation, "journal" appends each mutation to a log next to the snapshot and
+# "sqlite" keeps every dataset in one embedded database.
+STORAGE_MODE = os.environ.get("INVENTORY_STORAGE", "json")
+# Number of journal entries after which the log is folded into the snapshot
+JOURNAL_COMPACT_EVERY = int(os.environ.get("INVENTORY_JOURNAL_COMPACT_EVERY", "1000"))
+# Database used in sqlite mode; defaults to inventory.db next to the JSON files
+SQLITE_FILE = os.environ.get("INVENTORY_SQLITE_FILE")
+
+# Record fields copied into their own indexed columns, per table, for
+# SqliteStorage.query(): "text" columns hold the lower-cased text, "number"
+# columns the value if it is a number (NULL otherwise)
+SQLITE_INDEXED_FIELDS = {
+    "products": {"product_id": "text", "name": "text", "category": "text", "price": "number", "stock_quantity": "number"},
+    "users": {"username": "text"},
+    "roles": {"name": "text"},
+}
+
+
+def file_signature(path):
+    """
+    Returns a cheap fingerprint of a data file used to detect changes on disk.
+
+    Parameters:
+        path (str): Path of the data file.
+
+    Returns:
+        tuple or None: (mtime in nanoseconds, size in bytes), or None if the file is missing.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def comparable_signature(signature):
+    """
+    Returns signature in the form it has after a JSON round trip (tuples become
+    lists), so it compares equal to a signature read back from a JSON file.
+    """
+    return json.loads(json.dumps(signature))
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Holds an exclusive advisory lock on path (created if missing) for the duration of the block.
+
+    The lock is shared by every process using the same data directory, so
+    replicas on a shared volume take turns writing. It is not reentrant:
+    nested use in one process must go through repository.write_transaction().
+    """
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def plain_records(records):
+    """Returns records as a list of plain dicts (compact ProductRecords are converted) for the encoders."""
+    return [record.to_dict() if type(record) is ProductRecord else record for record in records]
+
+
+def atomic_write_json(path, data, indent=4):
+    """
+    Writes data to path as JSON without ever leaving a half-written file behind.
+
+    The JSON is written to a temporary file in the same directory, flushed to
+    disk and then renamed over the target, which is atomic on POSIX and Windows.
+    """
+    if isinstance(data, list):
+        # Turning compact records into dicts up front is cheaper than the encoder's default= callback
+        data = plain_records(data)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as file:
+            if indent is None:
+                # dumps() runs the C encoder for compact output; dump() always streams in Python
+                file.write(json.dumps(data, default=to_json_default))
+            else:
+                json.dump(data, file, indent=indent, default=to_json_default)
+            metrics.observe("storage.bytes_written", file.tell())
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(path):
+            # mkstemp creates 0600 files; keep the permissions of the file we replace
+            os.chmod(temp_path, os.stat(path).st_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class JsonStorage:
+    """
+    Persists a list of records as a single pretty-printed JSON file.
+
+    Next to it, "<data_file>.pickle" holds the same records as a binary
+    snapshot tagged with the JSON file's signature. Loading prefers the
+    snapshot while that signature matches, which skips JSON parsing at startup;
+    a JSON file edited by hand simply makes it stale until the next save.
+    """
+
+    # Whether query() can select records without loading the dataset
+    supports_queries = False
+    # Whether lookup() can fetch a single record without loading the dataset
+    supports_lookup = True
+
+    def __init__(self, data_file, key_field, record_type=None):
+        self.data_file = data_file
+        self.key_field = key_field
+        # Class the loaded records are converted to (e.g. ProductRecord); None keeps dicts
+        self.record_type = record_type
+        self.known_signature = None
+        # ID -> byte range of each record in the data file, kept in <data_file>.offsets
+        self.offsets = OffsetIndex(data_file + ".offsets", data_file, key_field)
+        # Binary copy of the data file for fast loads (see binary_snapshot.py)
+        self.binary_file = data_file + ".pickle" if BINARY_SNAPSHOTS else None
+        # Cross-process lock taken around every write (see repository.write_transaction)
+        self.lock_file = data_file + ".lock"
+        self.lock_depth = 0
+
+    def signature(self):
+        return file_signature(self.data_file)
+
+    def changed_on_disk(self):
+        """True if the files were modified by someone else since our last load/save."""
+        return self.signature() != self.known_signature
+
+    def load(self):
+        # Take the signature first so a concurrent write triggers another reload
+        self.known_signature = self.signature()
+        data_signature = file_signature(self.data_file)
+        records = self._read_binary(data_signature)
+        if records is not None:
+            if self.record_type is not None:
+                # In place, so each parsed dict is freed as soon as it is converted
+                for position, record in enumerate(records):
+                    records[position] = self.record_type(record)
+            return records
+        # The offset index is rebuilt in the same pass when the file changed
+        build_offsets = self.supports_lookup and not self.offsets.open(data_signature)
+        records = []
+        locations = []
+        # Parsed record by record, so the file text is never held in memory as a whole
+        for offset, length, record in iter_json_array(self.data_file):
+            if self.record_type is not None:
+                record = self.record_type(record)
+            records.append(record)
+            if build_offsets:
+                locations.append((record.get(self.key_field), offset, length))
+        metrics.observe("storage.bytes_read", data_signature[1] if data_signature else 0)
+        if build_offsets:
+            self.offsets.build(data_signature, locations)
+        if self.binary_file and data_signature:
+            # The next start (or reload) reads the snapshot instead of parsing
+            write_snapshot(self.binary_file, data_signature, plain_records(records))
+        return records
+
+    def _read_binary(self, data_signature):
+        if not self.binary_file or not data_signature:
+            return None
+        return read_snapshot(self.binary_file, data_signature)
+
+    def iter_records(self):
+        """Streams the stored records without keeping them in memory (from the snapshot if it is fresh)."""
+        records = self._read_binary(file_signature(self.data_file))
+        if records is not None:
+            yield from records
+            return
+        for _, _, record in iter_json_array(self.data_file):
+            yield record
+
+    def lookup(self, key):
+        """Reads the record with the given ID through the offset index, without loading the file."""
+        for attempt in range(2):
+            data_signature = file_signature(self.data_file)
+            if self.offsets.signature != data_signature and not self.offsets.open(data_signature):
+                self.offsets.build_from_file(data_signature)
+            try:
+                record = self.offsets.get(key)
+            except ValueError:
+                # The file was replaced between the check and the read
+                self.offsets.signature = None
+                continue
+            if record is not None and self.record_type is not None:
+                record = self.record_type(record)
+            return record
+        return None
+
+    def save(self, records):
+        records = plain_records(records)
+        atomic_write_json(self.data_file, records)
+        self.known_signature = self.signature()
+        if self.binary_file:
+            write_snapshot(self.binary_file, file_signature(self.data_file), records)
+
+    def record_change(self, op, key, record, snapshot):
+        """
+        Persists a single mutation.
+
+        Parameters:
+            op (str): "put" for an insert/update, "delete" for a removal.
+            key: ID of the record before the change.
+            record (dict or None): The full record after the change ("put" only).
+            snapshot (callable): Returns the full list of records if a rewrite is needed.
+        """
+        self.apply_changes([(op, key, record)], snapshot)
+
+    def apply_changes(self, changes, snapshot):
+        """
+        Persists a batch of mutations with a single write.
+
+        Parameters:
+            changes (list): (op, key, record) tuples, see record_change.
+            snapshot (callable): Returns the full list of records, changes included.
+        """
+        if not self.changed_on_disk():
+            self.save(snapshot())
+            return
+        # Another process wrote since our last load (write-behind batches can
+        # be that old): apply the batch to their version instead of ours
+        by_key = {normalize_id(record.get(self.key_field)): record for record in self.load()}
+        for op, key, record in changes:
+            self._apply(by_key, op, key, record)
+        self.save(list(by_key.values()))
+
+    def _apply(self, by_key, op, key, record):
+        key = normalize_id(key)
+        if op == "delete":
+            by_key.pop(key, None)
+            return
+        if self.record_type is not None and type(record) is not self.record_type:
+            record = self.record_type(record)
+        new_key = normalize_id(record.get(self.key_field))
+        if new_key != key:
+            by_key.pop(key, None)
+        by_key[new_key] = record
+
+
+class JournalStorage(JsonStorage):
+    """
+    Snapshot + append-only write-ahead log.
+
+    Each mutation appends one compact JSON line to "<data_file>.log". Loading
+    replays the log over the snapshot; every JOURNAL_COMPACT_EVERY entries the
+    log is folded into a fresh snapshot written with atomic_write_json().
+    Log entries carry full records, so replaying one twice is harmless.
+    """
+
+    # The snapshot alone is out of date while the log has entries
+    supports_lookup = False
+
+    def __init__(self, data_file, key_field, record_type=None, compact_every=JOURNAL_COMPACT_EVERY):
+        super().__init__(data_file, key_field, record_type)
+        self.log_file = data_file + ".log"
+        self.compact_every = compact_every
+        self.pending = 0
+
+    def signature(self):
+        return (file_signature(self.data_file), file_signature(self.log_file))
+
+    def load(self):
+        # super().load() takes the signature of the snapshot and the log before
+        # reading either, so anything appended while (or after) we read the log,
+        # including the rest of a torn last line, shows up as a change on disk
+        records = super().load()
+        self.pending = 0
+        try:
+            file = open(self.log_file, "rb")
+        except FileNotFoundError:
+            # No log, or a compaction removed it after the check of the signature
+            return records
+
+        by_key = {normalize_id(record.get(self.key_field)): record for record in records}
+        # Loads run without the file lock, so the file is only read here: a
+        # last line without its newline may be an append still being written
+        # and is left for the next load (or repaired by _repair_tail()).
+        with file:
+            offset = 0
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    metrics.count("storage.journal_bad_lines")
+                    continue
+                self._apply(by_key, entry["op"], entry["key"], entry.get("record"))
+                self.pending += 1
+            metrics.observe("storage.bytes_read", offset)
+        return list(by_key.values())
+
+    def save(self, records):
+        super().save(records)
+        # The snapshot now contains everything in the log
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.pending = 0
+        self.known_signature = self.signature()
+
+    def _repair_tail(self):
+        """
+        Drops a torn last line left by a process that crashed mid-append, so our
+        append starts on a clean line. Only call with the file lock held: then
+        no other process is appending and the size we see is final.
+        """
+        try:
+            file = open(self.log_file, "rb+")
+        except FileNotFoundError:
+            return
+        with file:
+            end = file.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            file.seek(end - 1)
+            if file.read(1) == b"\n":
+                return
+            # Walk back to the end of the last complete line
+            position = end
+            while position > 0:
+                start = max(0, position - 65536)
+                file.seek(start)
+                newline = file.read(position - start).rfind(b"\n")
+                if newline >= 0:
+                    file.truncate(start + newline + 1)
+                    return
+                position = start
+            file.truncate(0)
+
+    def apply_changes(self, changes, snapshot):
+        """
+        Appends one log line per change, with a single write and fsync for the
+        batch. Runs inside write_transaction, i.e. under the file lock.
+        """
+        lines = []
+        for op, key, record in changes:
+            entry = {"op": op, "key": key}
+            if op == "put":
+                entry["record"] = record
+            lines.append(json.dumps(entry, separators=(",", ":"), default=to_json_default) + "\n")
+        data = "".join(lines)
+        # Our records are missing whatever another process appended since our last load
+        stale = self.changed_on_disk()
+        self._repair_tail()
+        metrics.observe("storage.bytes_written", len(data))
+        with open(self.log_file, "a") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        self.pending += len(lines)
+
+        if self.pending >= self.compact_every and not stale:
+            self.save(snapshot())
+        else:
+            self.known_signature = self.signature()
+
+    def iter_records(self):
+        return iter(self.load())
+
+
+class SqliteStorage:
+    """
+    Stores one dataset as a table of an embedded SQLite database.
+
+    The database runs in WAL mode, so sessions and replicas can read while one
+    of them writes, and every mutation is a single-row upsert or delete. Each
+    row keeps the full record as JSON plus the fields of SQLITE_INDEXED_FIELDS
+    in indexed columns, which query() selects on without loading the table.
+    The first time a table is created it is filled from the existing JSON data
+    file.
+
+    Every write also bumps the table's row in table_changes in the same
+    transaction, and that (generation, version) pair is the signature: a write
+    to one table does not make the managers of the others reload.
+    """
+
+    supports_queries = True
+    supports_lookup = True
+
+    def __init__(self, data_file, key_field, record_type=None, db_file=None):
+        self.data_file = data_file
+        self.key_field = key_field
+        self.record_type = record_type
+        self.db_file = db_file or SQLITE_FILE or os.path.join(os.path.dirname(data_file), "inventory.db")
+        # products.json -> products, users.json -> users, roles.json -> roles
+        self.table = os.path.splitext(os.path.basename(data_file))[0]
+        self.columns = SQLITE_INDEXED_FIELDS.get(self.table, {})
+        # Cross-process lock taken around every write (see repository.write_transaction)
+        self.lock_file = f"{self.db_file}.{self.table}.lock"
+        self.lock_depth = 0
+        # Column list and placeholders shared by the INSERT statements
+        self._insert_columns = "".join(f"{column}, " for column in self.columns) + "data, position"
+        self._insert_values = "?, " * (len(self.columns) + 2)
+        self.known_signature = None
+        # One connection per storage, shared by the script threads of all sessions
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.db_file, check_same_thread=False, timeout=5.0)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        if self._create_schema() and os.path.exists(data_file):
+            self.import_json()
+
+    def _create_schema(self):
+        """Creates or upgrades the table, its indexes and its change counter; returns True if the table did not exist yet."""
+        with self.lock, self.connection:
+            exists = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table,)
+            ).fetchone()
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS table_changes ("
+                "name TEXT PRIMARY KEY, generation TEXT NOT NULL, version INTEGER NOT NULL)"
+            )
+            columns = "".join(f"{column}, " for column in self.columns)
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                f"key TEXT PRIMARY KEY, position INTEGER NOT NULL, {columns}data TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{self.table}_position ON {self.table}(position)"
+            )
+            present = {row[1] for row in self.connection.execute(f"PRAGMA table_info({self.table})")}
+            for column in self.columns:
+                if column not in present:
+                    self.connection.execute(f"ALTER TABLE {self.table} ADD COLUMN {column}")
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{self.table}_{column} ON {self.table}({column})"
+                )
+            # A new generation per counter, so a recreated table never repeats an old signature
+            counted = self.connection.execute(
+                "INSERT OR IGNORE INTO table_changes (name, generation, version) VALUES (?, ?, 0)",
+                (self.table, os.urandom(8).hex()),
+            ).rowcount
+            if exists and counted:
+                # Written by a version without the counter, which did not always fill the columns
+                self._fill_columns()
+        return exists is None
+
+    def _fill_columns(self):
+        rows = self.connection.execute(f"SELECT key, data FROM {self.table}").fetchall()
+        assignments = ", ".join(f"{column} = ?" for column in self.columns)
+        self.connection.executemany(
+            f"UPDATE {self.table} SET {assignments} WHERE key = ?",
+            [(*self._column_values(json.loads(data)), key) for key, data in rows],
+        )
+
+    def _column_values(self, record):
+        values = []
+        for column, kind in self.columns.items():
+            value = record.get(column)
+            if kind == "text":
+                values.append(None if value is None else str(value).lower())
+            else:
+                values.append(value if isinstance(value, (int, float)) and not isinstance(value, bool) else None)
+        return values
+
+    def import_json(self):
+        """One-shot migration: replaces the table contents with the JSON data file."""
+        with open(self.data_file, "r") as file:
+            self.save(json.load(file))
+
+    def _signature(self):
+        row = self.connection.execute(
+            "SELECT generation, version FROM table_changes WHERE name = ?", (self.table,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def _bump_version(self):
+        self.connection.execute("UPDATE table_changes SET version = version + 1 WHERE name = ?", (self.table,))
+
+    def signature(self):
+        with self.lock:
+            return self._signature()
+
+    def changed_on_disk(self):
+        return self.signature() != self.known_signature
+
+    def load(self):
+        with self.lock:
+            self.known_signature = self._signature()
+            rows = self.connection.execute(f"SELECT data FROM {self.table} ORDER BY position").fetchall()
+        # SQLite does its own page I/O; the JSON payload size is what we account for
+        metrics.observe("storage.bytes_read", sum(len(data) for (data,) in rows))
+        return [self._record(json.loads(data)) for (data,) in rows]
+
+    def _record(self, data):
+        return data if self.record_type is None else self.record_type(data)
+
+    def iter_records(self):
+        return iter(self.load())
+
+    def lookup(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT data FROM {self.table} WHERE key = ?", (normalize_id(key),)
+            ).fetchone()
+        return self._record(json.loads(row[0])) if row else None
+
+    def _column(self, field):
+        if field not in self.columns:
+            raise KeyError(f"'{field}' is not an indexed field of {self.table}")
+        return field
+
+    def query(self, contains=None, ranges=None, order_by=None):
+        """
+        Returns the records matching every criterion, selected on the indexed columns.
+
+        Parameters:
+            contains (dict, optional): Text field -> text it must contain (case-insensitive).
+            ranges (dict, optional): Number field -> (min, max); either bound may be None.
+            order_by (str, optional): Number field to sort by, lowest first (default: insertion order).
+
+        Returns:
+            list: The matching records.
+        """
+        conditions = []
+        params = []
+        for field, text in (contains or {}).items():
+            if text:
+                conditions.append(f"instr({self._column(field)}, ?) > 0")
+                params.append(str(text).lower())
+        for field, bounds in (ranges or {}).items():
+            low, high = bounds or (None, None)
+            if low is not None:
+                conditions.append(f"{self._column(field)} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{self._column(field)} <= ?")
+                params.append(high)
+        where = " AND ".join(conditions) or "1"
+        order = f"{self._column(order_by)}, position" if order_by else "position"
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT data FROM {self.table} WHERE {where} ORDER BY {order}", params
+            ).fetchall()
+        metrics.observe("storage.bytes_read", sum(len(data) for (data,) in rows))
+        return [self._record(json.loads(data)) for (data,) in rows]
+
+    def _row(self, key, record):
+        return (key, *self._column_values(record), json.dumps(record, default=to_json_default))
+
+    def save(self, records):
+        rows = [
+            (*self._row(normalize_id(record.get(self.key_field)), record), position)
+            for position, record in enumerate(records)
+        ]
+        with self.lock:
+            with self.connection:
+                self.connection.execute(f"DELETE FROM {self.table}")
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, {self._insert_columns}) "
+                    f"VALUES ({self._insert_values}?)",
+                    rows,
+                )
+                self._bump_version()
+            self.known_signature = self._signature()
+        metrics.observe("storage.bytes_written", sum(len(row[-2]) for row in rows))
+
+    def record_change(self, op, key, record, snapshot):
+        self.apply_changes([(op, key, record)], snapshot)
+
+    def apply_changes(self, changes, snapshot):
+        """Writes a batch of (op, key, record) changes in one transaction."""
+        with self.lock:
+            with self.connection:
+                for op, key, record in changes:
+                    self._write_change(normalize_id(key), op, record)
+                self._bump_version()
+            self.known_signature = self._signature()
+
+    def _write_change(self, key, op, record):
+        if op == "delete":
+            self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            return
+        new_key = normalize_id(record.get(self.key_field))
+        if new_key != key:
+            self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        updates = "".join(f"{column} = excluded.{column}, " for column in self.columns)
+        row = self._row(new_key, record)
+        self.connection.execute(
+            f"INSERT INTO {self.table} (key, {self._insert_columns}) VALUES ({self._insert_values}"
+            f"(SELECT COALESCE(MAX(position), -1) + 1 FROM {self.table})) "
+            f"ON CONFLICT(key) DO UPDATE SET {updates}data = excluded.data",
+            row,
+        )
+        metrics.observe("storage.bytes_written", len(row[-1]))
+
+
+def make_storage(data_file, key_field, record_type=None):
+    """
+    Returns the storage backend selected by INVENTORY_STORAGE for a data file.
+
+    Parameters:
+        record_type (callable, optional): Converts each loaded record (e.g. ProductRecord).
+    """
+    if STORAGE_MODE == "journal":
+        return JournalStorage(data_file, key_field, record_type)
+    if STORAGE_MODE == "sqlite":
+        return SqliteStorage(data_file, key_field, record_type)
+    return JsonStorage(data_file, key_field, record_type)
@@ -1,59 +1,193 @@
 import json
-import streamlit as st
+import threading
 
+from storage import make_storage
+from record_index import RecordIndex
+from repository import ConflictError, reload_if_changed, write_transaction
+from write_behind import WriteBehind
+from permissions import requires_permission
+from passwords import hash_passwords, is_hashed, needs_rehash, verify_password_async
+from instrumentation import instrument_methods, metrics
+
+@instrument_methods("user")
 class User:
     def __init__(self, data_file="data/users.json"):
         self.data_file = data_file
+        # The instance is shared by all sessions, so mutations hold this lock
+        self.lock = threading.RLock()
+        # Hash index on user_id backing every lookup and mutation, plus
+        # trigram indexes for substring search on the text fields
+        self.index = RecordIndex("user_id", text_fields=("user_id", "username", "role"))
+        # JSON file, snapshot + journal or SQLite table, depending on INVENTORY_STORAGE
+        self.storage = make_storage(data_file, "user_id")
+        # username -> record for logins, rebuilt lazily after a load or mutation
+        self._usernames = None
+        # Writes changes now or in batches, depending on INVENTORY_DURABILITY
+        self.writer = WriteBehind(self)
         self.load_data()
 
+    @property
+    def users(self):
+        with self.lock:
+            return self.index.records()
+
     def clear_json_file(self):
         """Overwrite the JSON file with an empty list."""
         with open(self.data_file, "w") as file:
             json.dump([], file)
 
+    @property
+    def usernames(self):
+        with self.lock:
+            if self._usernames is None:
+                usernames = {}
+                for user in self.index.records():
+                    # First match wins, like the old linear scan
+                    usernames.setdefault(user.get("username"), user)
+                self._usernames = usernames
+            return self._usernames
+
     def verify_login(self, username, password):
-        #users = self.load_users()
-        self.load_data()
-        for user in self.users:
-            if user["username"] == username and user["password"] == password:
-                return user["role"]
-        return None
-    
+        """
+        Checks a username and password.
+
+        The data file is only re-read when it changed on disk. The password is
+        hashed on the shared hashing pool and compared in constant time.
+
+        Returns:
+            str or None: The user's role, or None if the credentials are invalid.
+        """
+        with self.lock:
+            reload_if_changed(self)
+            user = self.usernames.get(username)
+        stored = user.get("password") if user else None
+        if not verify_password_async(password, stored).result():
+            metrics.count("login.failed")
+            return None
+        metrics.count("login.succeeded")
+        if needs_rehash(stored):
+            # Hashed with an older cost setting: upgrade while we have the password
+            self._rehash(user, password)
+        return user["role"]
+
+    def _rehash(self, user, password):
+        (hashed,) = hash_passwords([password])
+        with write_transaction(self):
+            current = self.index.get(user["user_id"])
+            if current is not None and current.get("password") == user.get("password"):
+                current["password"] = hashed
+                self.writer.record_change("put", current["user_id"], current)
+
+    def _hash_new_passwords(self, users):
+        """Replaces plaintext passwords in users with salted hashes (hashed on the pool, outside the lock)."""
+        pending = [user for user in users if user.get("password") and not is_hashed(user["password"])]
+        for user, hashed in zip(pending, hash_passwords([user["password"] for user in pending])):
+            user["password"] = hashed
+
     def load_data(self):
-        with open(self.data_file, "r") as file:
-            self.users = json.load(file)
+        with self.lock:
+            self.index.load(self.storage.load())
+            self._usernames = None
+            if any(user.get("password") and not is_hashed(user["password"]) for user in self.index.records()):
+                self.migrate_passwords()
+
+    def migrate_passwords(self):
+        """One-time migration: hashes every plaintext password and saves the file."""
+        with write_transaction(self, refresh=False):
+            self._hash_new_passwords(self.index.records())
+            self.storage.save(self.index.records())
+            self.writer.clear()
 
     def save_data(self):
-        with open(self.data_file, "w") as file:
-            json.dump(self.users, file, indent=4)
+        with write_transaction(self, refresh=False):
+            self.storage.save(self.index.records())
+            self.writer.clear()
 
+    @requires_permission("add_user")
     def add_user(self, user):
-        self.users.append(user)
-        self.save_data()
+        self._hash_new_passwords([user])
+        with write_transaction(self):
+            # User IDs are unique; adding an existing one would shadow it
+            if user["user_id"] in self.index:
+                return False
+            # Every record carries a version that each update increments (optimistic concurrency)
+            user.setdefault("version", 1)
+            self.index.put(user)
+            self._usernames = None
+            self.writer.record_change("put", user["user_id"], user)
+            return True
+
+    @requires_permission("add_user", "edit_user")
+    def upsert_users(self, users, persist=True):
+        """
+        Inserts or updates (matched on user_id) a batch of users.
 
-    def update_user(self, user_id, updated_user):
-        for idx, usr in enumerate(self.users):
-            if usr["user_id"] == user_id:
-                self.users[idx].update(updated_user)
+        With persist=False the changes stay in memory until save_data() is called.
+
+        Returns:
+            tuple: (number inserted, number updated)
+        """
+        inserted = updated = 0
+        self._hash_new_passwords(users)
+        with write_transaction(self):
+            for user in users:
+                current = self.index.get(user["user_id"])
+                if current is None:
+                    user.setdefault("version", 1)
+                    self.index.put(user)
+                    inserted += 1
+                else:
+                    self.index.update(user["user_id"], dict(user, version=current.get("version", 0) + 1))
+                    updated += 1
+            self._usernames = None
+            if persist:
                 self.save_data()
-                return True
-        return False
+        return inserted, updated
+
+    @requires_permission("edit_user")
+    def update_user(self, user_id, updated_user, expected_version=None):
+        """
+        Applies updated_user to the user with the given ID.
 
+        Pass the version the caller read as expected_version to make this a
+        compare-and-swap: if anyone updated the user since, ConflictError is
+        raised and nothing is written.
+        """
+        self._hash_new_passwords([updated_user])
+        with write_transaction(self):
+            current = self.index.get(user_id)
+            if current is None:
+                return False
+            if expected_version is not None and current.get("version", 0) != expected_version:
+                raise ConflictError(f"User '{user_id}' was changed by someone else.")
+            record = self.index.update(user_id, dict(updated_user, version=current.get("version", 0) + 1))
+            self._usernames = None
+            self.writer.record_change("put", user_id, record)
+            return True
+
+    @requires_permission("delete_user")
     def delete_user(self, user_id):
-        # Clear the JSON file first
-        self.clear_json_file()
-        self.users = [usr for usr in self.users if usr["user_id"] != user_id]
-        st.write(self.users)
-        self.save_data()
-
-    def search_users(self, query):
-        return [usr for usr in self.users if query.lower() in usr["username"].lower()]
+        with write_transaction(self):
+            self.index.pop(user_id)
+            self._usernames = None
+            self.writer.record_change("delete", user_id)
+            return True
+
+    def apply_remote_changes(self, changes, signature):
+        """Applies users written by another instance (see change_bus) instead of reloading the data file."""
+        with self.lock:
+            for op, key, record in changes:
+                if op == "delete":
+                    self.index.pop(key)
+                else:
+                    self.index.replace(key, record)
+            self._usernames = None
+            self.storage.known_signature = signature
+
+    @requires_permission("view_user")
+    def search_users(self, query, field="username"):
+        with self.lock:
+            return self.index.search(field, query)
     
     def get_user_by_id(self, user_id):
-        
-        for usr in self.users:
-            if usr["user_id"] == user_id:
-                return usr
-        return None
-
-    
\ No newline at end of file
+        return self.index.get(user_id)
@@ -0,0 +1,216 @@
+import atexit
+import os
+import threading
+import time
+import traceback
+import weakref
+
+from record_index import normalize_id
+from repository import write_transaction
+from instrumentation import metrics
+from change_bus import ChangeFollower
+
+# When a mutation reaches the data files:
+#   "sync"  - before the mutating call returns, on the caller's thread (default)
+#   "group" - after the locks are released; the first waiting caller writes the
+#             changes of every caller queued so far in one go (group commit)
+#   "async" - by a background thread; the call returns right away, and changes
+#             made within the flush delay are lost if the process is killed
+DURABILITY = os.environ.get("INVENTORY_DURABILITY", "sync")
+# Longest time a change waits in the queue before the background writer flushes it ("async")
+FLUSH_DELAY = float(os.environ.get("INVENTORY_FLUSH_DELAY", "0.5"))
+# Queued records that trigger a flush without waiting for the delay
+FLUSH_BATCH = int(os.environ.get("INVENTORY_FLUSH_BATCH", "1000"))
+
+DURABILITY_MODES = ("sync", "group", "async")
+
+# Every writer of the process, flushed at interpreter exit
+_writers = weakref.WeakSet()
+
+
+class WriteBehind:
+    """
+    Persistence queue of one manager (Product, User or RolePermission).
+
+    Managers hand their record changes to record_changes() inside a
+    write_transaction instead of calling the storage directly. In "sync" mode
+    they are written at once; otherwise they are queued and coalesced (a record
+    changed five times is written once) and each batch is written with a single
+    storage.apply_changes() call, i.e. one file rewrite, one journal append or
+    one SQLite transaction.
+
+    The queue is drained under the manager lock and the file lock, like any
+    other write. If another process changed the files in the meantime, the
+    batch is applied on top of their version and the manager reloads.
+
+    Every write is announced on the change bus, so other instances and
+    processes can apply it to their records without reloading (change_bus.py).
+    """
+
+    def __init__(self, manager, mode=None, delay=FLUSH_DELAY, batch_size=FLUSH_BATCH, on_flush=None):
+        """
+        Parameters:
+            manager: Object with lock, storage and index attributes.
+            mode (str, optional): "sync", "group" or "async" (default INVENTORY_DURABILITY).
+            delay (float): Seconds a queued change may wait before it is flushed.
+            batch_size (int): Queued records that trigger an immediate flush.
+            on_flush (callable, optional): Called under the locks after every write,
+                e.g. to save files tagged with the storage's new signature.
+        """
+        self.manager = manager
+        self.mode = mode or DURABILITY
+        if self.mode not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode '{self.mode}', expected one of {', '.join(DURABILITY_MODES)}")
+        self.delay = delay
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        # Normalised key -> (op, key, record); the latest change of each record wins
+        self.pending = {}
+        # Guards the queue and wakes the background thread
+        self.condition = threading.Condition()
+        # Batches queued / written so far, as sequence numbers for group-commit waits
+        self.queued = 0
+        self.flushed = 0
+        self.first_queued_at = None
+        self.thread = None
+        self.follower = ChangeFollower(manager)
+        _writers.add(self)
+
+    def record_changes(self, changes):
+        """
+        Persists (or queues) a batch of changes; call inside write_transaction.
+
+        Parameters:
+            changes (list): (op, key, record) tuples as for storage.record_change:
+                op is "put" or "delete", key the record ID before the change and
+                record the full record after it ("put" only).
+        """
+        if not changes:
+            return
+        if self.mode == "sync":
+            self._write(changes)
+            return
+        with self.condition:
+            for op, key, record in changes:
+                key = normalize_id(key)
+                if op == "put":
+                    new_key = normalize_id(record.get(self.manager.storage.key_field))
+                    if new_key != key:
+                        # A renamed record: queue the removal of the old key on its own
+                        self.pending[key] = ("delete", key, None)
+                        key = new_key
+                self.pending[key] = (op, key, record)
+            self.queued += 1
+            if self.first_queued_at is None:
+                self.first_queued_at = time.monotonic()
+            metrics.observe("write_behind.queue_depth", len(self.pending))
+            if self.mode == "async":
+                self._start()
+                self.condition.notify_all()
+
+    def record_change(self, op, key, record=None):
+        """Persists (or queues) a single change; see record_changes."""
+        self.record_changes([(op, key, record)])
+
+    def clear(self):
+        """Drops the queued changes after a full save made them redundant."""
+        with self.condition:
+            self.pending.clear()
+            self.first_queued_at = None
+            self.flushed = self.queued
+            self.condition.notify_all()
+
+    def flush(self):
+        """Writes every queued change now, on the calling thread."""
+        with self.condition:
+            if not self.pending:
+                # Nothing to write: do not take (or create) the file lock at all
+                return
+        with write_transaction(self.manager, refresh=False):
+            with self.condition:
+                if not self.pending:
+                    return
+                changes = list(self.pending.values())
+                target = self.queued
+            self._write(changes)
+            with self.condition:
+                # Nothing can be queued meanwhile: record_changes runs under the manager lock we hold
+                self.pending.clear()
+                self.first_queued_at = None
+                self.flushed = target
+
+    def _write(self, changes):
+        storage = self.manager.storage
+        start = time.perf_counter()
+        # Another process wrote since our last load: our queued changes go on top of theirs
+        stale = self.mode != "sync" and storage.changed_on_disk()
+        # What the files looked like right before this write, for the change bus
+        base = storage.signature()
+        storage.apply_changes(changes, self.manager.index.records)
+        if stale:
+            self.manager.load_data()
+        if self.on_flush is not None:
+            self.on_flush()
+        self.follower.published(base, changes)
+        metrics.record_time("write_behind.flush", time.perf_counter() - start)
+        metrics.observe("write_behind.batch_size", len(changes))
+
+    def wait_durable(self, target):
+        """
+        Group commit: returns once the batches numbered up to target are on disk.
+
+        Called by write_transaction after it released the locks. The caller
+        that gets the locks first writes everything queued so far, including
+        the changes of sessions that committed while it was waiting; they then
+        find their changes written and return without touching the disk.
+        """
+        if self.mode != "group":
+            return
+        with self.condition:
+            if self.flushed >= target:
+                return
+        start = time.perf_counter()
+        self.flush()
+        metrics.record_time("write_behind.commit_wait", time.perf_counter() - start)
+
+    def _start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name=f"write-behind-{self.manager.storage.key_field}", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                # Flush after the delay, or as soon as the batch is full
+                while len(self.pending) < self.batch_size:
+                    remaining = self.first_queued_at + self.delay - time.monotonic()
+                    if remaining <= 0 or not self.pending:
+                        break
+                    self.condition.wait(remaining)
+                if not self.pending:
+                    continue
+            try:
+                self.flush()
+            except Exception:
+                # The changes stay queued; retry after the delay
+                traceback.print_exc()
+                metrics.count("write_behind.flush_failed")
+                time.sleep(self.delay)
+
+
+def flush_all():
+    """Writes the queued changes of every manager; registered to run at interpreter exit."""
+    for writer in list(_writers):
+        if not writer.pending:
+            continue
+        if not os.path.isdir(os.path.dirname(os.path.abspath(writer.manager.data_file))):
+            # The data directory is gone (e.g. a removed temporary directory); nothing to write to
+            continue
+        try:
+            writer.flush()
+        except Exception:
+            traceback.print_exc()
+
+
+atexit.register(flush_all)
@@ -0,0 +1,41 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The app modules import each other as top-level modules (run from that directory)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "inventory_management_system"))
+
+import repository  # noqa: E402
+from permissions import PERMISSIONS  # noqa: E402
+
+PRODUCTS = [
+    {"product_id": 1, "name": "Laptop", "category": "Electronics", "price": 999.99, "stock_quantity": 10},
+    {"product_id": 2, "name": "Smartphone", "category": "Electronics", "price": 499.99, "stock_quantity": 25},
+    {"product_id": 3, "name": "Desk", "category": "Furniture", "price": 150.0, "stock_quantity": 0},
+]
+USERS = [
+    {"user_id": 1, "username": "admin", "password": "admin", "role": "admin"},
+    {"user_id": 2, "username": "clerk", "password": "clerk", "role": "user"},
+]
+ROLES = [
+    {"role_id": 1, "name": "admin", "permission_level": list(PERMISSIONS)},
+    {"role_id": 2, "name": "user", "permission_level": ["view_product"]},
+]
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    A fresh data directory as the working directory, so the managers' default
+    data files (data/products.json, ...) point into it, and an empty manager
+    registry, so get_manager() builds managers on it.
+    """
+    data = tmp_path / "data"
+    data.mkdir()
+    for name, records in (("products", PRODUCTS), ("users", USERS), ("roles", ROLES)):
+        (data / f"{name}.json").write_text(json.dumps(records))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(repository, "_managers", {})
+    return data
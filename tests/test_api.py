@@ -0,0 +1,104 @@
+import pytest
+
+from api import ApiClient, InventoryApi
+from permissions import acting_as
+from product import Product
+from repository import get_manager
+
+
+@pytest.fixture
+def api(data_dir):
+    """The API on an ephemeral port over the test data directory."""
+    port = InventoryApi(workers=2).start_in_thread(port=0)
+    return port
+
+
+@pytest.fixture
+def admin(api):
+    client = ApiClient(port=api)
+    client.login("admin", "admin")
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def clerk(api):
+    client = ApiClient(port=api)
+    client.login("clerk", "clerk")
+    yield client
+    client.close()
+
+
+def test_health_needs_no_token(api):
+    client = ApiClient(port=api)
+    assert client.call("GET", "/health") == (200, {"status": "ok"})
+    client.close()
+
+
+def test_login_rejects_a_wrong_password(api):
+    client = ApiClient(port=api)
+    status, response = client.call("POST", "/login", {"username": "admin", "password": "nope"})
+    assert status == 401
+    assert "error" in response
+    client.close()
+
+
+def test_endpoints_need_a_token(api):
+    client = ApiClient(port=api)
+    assert client.call("POST", "/products/get", {"ids": [1]})[0] == 401
+    client.token = "forged"
+    assert client.call("GET", "/products/1")[0] == 401
+    client.close()
+
+
+def test_role_without_the_permission_gets_403(clerk):
+    assert clerk.call("POST", "/users/get", {"ids": [1]})[0] == 403
+    status, _ = clerk.call("POST", "/stock/adjust", {"movements": [{"product_id": 1, "kind": "sale", "quantity": 1}]})
+    assert status == 403
+    with acting_as(None):
+        assert get_manager(Product).get_product_by_id(1)["stock_quantity"] == 10
+
+
+def test_multi_get_reports_missing_ids(clerk):
+    status, response = clerk.call("POST", "/products/get", {"ids": [1, "2", 99]})
+    assert status == 200
+    assert [product["product_id"] for product in response["products"]] == [1, 2]
+    assert response["missing"] == [99]
+    assert clerk.call("GET", "/products/99")[0] == 404
+
+
+def test_users_are_returned_without_password_hashes(admin):
+    status, response = admin.call("POST", "/users/get", {"ids": [1, 2]})
+    assert status == 200
+    assert [user["username"] for user in response["users"]] == ["admin", "clerk"]
+    assert all("password" not in user for user in response["users"])
+
+
+def test_adjust_books_the_whole_batch(admin):
+    movements = [
+        {"product_id": 1, "kind": "sale", "quantity": 3},
+        {"product_id": 2, "kind": "receipt", "quantity": 5},
+        {"product_id": 1, "kind": "adjustment", "quantity": -1},
+    ]
+    status, response = admin.call("POST", "/stock/adjust", {"movements": movements})
+    assert status == 200
+    assert response["products"] == [{"product_id": 1, "stock_quantity": 6}, {"product_id": 2, "stock_quantity": 30}]
+    assert admin.call("GET", "/products/1")[1]["stock_quantity"] == 6
+
+
+def test_adjust_that_would_go_negative_books_nothing(admin):
+    movements = [
+        {"product_id": 2, "kind": "receipt", "quantity": 5},
+        {"product_id": 3, "kind": "sale", "quantity": 1},
+    ]
+    assert admin.call("POST", "/stock/adjust", {"movements": movements})[0] == 409
+    status, response = admin.call("POST", "/products/get", {"ids": [2, 3]})
+    assert [product["stock_quantity"] for product in response["products"]] == [25, 0]
+
+
+def test_bad_requests_get_400(admin):
+    assert admin.call("POST", "/products/get", {"ids": "1"})[0] == 400
+    status, _ = admin.call("POST", "/stock/adjust", {"movements": [{"product_id": 1, "kind": "theft", "quantity": 1}]})
+    assert status == 400
+    status, _ = admin.call("POST", "/stock/transfer", {"product_id": 1, "quantity": 1, "from": "main", "to": "nowhere"})
+    assert status == 400
@@ -0,0 +1,43 @@
+import io
+
+import pytest
+
+import bulk_io
+from product import Product
+from repository import get_manager
+
+
+@pytest.fixture
+def products(data_dir):
+    return get_manager(Product)
+
+
+def validate(record):
+    return None if record.get("name") else "Name is required."
+
+
+def csv_upload(rows, tail=b""):
+    lines = ["product_id,name,category,price,stock_quantity"] + rows
+    return io.TextIOWrapper(io.BytesIO("\n".join(lines).encode("utf-8") + tail), encoding="utf-8-sig", newline="")
+
+
+def test_import_upserts_the_valid_rows_and_saves_them(products, data_dir):
+    upload = csv_upload(["1,Laptop Pro,Electronics,1299.00,10", "4,,Furniture,80,2", "5,Chair,Furniture,80,2"])
+    report = bulk_io.import_records(upload, "csv", bulk_io.PRODUCT_SCHEMA, validate, products.upsert_products)
+    assert (report["rows"], report["inserted"], report["updated"]) == (3, 1, 1)
+    assert report["errors"] == [(3, "Name is required.")]
+    assert report["failed"] is None
+    reloaded = Product(str(data_dir / "products.json"))
+    assert reloaded.get_product_by_id(1)["name"] == "Laptop Pro"
+    assert reloaded.get_product_by_id(5)["name"] == "Chair"
+
+
+def test_unreadable_file_imports_nothing(products):
+    rows = [f"{product_id},Item {product_id},Misc,1.0,1" for product_id in range(100, 2100)]
+    # Latin-1 text past the first chunks of the UTF-8 decoder
+    upload = csv_upload(rows, tail="\n9999,Caf\xe9,Misc,1.0,1".encode("latin-1"))
+    report = bulk_io.import_records(upload, "csv", bulk_io.PRODUCT_SCHEMA, validate, products.upsert_products)
+    assert report["failed"] == "The file is not UTF-8 encoded text."
+    assert report["inserted"] == report["updated"] == 0
+    assert products.get_product_by_id(100) is None
+    assert len(products.products) == 3
@@ -0,0 +1,78 @@
+import pytest
+
+import storage
+
+from permissions import PermissionDenied, acting_as
+from product import Product
+from repository import ConflictError, get_manager
+from role_permission import RolePermission
+
+
+@pytest.fixture
+def products(data_dir):
+    return get_manager(Product)
+
+
+def test_update_with_a_stale_version_raises_conflict(products):
+    version = products.get_product_by_id(1).get("version", 0)
+    assert products.update_product(1, {"price": 899.99}, expected_version=version)
+    with pytest.raises(ConflictError):
+        products.update_product(1, {"price": 799.99}, expected_version=version)
+    assert products.get_product_by_id(1)["price"] == 899.99
+
+
+def test_update_of_a_deleted_product_returns_false(products):
+    assert products.delete_product(2)
+    assert not products.update_product(2, {"price": 1.0})
+
+
+def test_writes_reach_a_fresh_manager(products, data_dir):
+    products.update_product(1, {"name": "Notebook"})
+    products.record_movement(2, "sale", 5)
+    products.writer.flush()
+    reloaded = Product(str(data_dir / "products.json"))
+    assert reloaded.get_product_by_id(1)["name"] == "Notebook"
+    assert reloaded.get_product_by_id(2)["stock_quantity"] == 20
+
+
+def test_role_mask_limits_manager_calls(products):
+    mask = get_manager(RolePermission).mask_for("user")
+    with acting_as(mask):
+        assert products.get_product_by_id(1)["product_id"] == 1
+        assert products.search_products("lap")
+        with pytest.raises(PermissionDenied):
+            products.update_product(1, {"price": 1.0})
+        with pytest.raises(PermissionDenied):
+            products.delete_product(1)
+    with acting_as(get_manager(RolePermission).mask_for("admin")):
+        assert products.update_product(1, {"price": 1.0})
+
+
+def test_unknown_role_has_no_permissions(products):
+    with acting_as(get_manager(RolePermission).mask_for("nobody")):
+        with pytest.raises(PermissionDenied):
+            products.search_products("lap")
+
+
+def test_movements_that_would_go_negative_book_nothing(products):
+    assert not products.record_movements([(1, "sale", 4), (3, "sale", 1)])
+    assert products.get_product_by_id(1)["stock_quantity"] == 10
+    assert products.ledger.balance(1) is None
+    assert products.record_movements([(1, "sale", 4), (1, "receipt", 2)])
+    assert products.get_product_by_id(1)["stock_quantity"] == 8
+    assert products.ledger.balance(1) == 8
+
+
+def test_cold_sqlite_queries_match_the_loaded_catalog(data_dir, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_MODE", "sqlite")
+    products = get_manager(Product)
+    queries = [
+        lambda: products.search_products("PHONE"),
+        lambda: products.filter_products(10),
+        lambda: products.query_products(category="elec", stock_range=(5, 20)),
+        lambda: products.query_products(price_range=(100, 600)),
+    ]
+    cold = [[prod["product_id"] for prod in query()] for query in queries]
+    assert not products._loaded
+    products.index
+    assert cold == [[prod["product_id"] for prod in query()] for query in queries]
@@ -0,0 +1,46 @@
+import threading
+
+import repository
+from repository import get_manager
+
+
+class UnchangedStorage:
+    def changed_on_disk(self):
+        return False
+
+
+class QuickManager:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.storage = UnchangedStorage()
+
+
+class SlowManager(QuickManager):
+    """Stands in for a manager whose data file takes a while to load."""
+
+    started = threading.Event()
+    release = threading.Event()
+    instances = 0
+
+    def __init__(self):
+        super().__init__()
+        SlowManager.instances += 1
+        SlowManager.started.set()
+        assert SlowManager.release.wait(10)
+
+
+def test_constructing_one_manager_does_not_block_the_others(monkeypatch):
+    monkeypatch.setattr(repository, "_managers", {})
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get_manager(SlowManager))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    assert SlowManager.started.wait(10)
+    try:
+        assert isinstance(get_manager(QuickManager), QuickManager)
+    finally:
+        SlowManager.release.set()
+    for thread in threads:
+        thread.join(10)
+    assert SlowManager.instances == 1
+    assert len(results) == 3 and all(manager is results[0] for manager in results)
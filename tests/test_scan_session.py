@@ -0,0 +1,64 @@
+import pytest
+
+from product import Product
+from repository import get_manager
+from scan_session import ScanSession
+
+
+@pytest.fixture
+def products(data_dir):
+    return get_manager(Product)
+
+
+def test_scans_of_a_product_add_up_to_one_movement(products):
+    session = ScanSession("receipt")
+    for product_id in (1, "1", 2, 1):
+        session.add(product_id)
+    assert len(session) == 2
+    assert session.units() == 4
+    assert session.movements() == [(1, "receipt", 3), (2, "receipt", 1)]
+
+
+def test_commit_books_the_tally_and_empties_the_session(products):
+    session = ScanSession("sale")
+    session.add(1, 2)
+    session.add(2)
+    assert session.commit(products)
+    assert len(session) == 0
+    assert products.get_product_by_id(1)["stock_quantity"] == 8
+    assert products.get_product_by_id(2)["stock_quantity"] == 24
+    assert products.ledger.balance(1) == 8
+
+
+def test_failed_commit_keeps_the_tally(products):
+    session = ScanSession("sale")
+    session.add(1)
+    session.add(3)
+    assert not session.commit(products)
+    assert session.units() == 2
+    assert products.get_product_by_id(1)["stock_quantity"] == 10
+
+
+def test_undo_takes_back_the_last_scan(products):
+    session = ScanSession("receipt")
+    session.add(1)
+    session.add(2, 3)
+    session.undo()
+    assert session.movements() == [(1, "receipt", 1)]
+    session.undo()
+    session.undo()
+    assert len(session) == 0
+
+
+def test_undo_after_scans_that_cancel_out(products):
+    session = ScanSession("adjustment")
+    session.add(1)
+    session.add(1, -1)
+    assert session.movements() == []
+    assert session.tally["1"][2] == 2
+    session.undo()
+    assert session.tally["1"] == [1, 1, 1]
+    session.undo()
+    assert len(session) == 0
+    assert session.commit(products)
+    assert products.ledger.balance(1) is None
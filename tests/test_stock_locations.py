@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import stock_locations
+from product import Product
+
+
+@pytest.fixture
+def data_file(data_dir):
+    locations = [{"location_id": "main", "name": "Main warehouse"}, {"location_id": "east", "name": "East depot"}]
+    (data_dir / "locations.json").write_text(json.dumps(locations))
+    return str(data_dir / "products.json")
+
+
+@pytest.fixture
+def terminal(data_file, monkeypatch):
+    """A manager started with INVENTORY_LOCATION=east."""
+    monkeypatch.setattr(stock_locations, "LOCAL_LOCATIONS", ["east"])
+    return Product(data_file)
+
+
+@pytest.fixture
+def office(data_file, monkeypatch):
+    """Builds a manager that loads every location, e.g. the back office's."""
+    def build():
+        monkeypatch.setattr(stock_locations, "LOCAL_LOCATIONS", [])
+        return Product(data_file)
+    return build
+
+
+def test_terminal_books_direct_edits_at_its_location(terminal, office):
+    assert terminal.locations.home == "east"
+    assert terminal.update_product(1, {"stock_quantity": 14})
+    assert terminal.get_product_by_id(1)["stock_quantity"] == 14
+    office = office()
+    assert office.stock_at("east").get("1") == 4
+    assert office.stock_at("main").get("1") == 10
+    assert office.location_totals() == {"main": 35, "east": 4}
+
+
+def test_delete_takes_the_stock_off_every_location(terminal, office):
+    terminal.record_movement(1, "receipt", 6, "east")
+    assert terminal.transfer_stock(2, 5, "main", "east")
+    assert terminal.location_totals() == {"main": 30, "east": 11}
+    assert terminal.delete_product(1)
+    assert terminal.delete_product(2)
+    office = office()
+    assert office.location_totals() == {"main": 0, "east": 0}
+    assert office.locations.ledger_total(1) == 0
+    assert office.locations.ledger_total(2) == 0
+
+
+def test_readded_product_starts_from_its_new_stock(terminal):
+    terminal.record_movement(1, "receipt", 6, "east")
+    terminal.delete_product(1)
+    assert terminal.add_product({"product_id": 1, "name": "Laptop", "category": "Electronics", "price": 1.0, "stock_quantity": 3})
+    assert terminal.get_product_by_id(1)["stock_quantity"] == 3
+    assert terminal.stock_at("east").get("1") == 3
@@ -0,0 +1,141 @@
+import json
+import os
+
+from offset_index import iter_json_array
+from stock_ledger import RECORD, StockLedger
+import storage as storage_module
+from storage import JournalStorage, SqliteStorage
+
+
+def make_journal(tmp_path, records):
+    data_file = str(tmp_path / "products.json")
+    with open(data_file, "w") as file:
+        json.dump(records, file)
+    return JournalStorage(data_file, "product_id", compact_every=100)
+
+
+def test_journal_replays_the_log_over_the_snapshot(tmp_path):
+    storage = make_journal(tmp_path, [{"product_id": 1, "name": "Laptop"}, {"product_id": 2, "name": "Desk"}])
+    storage.apply_changes(
+        [("put", "1", {"product_id": 1, "name": "Notebook"}), ("delete", "2", None), ("put", "3", {"product_id": 3, "name": "Chair"})],
+        snapshot=None,
+    )
+    replayed = JournalStorage(storage.data_file, "product_id").load()
+    assert sorted(record["name"] for record in replayed) == ["Chair", "Notebook"]
+
+
+def test_journal_compacts_into_the_snapshot(tmp_path):
+    storage = make_journal(tmp_path, [])
+    storage.compact_every = 2
+    records = [{"product_id": 1}, {"product_id": 2}]
+    storage.apply_changes([("put", "1", records[0])], lambda: records[:1])
+    assert os.path.exists(storage.log_file)
+    storage.apply_changes([("put", "2", records[1])], lambda: records)
+    assert not os.path.exists(storage.log_file)
+    assert JournalStorage(storage.data_file, "product_id").load() == records
+
+
+def test_torn_journal_tail_is_skipped_on_load_and_repaired_on_append(tmp_path):
+    storage = make_journal(tmp_path, [{"product_id": 1, "name": "Laptop"}])
+    storage.apply_changes([("put", "1", {"product_id": 1, "name": "Notebook"})], snapshot=None)
+    with open(storage.log_file, "a") as file:
+        file.write('{"op":"put","key":"2","rec')
+    size = os.path.getsize(storage.log_file)
+
+    reader = JournalStorage(storage.data_file, "product_id")
+    assert [record["name"] for record in reader.load()] == ["Notebook"]
+    # Loading never writes: the torn line may be an append still in progress
+    assert os.path.getsize(storage.log_file) == size
+
+    reader.apply_changes([("put", "2", {"product_id": 2, "name": "Desk"})], snapshot=None)
+    with open(storage.log_file) as file:
+        assert all(json.loads(line) for line in file)
+    assert sorted(record["name"] for record in JournalStorage(storage.data_file, "product_id").load()) == ["Desk", "Notebook"]
+
+
+def test_torn_ledger_record_is_ignored_until_the_next_append(tmp_path):
+    path = str(tmp_path / "products.movements.bin")
+    ledger = StockLedger(path)
+    ledger.append([("1", "receipt", 5, None)])
+    with open(path, "ab") as file:
+        file.write(b"\x00" * (RECORD.size // 2))
+
+    reader = StockLedger(path)
+    assert reader.balance("1") == 5
+    reader.append([("1", "sale", 2, None)])
+    assert os.path.getsize(path) % RECORD.size == 0
+    assert StockLedger(path).balance("1") == 3
+
+
+def test_append_racing_a_load_is_replayed_by_the_next_load(tmp_path, monkeypatch):
+    storage = make_journal(tmp_path, [{"product_id": 1, "name": "Laptop"}])
+    storage.apply_changes([("put", "1", {"product_id": 1, "name": "Notebook"})], snapshot=None)
+    writer = JournalStorage(storage.data_file, "product_id")
+    reader = JournalStorage(storage.data_file, "product_id")
+    observe = storage_module.metrics.observe
+    reads = []
+
+    def append_after_reading(name, value):
+        # Another process appends right after the reader's pass over the log
+        # (the second read it accounts for; the first is the snapshot)
+        if name == "storage.bytes_read":
+            reads.append(value)
+        if len(reads) == 2:
+            monkeypatch.setattr(storage_module.metrics, "observe", observe)
+            writer.apply_changes([("put", "2", {"product_id": 2, "name": "Desk"})], snapshot=None)
+
+    monkeypatch.setattr(storage_module.metrics, "observe", append_after_reading)
+    assert [record["name"] for record in reader.load()] == ["Notebook"]
+    assert reader.changed_on_disk()
+    assert sorted(record["name"] for record in reader.load()) == ["Desk", "Notebook"]
+
+
+def test_streamed_records_carry_their_byte_ranges(tmp_path):
+    records = [{"product_id": index, "name": f"Café crème {index}", "category": "Épicerie"} for index in range(50)]
+    path = tmp_path / "products.json"
+    path.write_text(json.dumps(records, ensure_ascii=False, indent=4), encoding="utf-8")
+    data = path.read_bytes()
+    # Small chunks split elements and multi-byte characters across refills
+    streamed = list(iter_json_array(str(path), chunk_size=7))
+    assert [record for _, _, record in streamed] == records
+    assert all(json.loads(data[offset:offset + length]) == record for offset, length, record in streamed)
+
+
+def make_sqlite(tmp_path, name, key_field, records):
+    data_file = str(tmp_path / f"{name}.json")
+    with open(data_file, "w") as file:
+        json.dump(records, file)
+    return SqliteStorage(data_file, key_field, db_file=str(tmp_path / "inventory.db"))
+
+
+def test_sqlite_write_changes_only_its_own_table(tmp_path):
+    products = make_sqlite(tmp_path, "products", "product_id", [{"product_id": 1, "name": "Laptop"}])
+    users = make_sqlite(tmp_path, "users", "user_id", [{"user_id": 1, "username": "admin"}])
+    products.load()
+    users.apply_changes([("put", "2", {"user_id": 2, "username": "clerk"})], snapshot=None)
+    assert not products.changed_on_disk()
+    other = SqliteStorage(products.data_file, "product_id", db_file=products.db_file)
+    other.apply_changes([("delete", "1", None)], snapshot=None)
+    assert products.changed_on_disk()
+
+
+def test_sqlite_query_uses_the_indexed_columns(tmp_path):
+    storage = make_sqlite(tmp_path, "products", "product_id", [
+        {"product_id": 1, "name": "Laptop", "category": "Electronics", "price": 999.99, "stock_quantity": 10},
+        {"product_id": 2, "name": "Laptop Bag", "category": "Accessories", "price": 49.0, "stock_quantity": 3},
+        {"product_id": 3, "name": "Desk", "category": "Furniture", "price": 150.0, "stock_quantity": "n/a"},
+    ])
+    storage.apply_changes([("put", "2", {"product_id": 2, "name": "CAFÉ Mug", "price": 9.5, "stock_quantity": 3})], snapshot=None)
+    assert [record["product_id"] for record in storage.query(contains={"name": "café"})] == [2]
+    assert [record["product_id"] for record in storage.query(ranges={"stock_quantity": (None, 10)}, order_by="stock_quantity")] == [2, 1]
+    assert [record["product_id"] for record in storage.query(contains={"category": "E"}, ranges={"price": (100, None)})] == [1, 3]
+
+
+def test_sqlite_fills_the_columns_of_an_older_database(tmp_path):
+    import sqlite3
+
+    with sqlite3.connect(str(tmp_path / "inventory.db")) as connection:
+        connection.execute("CREATE TABLE products (key TEXT PRIMARY KEY, position INTEGER NOT NULL, data TEXT NOT NULL)")
+        connection.execute("INSERT INTO products VALUES ('1', 0, ?)", (json.dumps({"product_id": 1, "name": "Laptop"}),))
+    storage = make_sqlite(tmp_path, "products", "product_id", [])
+    assert [record["name"] for record in storage.query(contains={"name": "lap"})] == ["Laptop"]